@@ -44,6 +44,33 @@ def main(arguments):
     )
     daemon_parser.add_argument("targets", nargs="*")
     daemon_parser.add_argument("--read-delay", default=1000, type=int)
+    daemon_parser.add_argument(
+        "--settle-time",
+        default=2,
+        type=float,
+        help="Seconds a file must go unchanged before it is synced",
+    )
+    daemon_parser.add_argument(
+        "--write-timeout",
+        default=300,
+        type=float,
+        help=(
+            "Seconds a file which is still open for writing must go unchanged "
+            "before it is synced anyway"
+        ),
+    )
+    daemon_parser.add_argument(
+        "--flush-interval",
+        default=10,
+        type=int,
+        help="Seconds to wait before writing the indexes after a change",
+    )
+    daemon_parser.add_argument(
+        "--refresh-interval",
+        default=300,
+        type=int,
+        help="Seconds between full syncs which pick up changes made elsewhere",
+    )
     daemon_parser.add_argument(
         "--conflicts", default="ignore", choices=["1", "2", "ignore"]
     )
@@ -63,6 +90,19 @@ def main(arguments):
     sync_parser.add_argument("targets", nargs="*")
     sync_parser.add_argument("--conflicts", default=None, choices=["1", "2", "ignore"])
     sync_parser.add_argument("--dry-run", action="store_true")
+    sync_parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="Number of concurrent transfers (defaults to the target's jobs setting or 1)",
+    )
+    sync_parser.add_argument(
+        "--parallel-targets",
+        type=int,
+        default=1,
+        help="Number of targets to synchronise at the same time",
+    )
 
     edit_parser = subparsers.add_parser(
         "edit", help="Edit Target details", aliases=["e"]
@@ -82,6 +122,7 @@ def main(arguments):
     ls_parser.add_argument(
         "--all", "-A", dest="show_all", action="store_true", help="show deleted files"
     )
+    ls_parser.add_argument("--prefix", "-p", help="only show keys starting with prefix")
 
     remove_parser = subparsers.add_parser("rm", help="Remove a Target")
     remove_parser.add_argument("target")
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import heapq
+import itertools
+import threading
 
 
 class SyncState(object):
@@ -53,6 +56,26 @@ class SyncObject(object):
         return "SyncObject<{}, {}, {}>".format(self.fp, self.total_size, self.timestamp)
 
 
+def _tag(iterable, index):
+    for key, value in iterable:
+        yield key, index, value
+
+
+def merge_sorted(*iterables):
+    """
+    Merge-join iterables of (key, value) pairs which are each sorted by key.
+    Yields (key, values) in key order, where values holds one item per iterable
+    which is None if that iterable had no entry for the key.
+    """
+    tagged = [_tag(iterable, index) for index, iterable in enumerate(iterables)]
+    merged = heapq.merge(*tagged, key=lambda item: (item[0], item[1]))
+    for key, group in itertools.groupby(merged, key=lambda item: item[0]):
+        values = [None] * len(iterables)
+        for _, index, value in group:
+            values[index] = value
+        yield key, values
+
+
 def get_sync_state(index_local, real_local, remote):
     # convert to int because not all clients support float precision
     index_local = int(index_local) if index_local is not None else None
@@ -78,6 +101,14 @@ def get_sync_state(index_local, real_local, remote):
 
 
 class SyncClient(object):
+    # whether deleting many keys with delete_many is cheaper than deleting them
+    # one at a time, in which case the sync collects deletions into batches
+    BATCH_DELETES = False
+
+    def __init__(self):
+        # guards mutations of the index when resolutions are run concurrently
+        self.index_lock = threading.RLock()
+
     def get_client_name(self):
         """
         Return a human readable name for the client.
@@ -122,6 +153,26 @@ class SyncClient(object):
         """
         raise NotImplementedError()
 
+    def delete_many(self, keys):
+        """
+        Delete all the given keys from client storage. Returns a dict of the keys
+        which could not be deleted mapped to the reason why.
+        """
+        errors = {}
+        for key in keys:
+            try:
+                self.delete(key)
+            except Exception as e:
+                errors[key] = e
+        return errors
+
+    def move(self, source_key, key):
+        """
+        Move the object stored under source_key to key without transferring
+        its contents through this machine.
+        """
+        raise NotImplementedError()
+
     def get_size(self, key):
         """
         Get the size of the file on the given client.
@@ -136,12 +187,46 @@ class SyncClient(object):
         """
         raise NotImplementedError()
 
+    def iter_local_keys(self, prefix):
+        """
+        Yield the keys on the client's local storage which start with prefix, if
+        they can be found without listing everything. Clients which cannot do
+        that yield nothing, so only the keys in their index are considered.
+        """
+        return iter(())
+
+    def is_ignored(self, key):
+        """
+        Return True if key is excluded from syncing by the client's ignore rules.
+        """
+        return False
+
+    def invalidate_listing(self, key=None):
+        """
+        Drop anything the client has cached about the contents of its storage for
+        the given key (or for all keys if no key is given). Clients which do not
+        cache their listing do not need to do anything.
+        """
+
     def get_real_local_timestamp(self, key):
         raise NotImplementedError()
 
     def get_index_keys(self):
         raise NotImplementedError()
 
+    def get_content_hash(self, key):
+        """
+        Return a hash of the current contents of key, or None if the client
+        does not keep track of content hashes.
+        """
+        return None
+
+    def get_index_content_hash(self, key):
+        """
+        Return the content hash of key stored in the index when it was last synced.
+        """
+        return self.index.get(key, {}).get("content_hash")
+
     def get_index_local_timestamp(self, key):
         raise NotImplementedError()
 
@@ -163,6 +248,34 @@ class SyncClient(object):
     def get_all_real_local_timestamps(self):
         raise NotImplementedError()
 
+    def iter_real_local_timestamps(self):
+        """
+        Yield (key, timestamp) for every file on the client's local storage, sorted by key.
+        """
+        return iter(sorted(self.get_all_real_local_timestamps().items()))
+
+    def iter_index(self):
+        """
+        Yield (key, entry) for every key in the index, sorted by key.
+        """
+        with self.index_lock:
+            iter_items = getattr(self.index, "iter_items", None)
+            if iter_items is not None:
+                # indexes which keep their entries sorted do not need sorting again
+                items = iter_items()
+            else:
+                keys = sorted(self.index)
+                items = None
+
+        if items is not None:
+            yield from items
+            return
+
+        for key in keys:
+            entry = self.index.get(key)
+            if entry is not None:
+                yield key, entry
+
     def get_all_keys(self):
         local_keys = self.get_local_keys()
         index_keys = self.get_index_keys()
@@ -180,14 +293,24 @@ class SyncClient(object):
         self.index = index
 
     def update_index_entry(self, key):
-        self.index[key] = {
-            "remote_timestamp": self.get_remote_timestamp(key),
-            "local_timestamp": self.get_real_local_timestamp(key),
-        }
+        remote_timestamp = self.get_remote_timestamp(key)
+        local_timestamp = self.get_real_local_timestamp(key)
+        with self.index_lock:
+            self.index[key] = {
+                "remote_timestamp": remote_timestamp,
+                "local_timestamp": local_timestamp,
+            }
 
     def flush_index(self):
         raise NotImplementedError()
 
+    def resolve_deferred_index_entries(self):
+        """
+        Complete the index entries which were left unfinished when they were
+        updated. This happens when the index is flushed, so it only needs to be
+        called when the index is used again before then.
+        """
+
     def get_action(self, key):
         """
         returns the action to perform on this key based on its
@@ -200,21 +323,22 @@ class SyncClient(object):
             index_local_timestamp, real_local_timestamp, remote_timestamp
         )
 
-    def get_all_actions(self):
-        real_local_timestamps = self.get_all_real_local_timestamps()
-        index_local_timestamps = self.get_all_index_local_timestamps()
-        remote_timestamps = self.get_all_remote_timestamps()
-
-        keys = set(real_local_timestamps) | set(index_local_timestamps)
-
-        results = {}
-        for key in keys:
-            index_local_timestamp = index_local_timestamps.get(key)
-            real_local_timestamp = real_local_timestamps.get(key)
-            remote_timestamp = remote_timestamps.get(key)
-
-            results[key] = get_sync_state(
-                index_local_timestamp, real_local_timestamp, remote_timestamp
+    def iter_actions(self):
+        """
+        Yield (key, SyncState) for every key known to the client, sorted by key.
+        This is a merge-join over the sorted local listing and the index, so only
+        a single key is being looked at any point in time.
+        """
+        local_timestamps = self.iter_real_local_timestamps()
+        for key, (real_local_timestamp, entry) in merge_sorted(
+            local_timestamps, self.iter_index()
+        ):
+            entry = entry or {}
+            yield key, get_sync_state(
+                entry.get("local_timestamp"),
+                real_local_timestamp,
+                entry.get("remote_timestamp"),
             )
 
-        return results
+    def get_all_actions(self):
+        return dict(self.iter_actions())
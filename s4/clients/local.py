@@ -1,54 +1,257 @@
 # -*- coding: utf-8 -*-
 
+import collections
+import concurrent.futures
 import gzip
+import hashlib
+import io
+import itertools
 import json
 import logging
 import os
 import shutil
 import tempfile
+import threading
 from os import scandir
 
 import filelock
-import magic
 import pathspec
 
 from s4.clients import SyncClient, SyncObject
+from s4.index import (
+    INDEX_IGNORE_PATTERNS,
+    TEMP_FILE_PREFIX,
+    OverlayIndex,
+    iter_sorted_items,
+    write_json_index,
+)
+from s4.index.binary import BinaryIndex, is_binary_index, write_binary_index
+from s4.index.compact import compact_index
+from s4.index.encoding import detect_codec, encode_index, loads_index, parse_codec
+from s4.index.journal import IndexJournal, replay_journal
+from s4.index.sharded import (
+    MANIFEST_FILE_NAME,
+    SHARD_DIRECTORY,
+    ShardedIndex,
+    decode_manifest,
+    decode_shard,
+    encode_manifest,
+    encode_shard,
+    get_shard_file_name,
+)
+from s4.index.sqlite import SQLiteIndex
 
 logger = logging.getLogger(__name__)
 
 
-def get_local_client(target):
-    return LocalSyncClient(target)
+def get_local_client(
+    target, scan_workers=None, content_hash=False, index_format=None, index_codec=None
+):
+    return LocalSyncClient(
+        target,
+        scan_workers=scan_workers,
+        content_hash=content_hash,
+        index_format=index_format,
+        index_codec=index_codec,
+    )
 
 
-def traverse(path, ignore_files=None):
+LocalEntry = collections.namedtuple("LocalEntry", ["key", "timestamp", "size", "inode"])
+
+
+def compile_ignore_spec(ignore_files):
+    return pathspec.PathSpec.from_lines(
+        pathspec.patterns.GitWildMatchPattern, ignore_files
+    )
+
+
+def _sort_key(item):
+    # directories are compared with their trailing separator so that the
+    # generated keys come out in the same order as a plain sort of the keys
+    return item.name + "/" if item.is_dir() else item.name
+
+
+def _list_dir(path):
+    try:
+        return sorted(scandir(path), key=_sort_key)
+    except FileNotFoundError:
+        # removed while we were scanning
+        return []
+
+
+def _is_ignored(spec, item):
+    if spec.match_file(item.path):
+        return True
+    # patterns such as "build/" only match directories with a trailing separator
+    return item.is_dir() and spec.match_file(item.path + "/")
+
+
+def _read_dir(path):
+    # stat every entry here so that, when running on a worker thread, all the
+    # round trips to the filesystem happen off the main thread
+    entries = _list_dir(path)
+    for item in entries:
+        try:
+            item.stat()
+        except FileNotFoundError:
+            pass
+    return entries
+
+
+class _PrefetchingLister(object):
+    """
+    Lists directories on a thread pool ahead of the walk. The directories still
+    to be walked are kept in the order the walk will reach them, and the first
+    max_pending of them are always being listed, so that their listings are
+    ready by the time the walk gets there. The walk itself stays on the calling
+    thread, so the order of the results is unaffected.
+    """
+
+    def __init__(self, executor, ignore_spec, max_pending):
+        self.executor = executor
+        self.ignore_spec = ignore_spec
+        self.max_pending = max_pending
+        # paths of the directories the walk has not reached yet, in walk order
+        self.queue = collections.deque()
+        # path => future of the listings submitted to the pool
+        self.pending = {}
+
+    def __call__(self, path):
+        if self.queue and self.queue[0] == path:
+            self.queue.popleft()
+        future = self.pending.pop(path, None)
+        if future is not None:
+            entries = future.result()
+        else:
+            entries = _read_dir(path)
+
+        # the walk descends into these before carrying on with the directories
+        # already queued up
+        self.queue.extendleft(
+            reversed(
+                [
+                    item.path
+                    for item in entries
+                    if item.is_dir() and not _is_ignored(self.ignore_spec, item)
+                ]
+            )
+        )
+        self._top_up()
+        return entries
+
+    def _top_up(self):
+        window = list(itertools.islice(self.queue, self.max_pending))
+        for directory in window:
+            if directory not in self.pending:
+                self.pending[directory] = self.executor.submit(_read_dir, directory)
+
+        # listings which were overtaken by directories the walk reaches first are
+        # dropped for now, unless they already started, and submitted again later
+        if len(self.pending) > self.max_pending:
+            window = set(window)
+            for directory, future in list(self.pending.items()):
+                if directory not in window and future.cancel():
+                    del self.pending[directory]
+
+
+def scan(path, ignore_spec=None, workers=None):
+    """
+    Yield a LocalEntry for every file under path which is not ignored, sorted
+    in lexicographic order of its key. Ignored directories are never descended
+    into and the stat information comes straight from scandir.
+
+    If workers is greater than 1, directories are listed ahead of time on a
+    pool of that many threads. This helps on filesystems where every scandir
+    and stat is a network round trip (such as NFS or CIFS mounts).
+    """
     if not os.path.exists(path):
         return
-    if ignore_files is None:
-        ignore_files = []
+    if ignore_spec is None:
+        ignore_spec = compile_ignore_spec([])
+
+    if workers is not None and workers > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            lister = _PrefetchingLister(executor, ignore_spec, max_pending=workers * 16)
+            yield from _walk(path, ignore_spec, lister)
+    else:
+        yield from _walk(path, ignore_spec, _list_dir)
+
+
+def _walk(path, ignore_spec, list_dir):
+    # one sorted directory listing per level of the tree currently being walked
+    stack = [iter(list_dir(path))]
+    prefixes = [""]
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+            prefixes.pop()
+            continue
 
-    for item in scandir(path):
-        full_path = os.path.join(path, item.name)
-        spec = pathspec.PathSpec.from_lines(
-            pathspec.patterns.GitWildMatchPattern, ignore_files
-        )
-        if spec.match_file(full_path):
+        if _is_ignored(ignore_spec, item):
             logger.debug("Ignoring %s", item)
             continue
 
+        key = prefixes[-1] + item.name
         if item.is_dir():
-            for result in traverse(item.path, ignore_files):
-                yield os.path.join(item.name, result)
-        else:
-            yield item.name
+            stack.append(iter(list_dir(item.path)))
+            prefixes.append(key + "/")
+            continue
+
+        try:
+            stat = item.stat()
+        except FileNotFoundError:
+            logger.debug("%s was removed while scanning", item)
+            continue
+        yield LocalEntry(key, stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+def traverse(path, ignore_files=None):
+    """
+    Yield the relative path of every file under path which is not ignored,
+    sorted in lexicographic order.
+    """
+    ignore_spec = compile_ignore_spec(ignore_files or [])
+    for entry in scan(path, ignore_spec):
+        yield entry.key
 
 
 class LocalSyncClient(SyncClient):
-    DEFAULT_IGNORE_FILES = [".index", ".s4lock"]
+    DEFAULT_IGNORE_FILES = INDEX_IGNORE_PATTERNS + [".s4lock", ".s4hashes"]
     LOCK_FILE_NAME = ".s4lock"
-
-    def __init__(self, path):
+    HASH_CACHE_FILE_NAME = ".s4hashes"
+    SQLITE_INDEX_FILE_NAME = ".index.sqlite"
+    JOURNAL_FILE_NAME = ".index.journal"
+    INDEX_FORMATS = ("binary", "json", "sqlite", "sharded")
+    # the journal is compacted into the index once it is larger than this and
+    # larger than the index itself
+    COMPACT_JOURNAL_SIZE = 1024 * 1024
+
+    def __init__(
+        self,
+        path,
+        scan_workers=None,
+        content_hash=False,
+        index_format=None,
+        index_codec=None,
+    ):
+        super().__init__()
         self.path = path
+        self.scan_workers = scan_workers
+        self.content_hash = content_hash
+        # the format the index is written in. Indexes in any format can be read.
+        self.index_format = index_format or "binary"
+        if self.index_format not in self.INDEX_FORMATS:
+            raise ValueError("Unknown index format", index_format)
+        # the codec compressed JSON indexes and shards are written with
+        self.index_codec = index_codec or "gzip"
+        parse_codec(self.index_codec)
+        # key => [inode, size, mtime, md5] of the last time the file was hashed
+        self._hash_cache = None
+        self._hash_cache_lock = threading.Lock()
+        # whether the hash cache changed since it was last written
+        self._hash_cache_dirty = False
+        self._journal = None
         self.reload_index()
         self.reload_ignore_files()
         self._lock = filelock.FileLock(self.lock_file)
@@ -59,8 +262,8 @@ class LocalSyncClient(SyncClient):
 
     def ensure_path(self, path):
         parent = os.path.dirname(path)
-        if not os.path.exists(parent):
-            os.makedirs(parent)
+        # concurrent transfers may race to create the same parent directory
+        os.makedirs(parent, exist_ok=True)
 
     def lock(self, timeout=10):
         """
@@ -97,18 +300,33 @@ class LocalSyncClient(SyncClient):
     def index_path(self):
         return os.path.join(self.path, ".index")
 
+    def sqlite_index_path(self):
+        return os.path.join(self.path, self.SQLITE_INDEX_FILE_NAME)
+
+    def journal_path(self):
+        return os.path.join(self.path, self.JOURNAL_FILE_NAME)
+
+    def manifest_path(self):
+        return os.path.join(self.path, MANIFEST_FILE_NAME)
+
+    def shard_path(self, name):
+        return os.path.join(self.path, SHARD_DIRECTORY, get_shard_file_name(name))
+
     def put(self, key, sync_object, callback=None):
         path = os.path.join(self.path, key)
         self.ensure_path(path)
 
         BUFFER_SIZE = 4096
         fd, temp_path = tempfile.mkstemp()
+        md5 = hashlib.md5() if self.content_hash else None
 
         try:
             with open(temp_path, "wb") as fp_1:
                 while True:
                     data = sync_object.fp.read(BUFFER_SIZE)
                     fp_1.write(data)
+                    if md5 is not None:
+                        md5.update(data)
                     if callback is not None:
                         callback(len(data))
                     if len(data) < BUFFER_SIZE:
@@ -120,6 +338,10 @@ class LocalSyncClient(SyncClient):
         finally:
             os.close(fd)
 
+        if md5 is not None:
+            # saves reading the file back in when it is indexed
+            self._cache_content_hash(key, os.stat(path), md5.hexdigest())
+
         self.set_remote_timestamp(key, sync_object.timestamp)
 
     def get(self, key):
@@ -139,50 +361,421 @@ class LocalSyncClient(SyncClient):
         else:
             return False
 
+    def move(self, source_key, key):
+        path = self.get_uri(key)
+        self.ensure_path(path)
+        os.rename(self.get_uri(source_key), path)
+
+        # the inode and timestamp are unchanged, so the cached hash is still valid
+        with self._hash_cache_lock:
+            if self._hash_cache is not None and source_key in self._hash_cache:
+                self._hash_cache[key] = self._hash_cache.pop(source_key)
+                self._hash_cache_dirty = True
+
+    @property
+    def index(self):
+        return self._index
+
+    @index.setter
+    def index(self, value):
+        # an index replaced as a whole is not in the journal, so the next flush
+        # needs to write all of it
+        self._index = value
+        self._stored_format = None
+
     def reload_index(self):
-        self.index = self._load_index()
+        with self.index_lock:
+            self._close_journal()
+            self._index, self._stored_format = self._load_index()
 
     def _load_index(self):
+        """
+        Return the index along with the format it is currently stored in.
+        """
+        if self.index_format == "sqlite":
+            return self._load_sqlite_index(), "sqlite"
+
+        index, stored_format = self._read_stored_index()
+        count = replay_journal(self.journal_path(), index)
+        if count:
+            logger.debug("Replayed %d index changes from the journal", count)
+        return index, stored_format
+
+    def _read_stored_index(self):
+        if os.path.exists(self.index_path()):
+            return self._read_index_file()
+
+        if os.path.exists(self.manifest_path()):
+            logger.debug("Reading sharded index")
+            with open(self.manifest_path(), "rb") as fp:
+                counts = decode_manifest(fp.read())
+            return ShardedIndex(self._read_shard, counts), "sharded"
+
+        if os.path.exists(self.sqlite_index_path()):
+            # switching away from sqlite, the database is removed when flushing
+            logger.debug("Reading index from %s", self.sqlite_index_path())
+            index = SQLiteIndex(self.sqlite_index_path())
+            try:
+                return dict(index.iter_items()), "sqlite"
+            finally:
+                index.close()
+        return {}, None
+
+    def _read_index_file(self):
         index_path = self.index_path()
-        if not os.path.exists(index_path):
+        with open(index_path, "rb") as fp:
+            header = fp.read(len(b"S4IX"))
+        if is_binary_index(header):
+            logger.debug("Detected binary encoding for reading index")
+            return OverlayIndex(BinaryIndex(index_path)), "binary"
+
+        with open(index_path, "rb") as fp:
+            body = fp.read()
+        codec, _ = detect_codec(body)
+        logger.debug("Detected %s encoding for reading index", codec)
+        return compact_index(loads_index(body)), "json"
+
+    def _read_shard(self, name):
+        try:
+            with open(self.shard_path(name), "rb") as fp:
+                return decode_shard(fp.read())
+        except FileNotFoundError:
             return {}
 
-        content_type = magic.from_file(index_path, mime=True)
-        if content_type in ("application/json", "text/plain"):
-            logger.debug("Detected %s encoding for reading index", content_type)
-            method = open
-        elif content_type in ("application/gzip", "application/x-gzip"):
-            logger.debug("Detected gzip encoding for reading index")
-            method = gzip.open
-        else:
-            raise ValueError("Index is of unknown type", content_type)
+    def _load_sqlite_index(self):
+        logger.debug("Using sqlite index %s", self.sqlite_index_path())
+        migrate = not os.path.exists(self.sqlite_index_path())
+        index = SQLiteIndex(self.sqlite_index_path())
+        if migrate:
+            data, stored_format = self._read_stored_index()
+            if stored_format is not None:
+                logger.info("Migrating %s index to sqlite", stored_format)
+                replay_journal(self.journal_path(), data)
+                index.replace(iter_sorted_items(data))
+                self._remove_other_indexes()
+                self._remove_journal()
+        return index
+
+    def _remove_other_indexes(self):
+        """
+        Remove the files of indexes stored in any format but the current one.
+        """
+        if self.index_format not in ("binary", "json"):
+            try:
+                os.remove(self.index_path())
+            except FileNotFoundError:
+                pass
+        if self.index_format != "sharded":
+            shutil.rmtree(os.path.join(self.path, SHARD_DIRECTORY), ignore_errors=True)
+            try:
+                os.remove(self.manifest_path())
+            except FileNotFoundError:
+                pass
+        if self.index_format != "sqlite":
+            self._remove_sqlite_index()
+
+    def _set_index_entry(self, key, entry):
+        with self.index_lock:
+            self._index[key] = entry
+            # every change to a sqlite index is already written to disk
+            if self.index_format != "sqlite":
+                if self._journal is None:
+                    self._journal = IndexJournal(self.journal_path())
+                self._journal.append(key, entry)
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _remove_journal(self):
+        self._close_journal()
+        try:
+            os.remove(self.journal_path())
+        except FileNotFoundError:
+            pass
+
+    def _journal_size(self):
+        if self._journal is not None:
+            return self._journal.size()
+        try:
+            return os.path.getsize(self.journal_path())
+        except FileNotFoundError:
+            return 0
+
+    def _remove_sqlite_index(self):
+        # the write ahead log and shared memory files are left next to it
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self.sqlite_index_path() + suffix)
+            except FileNotFoundError:
+                pass
+
+    def hash_cache_path(self):
+        return os.path.join(self.path, self.HASH_CACHE_FILE_NAME)
+
+    def _load_hash_cache(self):
+        path = self.hash_cache_path()
+        if not os.path.exists(path):
+            return {}
+        try:
+            with gzip.open(path, "rt") as fp:
+                return json.load(fp)
+        except (OSError, ValueError) as e:
+            # only a cache, so it can be rebuilt from scratch
+            logger.warning("Unable to read %s: %s", path, e)
+            return {}
+
+    def _cache_content_hash(self, key, stat, content_hash):
+        with self._hash_cache_lock:
+            if self._hash_cache is None:
+                self._hash_cache = self._load_hash_cache()
+            self._hash_cache[key] = [
+                stat.st_ino,
+                stat.st_size,
+                stat.st_mtime,
+                content_hash,
+            ]
+            self._hash_cache_dirty = True
+
+    def get_content_hash(self, key):
+        if not self.content_hash:
+            return None
+
+        path = self.get_uri(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            # forget the hashes of deleted files
+            with self._hash_cache_lock:
+                if self._hash_cache is not None and key in self._hash_cache:
+                    del self._hash_cache[key]
+                    self._hash_cache_dirty = True
+            return None
+
+        with self._hash_cache_lock:
+            if self._hash_cache is None:
+                self._hash_cache = self._load_hash_cache()
+            cached = self._hash_cache.get(key)
+
+        if cached is not None and cached[:3] == [
+            stat.st_ino,
+            stat.st_size,
+            stat.st_mtime,
+        ]:
+            return cached[3]
+
+        logger.debug("Calculating content hash of %s", key)
+        md5 = hashlib.md5()
+        with open(path, "rb") as fp:
+            for data in iter(lambda: fp.read(1024 * 1024), b""):
+                md5.update(data)
+
+        content_hash = md5.hexdigest()
+        self._cache_content_hash(key, stat, content_hash)
+        return content_hash
+
+    def flush_hash_cache(self):
+        with self._hash_cache_lock:
+            if not self._hash_cache_dirty:
+                return
+            data = json.dumps(self._hash_cache)
+            self._hash_cache_dirty = False
+
+        logger.debug("Writing %s", self.hash_cache_path())
+        try:
+            self._replace_file(
+                self.hash_cache_path(), gzip.compress(data.encode("utf-8"))
+            )
+        except Exception:
+            with self._hash_cache_lock:
+                self._hash_cache_dirty = True
+            raise
 
-        with method(index_path, "rt") as fp:
-            data = json.load(fp)
-        return data
+    def update_index_entry(self, key):
+        entry = {
+            "remote_timestamp": self.get_remote_timestamp(key),
+            "local_timestamp": self.get_real_local_timestamp(key),
+        }
+        if self.content_hash:
+            entry["content_hash"] = self.get_content_hash(key)
+        self._set_index_entry(key, entry)
 
     def flush_index(self, compressed=True):
-        if compressed:
-            logger.debug("Using gzip encoding for writing index")
-            method = gzip.open
-        else:
-            logger.debug("Using plaintext encoding for writing index")
-            method = open
+        """
+        Make every change to the index durable. Changes are normally only
+        appended to the journal, which is compacted into the index when it grows
+        too large or when the index needs to be stored in another format.
+        """
+        self.flush_hash_cache()
+        if self.index_format == "sqlite":
+            self._flush_sqlite_index()
+            return
+
+        with self.index_lock:
+            if self._stored_format != self.index_format:
+                self.compact_index(compressed)
+                return
+
+            try:
+                index_size = os.path.getsize(self.index_path())
+            except FileNotFoundError:
+                index_size = 0
+            journal_size = self._journal_size()
+            if journal_size > max(self.COMPACT_JOURNAL_SIZE, index_size):
+                self.compact_index(compressed)
+            elif self._journal is not None:
+                logger.debug("Syncing index journal (%d bytes)", journal_size)
+                self._journal.sync()
+
+    def compact_index(self, compressed=True):
+        """
+        Write the complete index, including every change in the journal, and
+        start a new journal.
+        """
+        with self.index_lock:
+            # once the new index is in place, replaying the old journal on top of
+            # it changes nothing, so a crash before it is removed is harmless
+            codec = self.index_codec if compressed else "none"
+            if self.index_format == "binary":
+                self._flush_binary_index()
+            elif self.index_format == "sharded":
+                self._flush_sharded_index(codec)
+            else:
+                self._flush_json_index(codec)
+            self._remove_journal()
+            self._remove_other_indexes()
+            self._stored_format = self.index_format
+
+    def _flush_json_index(self, codec):
+        logger.debug("Using %s encoding for writing index", codec)
+        compression, level = parse_codec(codec)
 
         fd, temp_path = tempfile.mkstemp()
-        with method(temp_path, "wt") as fp:
-            json.dump(self.index, fp)
+        # plain and gzip encoded indexes are written without a header, so that
+        # other tools and older versions can still read them
+        if compression.name == "none":
+            with open(temp_path, "wt") as fp:
+                write_json_index(fp, iter_sorted_items(self.index))
+        elif compression.name == "gzip":
+            with gzip.open(temp_path, "wt", compresslevel=level) as fp:
+                write_json_index(fp, iter_sorted_items(self.index))
+        else:
+            buffer = io.StringIO()
+            write_json_index(buffer, iter_sorted_items(self.index))
+            with open(temp_path, "wb") as fp:
+                fp.write(encode_index(buffer.getvalue().encode("utf-8"), codec))
 
         os.close(fd)
 
         shutil.move(temp_path, self.index_path())
 
+    def _flush_binary_index(self):
+        logger.debug("Using binary encoding for writing index")
+        with self.index_lock:
+            # The current index may be memory mapped (here or by another process),
+            # so the new one is renamed into place rather than copied over it
+            fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=TEMP_FILE_PREFIX)
+            try:
+                with open(temp_path, "wb") as fp:
+                    write_binary_index(fp, iter_sorted_items(self.index))
+                os.replace(temp_path, self.index_path())
+            except Exception:
+                os.remove(temp_path)
+                raise
+            finally:
+                os.close(fd)
+
+            # the changes are now part of the new base index
+            self._index = OverlayIndex(BinaryIndex(self.index_path()))
+
+    def _flush_sharded_index(self, codec):
+        index = self._index
+        replaced = not isinstance(index, ShardedIndex)
+        if replaced:
+            index = ShardedIndex.from_items(iter_sorted_items(index))
+
+        shard_directory = os.path.join(self.path, SHARD_DIRECTORY)
+        os.makedirs(shard_directory, exist_ok=True)
+
+        dirty = index.get_dirty_shards()
+        logger.debug("Writing %d changed index shards", len(dirty))
+        for name, items in dirty:
+            if items is not None:
+                self._replace_file(self.shard_path(name), encode_shard(items, codec))
+            else:
+                try:
+                    os.remove(self.shard_path(name))
+                except FileNotFoundError:
+                    pass
+        index.mark_clean(name for name, _ in dirty)
+
+        if replaced:
+            # remove the shards which are not part of the new index
+            file_names = {get_shard_file_name(name) for name in index.counts}
+            for file_name in os.listdir(shard_directory):
+                if file_name not in file_names:
+                    os.remove(os.path.join(shard_directory, file_name))
+
+        self._replace_file(self.manifest_path(), encode_manifest(index.counts))
+        self._index = index
+
+    def _replace_file(self, path, data):
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix=TEMP_FILE_PREFIX
+        )
+        try:
+            with open(temp_path, "wb") as fp:
+                fp.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        finally:
+            os.close(fd)
+
+    def _flush_sqlite_index(self):
+        # changes are written to the database as they are made, so there is only
+        # something to do when the index was replaced by an in memory one
+        with self.index_lock:
+            if isinstance(self.index, SQLiteIndex):
+                return
+            logger.debug("Writing index to %s", self.sqlite_index_path())
+            index = SQLiteIndex(self.sqlite_index_path())
+            index.replace(iter_sorted_items(self.index))
+            self._index = index
+            self._stored_format = "sqlite"
+
+    def scan(self):
+        return scan(self.path, self.ignore_spec, workers=self.scan_workers)
+
     def get_local_keys(self):
-        return list(traverse(self.path, ignore_files=self.ignore_files))
+        return [entry.key for entry in self.scan()]
+
+    def iter_local_keys(self, prefix):
+        path = os.path.join(self.path, prefix)
+        if not os.path.isdir(path):
+            return
+        for entry in scan(path, self.ignore_spec, workers=self.scan_workers):
+            yield prefix + entry.key
+
+    def is_ignored(self, key):
+        # scanning never descends into ignored directories, so every parent
+        # directory of the key needs to be checked as well
+        parts = key.split("/")
+        for position in range(1, len(parts) + 1):
+            path = os.path.join(self.path, *parts[:position])
+            if self.ignore_spec.match_file(path):
+                return True
+            is_dir = position < len(parts) or os.path.isdir(path)
+            if is_dir and self.ignore_spec.match_file(path + "/"):
+                return True
+        return False
 
     def get_real_local_timestamp(self, key):
         full_path = os.path.join(self.path, key)
-        if os.path.exists(full_path):
+        # directories are not synced themselves, only the files inside them
+        if os.path.isfile(full_path):
             return os.path.getmtime(full_path)
         else:
             return None
@@ -193,11 +786,12 @@ class LocalSyncClient(SyncClient):
     def get_index_local_timestamp(self, key):
         return self.index.get(key, {}).get("local_timestamp")
 
+    def iter_real_local_timestamps(self):
+        for entry in self.scan():
+            yield entry.key, entry.timestamp
+
     def get_all_real_local_timestamps(self):
-        result = {}
-        for key in self.get_local_keys():
-            result[key] = self.get_real_local_timestamp(key)
-        return result
+        return dict(self.iter_real_local_timestamps())
 
     def get_all_remote_timestamps(self):
         return {key: value.get("remote_timestamp") for key, value in self.index.items()}
@@ -206,9 +800,10 @@ class LocalSyncClient(SyncClient):
         return {key: value.get("local_timestamp") for key, value in self.index.items()}
 
     def set_index_local_timestamp(self, key, timestamp):
-        if key not in self.index:
-            self.index[key] = {}
-        self.index[key]["local_timestamp"] = timestamp
+        with self.index_lock:
+            entry = dict(self.index.get(key, {}))
+            entry["local_timestamp"] = timestamp
+            self._set_index_entry(key, entry)
 
     def get_size(self, key):
         path = self.get_uri(key)
@@ -221,9 +816,10 @@ class LocalSyncClient(SyncClient):
         return self.index.get(key, {}).get("remote_timestamp")
 
     def set_remote_timestamp(self, key, timestamp):
-        if key not in self.index:
-            self.index[key] = {}
-        self.index[key]["remote_timestamp"] = timestamp
+        with self.index_lock:
+            entry = dict(self.index.get(key, {}))
+            entry["remote_timestamp"] = timestamp
+            self._set_index_entry(key, entry)
 
     def reload_ignore_files(self):
         ignore_path = os.path.join(self.path, ".syncignore")
@@ -235,3 +831,4 @@ class LocalSyncClient(SyncClient):
             ignore_list = []
 
         self.ignore_files = self.DEFAULT_IGNORE_FILES + ignore_list
+        self.ignore_spec = compile_ignore_spec(self.ignore_files)
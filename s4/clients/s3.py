@@ -2,37 +2,91 @@
 import collections
 import copy
 import fnmatch
-import gzip
+import itertools
 import json
 import logging
 import os
-import zlib
+import threading
+import time
+import uuid
 
 import boto3
-import magic
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 from s4 import utils
-from s4.clients import SyncClient, SyncObject
+from s4.clients import SyncClient, SyncObject, merge_sorted
+from s4.index import INDEX_IGNORE_PATTERNS, OverlayIndex, iter_sorted_items
+from s4.index.cache import IndexCache
+from s4.index.compact import compact_index
+from s4.index.encoding import detect_codec, dumps_index, loads_index, parse_codec
+from s4.index.sharded import (
+    MANIFEST_FILE_NAME,
+    SHARD_DIRECTORY,
+    ShardedIndex,
+    decode_manifest,
+    decode_shard,
+    encode_manifest,
+    encode_shard,
+    get_shard_file_name,
+)
 
 logger = logging.getLogger(__name__)
 
 
 S3Uri = collections.namedtuple("S3Uri", ["bucket", "key"])
 
+ListingEntry = collections.namedtuple("ListingEntry", ["size", "etag", "timestamp"])
 
-def get_s3_client(
-    target, aws_access_key_id, aws_secret_access_key, endpoint_url, region_name
+# the size of the default connection pool of botocore, which is enough for the
+# listings and index requests made next to a few transfers
+MIN_POOL_CONNECTIONS = 10
+
+
+def get_boto_client(
+    aws_access_key_id, aws_secret_access_key, endpoint_url, region_name, jobs=1
 ):
-    s3_uri = parse_s3_uri(target)
-    s3_client = boto3.client(
+    """
+    Create a boto client with a connection pool large enough for jobs transfers
+    running at the same time (across every target sharing the client).
+    """
+    return boto3.client(
         "s3",
         aws_access_key_id=aws_access_key_id,
         aws_secret_access_key=aws_secret_access_key,
         region_name=region_name,
         endpoint_url=endpoint_url,
+        config=Config(max_pool_connections=max(MIN_POOL_CONNECTIONS, jobs)),
+    )
+
+
+def get_s3_client(
+    target,
+    aws_access_key_id,
+    aws_secret_access_key,
+    endpoint_url,
+    region_name,
+    boto_client=None,
+    sharded_index=False,
+    index_cache_path=None,
+    index_deltas=False,
+    index_codec=None,
+    jobs=1,
+):
+    s3_uri = parse_s3_uri(target)
+    if boto_client is None:
+        boto_client = get_boto_client(
+            aws_access_key_id, aws_secret_access_key, endpoint_url, region_name, jobs
+        )
+    return S3SyncClient(
+        boto_client,
+        s3_uri.bucket,
+        s3_uri.key,
+        sharded_index=sharded_index,
+        index_cache_path=index_cache_path,
+        index_deltas=index_deltas,
+        index_codec=index_codec,
     )
-    return S3SyncClient(s3_client, s3_uri.bucket, s3_uri.key)
 
 
 def parse_s3_uri(uri):
@@ -59,15 +113,66 @@ def is_ignored_key(key, ignore_files):
 
 
 class S3SyncClient(SyncClient):
-    DEFAULT_IGNORE_FILES = [".index", ".s4lock"]
-
-    def __init__(self, boto, bucket, prefix):
+    BATCH_DELETES = True
+
+    DEFAULT_IGNORE_FILES = INDEX_IGNORE_PATTERNS + [".s4lock", ".s4hashes"]
+    # copy_object only accepts sources of up to 5 GB
+    MAX_COPY_OBJECT_SIZE = 5 * 1024**3
+    # delete_objects accepts up to 1000 keys per request
+    MAX_DELETE_OBJECTS = 1000
+    DELTA_DIRECTORY = ".index.deltas"
+    # index deltas are folded back into the index once there are this many
+    MAX_INDEX_DELTAS = 32
+
+    def __init__(
+        self,
+        boto,
+        bucket,
+        prefix,
+        sharded_index=False,
+        index_cache_path=None,
+        index_deltas=False,
+        index_codec=None,
+    ):
+        super().__init__()
         self.boto = boto
         self.bucket = bucket
         self.prefix = prefix
+        self.sharded_index = sharded_index
+        self.index_deltas = index_deltas
+        # the codec compressed index objects are written with
+        self.index_codec = index_codec or "gzip"
+        parse_codec(self.index_codec)
+        # decoded copies of the index objects, which are only downloaded again
+        # when their ETag changed
+        self.index_cache = (
+            IndexCache(index_cache_path) if index_cache_path is not None else None
+        )
         # These are lazy loaded as needed
         self._index = None
+        # the index objects found when loading the index, which are removed when
+        # flushing if the index is now stored differently
+        self._stored_shards = set()
+        self._stored_index_file = False
+        # the delta objects read with the index, in the order they were applied
+        self._stored_deltas = []
+        # the index as loaded when deltas are read or written: an overlay of the
+        # changes made since loading on top of an overlay of the deltas
+        self._delta_index = None
         self._ignore_files = None
+        self._listing = None
+        # the snapshot while it is being listed, which covers every key up to
+        # the last one listed so far
+        self._partial_listing = None
+        self._last_listed_key = None
+
+        # keys changed since the listing snapshot was taken
+        self._listing_overrides = {}
+        self._stale_keys = set()
+        self._listing_lock = threading.Lock()
+
+        # index entries whose local timestamp is filled in when flushing
+        self._deferred_keys = set()
 
     def lock(self):
         pass
@@ -87,10 +192,18 @@ class S3SyncClient(SyncClient):
     def index_path(self):
         return os.path.join(self.prefix, ".index")
 
+    def manifest_path(self):
+        return os.path.join(self.prefix, MANIFEST_FILE_NAME)
+
+    def shard_path(self, name):
+        return os.path.join(self.prefix, SHARD_DIRECTORY, get_shard_file_name(name))
+
     @property
     def index(self):
         if self._index is None:
-            self._index = self.load_index()
+            with self.index_lock:
+                if self._index is None:
+                    self._index = self.load_index()
         return self._index
 
     @index.setter
@@ -104,6 +217,7 @@ class S3SyncClient(SyncClient):
             Fileobj=sync_object.fp,
             Callback=callback,
         )
+        self.invalidate_listing(key)
         self.set_remote_timestamp(key, sync_object.timestamp)
 
     def get(self, key):
@@ -124,82 +238,537 @@ class S3SyncClient(SyncClient):
             Bucket=self.bucket,
             Delete={"Objects": [{"Key": os.path.join(self.prefix, key)}]},
         )
-        return "Deleted" in resp
+        if "Deleted" in resp:
+            self.record_listing_entry(key, None)
+            return True
+        else:
+            self.invalidate_listing(key)
+            return False
+
+    def delete_many(self, keys):
+        errors = {}
+        for start in range(0, len(keys), self.MAX_DELETE_OBJECTS):
+            batch = {
+                os.path.join(self.prefix, key): key
+                for key in keys[start : start + self.MAX_DELETE_OBJECTS]
+            }
+            # only the keys which failed are reported back in quiet mode
+            resp = self.boto.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [{"Key": s3_key} for s3_key in batch],
+                    "Quiet": True,
+                },
+            )
+            for error in resp.get("Errors", []):
+                key = batch.get(error["Key"], error["Key"])
+                errors[key] = "{}: {}".format(error.get("Code"), error.get("Message"))
+
+            for key in batch.values():
+                if key in errors:
+                    self.invalidate_listing(key)
+                else:
+                    self.record_listing_entry(key, None)
+        return errors
+
+    def move(self, source_key, key):
+        copy_source = {
+            "Bucket": self.bucket,
+            "Key": os.path.join(self.prefix, source_key),
+        }
+        entry = self.get_listing_entry(source_key)
+        if entry is not None and entry.size <= self.MAX_COPY_OBJECT_SIZE:
+            resp = self.boto.copy_object(
+                Bucket=self.bucket,
+                Key=os.path.join(self.prefix, key),
+                CopySource=copy_source,
+            )
+            result = resp["CopyObjectResult"]
+            self.record_listing_entry(
+                key,
+                ListingEntry(
+                    entry.size,
+                    result["ETag"],
+                    utils.to_timestamp(result["LastModified"]),
+                ),
+            )
+        else:
+            # larger objects need a multipart copy, which boto3 takes care of
+            self.boto.copy(copy_source, self.bucket, os.path.join(self.prefix, key))
+            self.invalidate_listing(key)
+
+        self.delete(source_key)
+
+    def _get_index_object(self, key):
+        """
+        Return the contents of an index object, or None if it does not exist.
+        """
+        try:
+            resp = self.boto.get_object(Bucket=self.bucket, Key=key)
+        except ClientError:
+            return None
+        return resp["Body"].read()
+
+    def delta_prefix(self):
+        return os.path.join(self.prefix, self.DELTA_DIRECTORY) + "/"
 
     def load_index(self):
+        """
+        Load the index along with any deltas written since it was last compacted.
+        """
+        # deltas are listed first, so that a compaction running at the same time
+        # can at worst leave deltas which are already part of the index
+        delta_keys = self._list_deltas()
+        index = self._load_base_index()
+
+        self._stored_deltas = []
+        self._delta_index = None
+        if not delta_keys and not self.index_deltas:
+            return index
+
+        deltas = OverlayIndex(index)
+        for key in delta_keys:
+            delta = self._load_cached_index_object(key, decode_shard)
+            if delta is None:
+                # removed by a compaction, so its changes are in the index
+                continue
+            logger.debug("Applying index delta %s", key)
+            deltas.changes.update(delta.items())
+            self._stored_deltas.append(key)
+
+        self._delta_index = OverlayIndex(deltas)
+        return self._delta_index
+
+    def _list_deltas(self):
+        keys = []
+        kwargs = {"Bucket": self.bucket, "Prefix": self.delta_prefix()}
+        while True:
+            resp = self.boto.list_objects_v2(**kwargs)
+            keys.extend(obj["Key"] for obj in resp.get("Contents", []))
+            if not resp.get("IsTruncated"):
+                break
+            kwargs["ContinuationToken"] = resp["NextContinuationToken"]
+        # delta names start with the time they were written at
+        return sorted(keys)
+
+    def _load_base_index(self):
+        self._stored_shards = set()
+        self._stored_index_file = False
+
+        if self.sharded_index:
+            index = self._load_sharded_index()
+            if index is not None:
+                return index
+            # the shards are written the next time the index is flushed
+            return ShardedIndex.from_items(iter_sorted_items(self._load_index_file()))
+
+        index = self._load_index_file()
+        if not self._stored_index_file:
+            # no longer sharded, the shards are removed the next time it is flushed
+            sharded_index = self._load_sharded_index()
+            if sharded_index is not None:
+                return compact_index(sharded_index)
+        return index
+
+    def _load_cached_index_object(self, key, decode):
+        """
+        Return the index object at key decoded with decode(body), or None if it
+        does not exist. If a cached copy exists, the object is only downloaded
+        when it changed since.
+        """
+        if self.index_cache is not None:
+            etag, cached = self.index_cache.get(key)
+        else:
+            etag, cached = None, None
+
+        kwargs = {"IfNoneMatch": etag} if etag is not None else {}
         try:
-            resp = self.boto.get_object(Bucket=self.bucket, Key=self.index_path())
-            body = resp["Body"].read()
-            content_type = magic.from_buffer(body, mime=True)
-
-            if content_type in ("application/json", "text/plain"):
-                logger.debug("Detected %s encoding for index", content_type)
-                return json.loads(body.decode("utf-8"))
-
-            # the magic/file command reports gzip differently depending on its version
-            elif content_type in ("application/x-gzip", "application/gzip"):
-                logger.debug("Detected gzip encoding for index")
-                body = gzip.decompress(body)
-                return json.loads(body.decode("utf-8"))
-
-            elif content_type in ("application/zlib",):
-                logger.debug("Detected zlib encoding for index")
-                body = zlib.decompress(body)
-                return json.loads(body.decode("utf-8"))
-
-            # Older versions of Ubuntu and some versions of MAC cannot
-            # do not detect the file type correctly. In this case we need
-            # to try both gzip and zlib decompression
-            elif content_type in ("application/octet-stream",):
-                logger.debug("Cannot detect encoding for index - trying all")
-                body = utils.try_decompress(body)
-                return json.loads(body.decode("utf-8"))
-
-            elif content_type == "application/x-empty":
-                return {}
-            else:
-                raise ValueError("Unknown content type for index", content_type)
-        except (ClientError):
+            resp = self.boto.get_object(Bucket=self.bucket, Key=key, **kwargs)
+        except ClientError as e:
+            if cached is not None and e.response["Error"]["Code"] == "304":
+                logger.debug("Using cached copy of %s", key)
+                return cached
+            if self.index_cache is not None:
+                self.index_cache.remove(key)
+            return None
+
+        index = decode(resp["Body"].read())
+        if self.index_cache is not None:
+            self.index_cache.put(key, resp["ETag"], iter_sorted_items(index))
+        return index
+
+    def _put_index_object(self, key, data, items):
+        """
+        Write data to the index object at key. items are the (key, entry) items
+        it holds, sorted by key, which are cached so that what was just written
+        does not need to be downloaded again.
+        """
+        resp = self.boto.put_object(Bucket=self.bucket, Key=key, Body=data)
+        if self.index_cache is not None:
+            self.index_cache.put(key, resp["ETag"], items)
+
+    def _delete_index_objects(self, keys):
+        for start in range(0, len(keys), self.MAX_DELETE_OBJECTS):
+            self.boto.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [
+                        {"Key": key}
+                        for key in keys[start : start + self.MAX_DELETE_OBJECTS]
+                    ],
+                    "Quiet": True,
+                },
+            )
+        if self.index_cache is not None:
+            for key in keys:
+                self.index_cache.remove(key)
+
+    def _load_index_file(self):
+        index = self._load_cached_index_object(self.index_path(), self._decode_index)
+        if index is None:
             return {}
+        self._stored_index_file = True
+        return index
+
+    def _load_sharded_index(self):
+        manifest = self._get_index_object(self.manifest_path())
+        if manifest is None:
+            return None
+        counts = decode_manifest(manifest)
+        self._stored_shards = set(counts)
+        return ShardedIndex(self._read_shard, counts)
+
+    def _read_shard(self, name):
+        shard = self._load_cached_index_object(self.shard_path(name), decode_shard)
+        return shard if shard is not None else {}
+
+    def _decode_index(self, body):
+        codec, _ = detect_codec(body)
+        logger.debug("Detected %s encoding for index", codec)
+        return compact_index(loads_index(body))
 
     def reload_index(self):
         self.index = self.load_index()
 
+    def update_index_entry(self, key):
+        # Uploads do not return LastModified, so rather than sending a head_object
+        # for every key that was just written, the local timestamp is filled in
+        # for all of them at once when the index is flushed.
+        with self._listing_lock:
+            deferred = key in self._stale_keys
+            if deferred:
+                self._deferred_keys.add(key)
+
+        if not deferred:
+            super().update_index_entry(key)
+            return
+
+        remote_timestamp = self.get_remote_timestamp(key)
+        with self.index_lock:
+            self.index[key] = {
+                "remote_timestamp": remote_timestamp,
+                "local_timestamp": None,
+            }
+
+    def resolve_deferred_index_entries(self):
+        """
+        Fill in the local timestamps of index entries whose metadata was not
+        known when they were updated. When there are more such keys than there
+        would be requests to list the whole prefix, the prefix is listed again.
+        Otherwise (or for keys missing from the new listing) head_object is used.
+        """
+        with self._listing_lock:
+            keys = sorted(self._deferred_keys)
+            self._deferred_keys = set()
+            listing_size = len(self._listing) if self._listing is not None else None
+
+        if not keys:
+            return
+
+        # a listing request returns up to 1000 keys
+        if listing_size is not None and len(keys) > listing_size // 1000 + 1:
+            logger.debug("Listing %s again for %s new keys", self.get_uri(), len(keys))
+            self.invalidate_listing()
+            for _ in self._iter_snapshot():
+                pass
+            for key in keys:
+                if key not in self._listing:
+                    self.invalidate_listing(key)
+
+        for key in keys:
+            timestamp = self.get_real_local_timestamp(key)
+            with self.index_lock:
+                if key in self.index:
+                    entry = dict(self.index[key])
+                    entry["local_timestamp"] = timestamp
+                    self.index[key] = entry
+
     def flush_index(self, compressed=True):
-        data = json.dumps(self.index).encode("utf-8")
-        if compressed:
-            logger.debug("Using gzip encoding for writing index")
-            data = gzip.compress(data)
+        """
+        Write the changes made to the index. When using deltas, they are written
+        as a new delta unless there are too many deltas already, in which case
+        they are compacted into the index along with every other delta.
+        """
+        self.resolve_deferred_index_entries()
+        codec = self.index_codec if compressed else "none"
+        with self.index_lock:
+            if (
+                self.index_deltas
+                and self.index is self._delta_index
+                and len(self._stored_deltas) + 1 < self.MAX_INDEX_DELTAS
+            ):
+                self._flush_index_delta(codec)
+                return
+
+            self._fold_index_deltas()
+            self._flush_base_index(codec)
+
+            if self._stored_deltas:
+                logger.debug("Compacted %d index deltas", len(self._stored_deltas))
+                self._delete_index_objects(self._stored_deltas)
+                self._stored_deltas = []
+
+            if self.index_deltas:
+                self._delta_index = OverlayIndex(OverlayIndex(self._index))
+                self._index = self._delta_index
+
+    def _flush_index_delta(self, codec):
+        changes = self._delta_index.changes
+        if not changes:
+            logger.debug("No index changes to write")
+            return
+
+        # deltas are encoded like shards, with None for removed entries
+        items = sorted(changes.items())
+        key = os.path.join(
+            self.delta_prefix(),
+            "{:020d}-{}".format(int(time.time() * 1000000), uuid.uuid4().hex),
+        )
+        logger.debug("Writing index delta %s with %d changes", key, len(items))
+        self._put_index_object(key, encode_shard(items, codec), items)
+
+        self._stored_deltas.append(key)
+        self._delta_index.base.changes.update(changes)
+        self._delta_index.changes = {}
+
+    def _fold_index_deltas(self):
+        """
+        Apply the changes of the deltas, and the changes made since the index
+        was loaded, to the index they were loaded on top of.
+        """
+        if self._delta_index is None or self._index is not self._delta_index:
+            return
+
+        deltas = self._delta_index.base
+        index = deltas.base
+        for key, entry in itertools.chain(
+            deltas.changes.items(), self._delta_index.changes.items()
+        ):
+            if entry is not None:
+                index[key] = entry
+            elif key in index:
+                del index[key]
+        self._index = index
+        self._delta_index = None
+
+    def _flush_base_index(self, codec):
+        if self.sharded_index:
+            self._flush_sharded_index(codec)
+            return
+
+        index = self.index
+        logger.debug("Using %s encoding for writing index", codec)
+        compression, level = parse_codec(codec)
+        # plain and gzip encoded indexes are written without a header, so that
+        # older versions on other hosts can still read them
+        if compression.name in ("none", "gzip"):
+            body = json.dumps(dict(index.items())).encode("utf-8")
+            data = compression.compress(body, level)
         else:
-            logger.debug("Using plain text encoding for writing index")
+            data = dumps_index(dict(index.items()), codec)
 
-        self.boto.put_object(Bucket=self.bucket, Key=self.index_path(), Body=data)
+        self._put_index_object(self.index_path(), data, iter_sorted_items(index))
+        self._stored_index_file = True
 
-    def get_local_keys(self):
-        results = []
+        if self._stored_shards:
+            self._delete_index_objects(
+                [self.shard_path(name) for name in sorted(self._stored_shards)]
+                + [self.manifest_path()]
+            )
+            self._stored_shards = set()
+
+    def _flush_sharded_index(self, codec):
+        with self.index_lock:
+            index = self.index
+            if not isinstance(index, ShardedIndex):
+                # replaced as a whole, so every shard is written again
+                index = ShardedIndex.from_items(iter_sorted_items(index))
+                self.index = index
+
+            dirty = index.get_dirty_shards()
+            logger.debug("Writing %d changed index shards", len(dirty))
+            for name, items in dirty:
+                if items is not None:
+                    self._put_index_object(
+                        self.shard_path(name), encode_shard(items, codec), items
+                    )
+            index.mark_clean(name for name, _ in dirty)
+
+            # shards which are now empty, or which are not part of a replaced index
+            removed = self._stored_shards - set(index.counts)
+            if removed:
+                self._delete_index_objects(
+                    [self.shard_path(name) for name in sorted(removed)]
+                )
+            if dirty or removed or not self._stored_shards:
+                self.boto.put_object(
+                    Bucket=self.bucket,
+                    Key=self.manifest_path(),
+                    Body=encode_manifest(index.counts),
+                )
+            self._stored_shards = set(index.counts)
+
+            if self._stored_index_file:
+                self._delete_index_objects([self.index_path()])
+                self._stored_index_file = False
+
+    def invalidate_listing(self, key=None):
+        """
+        Mark key as changed so that it is fetched again the next time it is needed.
+        If no key is given, the whole listing snapshot is dropped.
+        """
+        with self._listing_lock:
+            if key is None:
+                self._listing = None
+                self._partial_listing = None
+                self._listing_overrides = {}
+                self._stale_keys = set()
+            else:
+                self._listing_overrides.pop(key, None)
+                self._stale_keys.add(key)
+
+    def record_listing_entry(self, key, entry):
+        """
+        Record what is known about key after writing it, so that it does not
+        need to be requested from S3 again. entry is None for deleted keys.
+        """
+        with self._listing_lock:
+            self._stale_keys.discard(key)
+            self._listing_overrides[key] = entry
+
+    def _list_objects(self):
         paginator = self.boto.get_paginator("list_objects_v2")
         page_iterator = paginator.paginate(Bucket=self.bucket, Prefix=self.prefix)
         for page in page_iterator:
-            if "Contents" not in page:
-                return results
-
-            for obj in page["Contents"]:
+            for obj in page.get("Contents", []):
                 key = os.path.relpath(obj["Key"], self.prefix)
-                if not is_ignored_key(key, self.ignore_files):
-                    results.append(key)
-                else:
-                    logger.debug("Ignoring %s", key)
-
-        return results
-
-    def get_real_local_timestamp(self, key):
+                yield key, ListingEntry(
+                    obj["Size"], obj["ETag"], utils.to_timestamp(obj["LastModified"])
+                )
+
+    def _iter_snapshot(self):
+        if self._listing is not None:
+            yield from self._listing.items()
+            return
+
+        logger.debug("Listing %s", self.get_uri())
+        listing = collections.OrderedDict()
+        with self._listing_lock:
+            self._partial_listing = listing
+            self._last_listed_key = None
+        for key, entry in self._list_objects():
+            # published as the keys arrive, so that keys which are transferred
+            # while the rest of the prefix is still being listed are covered
+            with self._listing_lock:
+                listing[key] = entry
+                self._last_listed_key = key
+            yield key, entry
+        with self._listing_lock:
+            if self._partial_listing is listing:
+                self._listing = listing
+                self._partial_listing = None
+
+    def _head(self, key):
         try:
             response = self.boto.head_object(
                 Bucket=self.bucket, Key=os.path.join(self.prefix, key)
             )
-            return utils.to_timestamp(response["LastModified"])
         except ClientError:
             return None
+        return ListingEntry(
+            response["ContentLength"],
+            response["ETag"],
+            utils.to_timestamp(response["LastModified"]),
+        )
+
+    def iter_listing(self):
+        """
+        Yield (key, ListingEntry) for every object under the prefix, sorted by key.
+        The prefix is only listed once; changes made through this client since then
+        are applied on top of the snapshot.
+        """
+        with self._listing_lock:
+            changed = sorted(set(self._listing_overrides) | self._stale_keys)
+
+        changes = ((key, True) for key in changed)
+        for key, (entry, is_changed) in merge_sorted(self._iter_snapshot(), changes):
+            if is_changed:
+                entry = self.get_listing_entry(key)
+            if entry is not None:
+                yield key, entry
+
+    def get_listing_entry(self, key):
+        """
+        Return the ListingEntry for key, or None if it does not exist. Only keys
+        which are not covered by the listing snapshot are requested from S3.
+        """
+        with self._listing_lock:
+            if key not in self._stale_keys:
+                if key in self._listing_overrides:
+                    return self._listing_overrides[key]
+                if self._listing is not None:
+                    return self._listing.get(key)
+                if (
+                    self._partial_listing is not None
+                    and self._last_listed_key is not None
+                    and key <= self._last_listed_key
+                ):
+                    return self._partial_listing.get(key)
+
+        entry = self._head(key)
+        with self._listing_lock:
+            self._stale_keys.discard(key)
+            self._listing_overrides[key] = entry
+        return entry
+
+    def is_ignored(self, key):
+        return is_ignored_key(key, self.ignore_files)
+
+    def get_local_keys(self):
+        results = []
+        for key, _ in self.iter_listing():
+            if not is_ignored_key(key, self.ignore_files):
+                results.append(key)
+            else:
+                logger.debug("Ignoring %s", key)
+
+        return results
+
+    def get_real_local_timestamp(self, key):
+        entry = self.get_listing_entry(key)
+        return entry.timestamp if entry is not None else None
+
+    def get_size(self, key):
+        entry = self.get_listing_entry(key)
+        return entry.size if entry is not None else 0
+
+    def get_content_hash(self, key):
+        # The ETag of an object uploaded in a single part is the MD5 of its contents.
+        # Multipart uploads have an ETag of the form "<hash>-<parts>" instead.
+        entry = self.get_listing_entry(key)
+        if entry is None or "-" in entry.etag:
+            return None
+        return entry.etag.strip('"')
 
     def get_index_keys(self):
         return self.index.keys()
@@ -208,29 +777,27 @@ class S3SyncClient(SyncClient):
         return self.index.get(key, {}).get("local_timestamp")
 
     def set_index_local_timestamp(self, key, timestamp):
-        if key not in self.index:
-            self.index[key] = {}
-        self.index[key]["local_timestamp"] = timestamp
+        with self.index_lock:
+            entry = dict(self.index.get(key, {}))
+            entry["local_timestamp"] = timestamp
+            self.index[key] = entry
 
     def get_remote_timestamp(self, key):
         return self.index.get(key, {}).get("remote_timestamp")
 
     def set_remote_timestamp(self, key, timestamp):
-        if key not in self.index:
-            self.index[key] = {}
-        self.index[key]["remote_timestamp"] = timestamp
+        with self.index_lock:
+            entry = dict(self.index.get(key, {}))
+            entry["remote_timestamp"] = timestamp
+            self.index[key] = entry
 
-    def get_all_real_local_timestamps(self):
-        result = {}
-        paginator = self.boto.get_paginator("list_objects_v2")
-        page_iterator = paginator.paginate(Bucket=self.bucket, Prefix=self.prefix)
-        for page in page_iterator:
-            for obj in page.get("Contents", []):
-                key = os.path.relpath(obj["Key"], self.prefix)
-                if not is_ignored_key(key, self.ignore_files):
-                    result[key] = utils.to_timestamp(obj["LastModified"])
+    def iter_real_local_timestamps(self):
+        for key, entry in self.iter_listing():
+            if not is_ignored_key(key, self.ignore_files):
+                yield key, entry.timestamp
 
-        return result
+    def get_all_real_local_timestamps(self):
+        return dict(self.iter_real_local_timestamps())
 
     def get_all_remote_timestamps(self):
         return {key: value.get("remote_timestamp") for key, value in self.index.items()}
@@ -1,8 +1,10 @@
 #! -*- encoding: utf8 -*-
 
+import os
+
 from s4 import sync
 from s4.clients.local import get_local_client
-from s4.clients.s3 import get_s3_client
+from s4.clients.s3 import get_boto_client, get_s3_client
 
 
 class Command(object):
@@ -11,12 +13,28 @@ class Command(object):
         self.config = config
         self.logger = logger
 
-    def get_sync_worker(self, target):
+    def get_sync_worker(self, target, boto_clients=None, jobs=None):
         entry = self.config["targets"][target]
-        client_1, client_2 = self.get_clients(entry)
-        return sync.SyncWorker(client_1, client_2)
+        client_1, client_2 = self.get_clients(
+            entry, boto_clients=boto_clients, jobs=jobs
+        )
+        return sync.SyncWorker(
+            client_1,
+            client_2,
+            jobs=entry.get("jobs", 1),
+            detect_moves=entry.get("detect_moves", False),
+        )
+
+    def get_clients(self, entry, boto_clients=None, jobs=None):
+        """
+        Create the clients for a target entry. If a boto_clients dict is given,
+        targets with the same credentials and endpoint share a boto client (and
+        so its connection pool) through it. The pool is sized for jobs transfers
+        at the same time, which defaults to the jobs setting of the entry.
+        """
+        if jobs is None:
+            jobs = entry.get("jobs", 1)
 
-    def get_clients(self, entry):
         target_1 = entry["local_folder"]
         target_2 = entry["s3_uri"]
         aws_access_key_id = entry["aws_access_key_id"]
@@ -30,12 +48,42 @@ class Command(object):
         if not target_2.endswith("/"):
             target_2 += "/"
 
-        client_1 = get_local_client(target_1)
+        sharded_index = entry.get("sharded_index", False)
+        index_format = entry.get("index_format")
+        if index_format is None and sharded_index:
+            index_format = "sharded"
+
+        client_1 = get_local_client(
+            target_1,
+            scan_workers=entry.get("scan_workers"),
+            content_hash=entry.get("content_hash", False),
+            index_format=index_format,
+            index_codec=entry.get("index_codec"),
+        )
+        if boto_clients is not None:
+            credentials = (
+                aws_access_key_id,
+                aws_secret_access_key,
+                endpoint_url,
+                region_name,
+            )
+            if credentials not in boto_clients:
+                boto_clients[credentials] = get_boto_client(*credentials, jobs=jobs)
+            boto_client = boto_clients[credentials]
+        else:
+            boto_client = None
+
         client_2 = get_s3_client(
             target_2,
             aws_access_key_id,
             aws_secret_access_key,
             endpoint_url,
             region_name,
+            boto_client=boto_client,
+            sharded_index=sharded_index,
+            index_cache_path=os.path.join(target_1, ".index.remote"),
+            index_deltas=entry.get("index_deltas", False),
+            index_codec=entry.get("index_codec"),
+            jobs=jobs,
         )
         return client_1, client_2
@@ -1,7 +1,10 @@
 #! -*- encoding: utf-8 -*-
+import math
+import time
 from collections import defaultdict
 
 from s4.commands import Command
+from s4.index import INDEX_FILE_NAMES, TEMP_FILE_PREFIX
 
 # Don't crash on import if the underlying operating system does not support INotify
 try:
@@ -13,6 +16,71 @@ except (OSError, ModuleNotFoundError):
     supported = False
 
 
+def is_index_file(key):
+    """
+    Return True for files S4 writes itself next to the synced files, such as
+    the index, its temporary files and the sqlite index.
+    """
+    name = key.split("/")[-1]
+    return (
+        name in (".s4lock", ".s4hashes")
+        or name.startswith(TEMP_FILE_PREFIX)
+        or any(part in INDEX_FILE_NAMES for part in key.split("/"))
+    )
+
+
+class SettlingKeys(object):
+    """
+    Keys which changed, held back until they have settled so that files are
+    not synced while they are still being written. Files which were closed
+    after writing (or which were moved or deleted) settle once nothing has
+    happened to them for settle_time seconds. Files which are still open for
+    writing are held back until they are closed, or until nothing has happened
+    to them for write_timeout seconds for writers which never close them.
+    """
+
+    def __init__(self, settle_time, write_timeout):
+        self.settle_time = settle_time
+        self.write_timeout = max(settle_time, write_timeout)
+        # (target, key) => time its current settle period ends
+        self.pending = {}
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, target, key, writing=False, now=None):
+        """
+        Record an event for key, where writing means that the file is still
+        open for writing.
+        """
+        if now is None:
+            now = time.monotonic()
+        settle_time = self.write_timeout if writing else self.settle_time
+        self.pending[(target, key)] = now + settle_time
+
+    def get_deadline(self):
+        """
+        Return when the next key settles, or None if there are no keys.
+        """
+        if not self.pending:
+            return None
+        return min(self.pending.values())
+
+    def pop_settled(self, now=None):
+        """
+        Remove the keys which settled and return them as a dict of targets
+        and their keys.
+        """
+        if now is None:
+            now = time.monotonic()
+        settled = defaultdict(set)
+        for (target, key), deadline in list(self.pending.items()):
+            if now >= deadline:
+                settled[target].add(key)
+                del self.pending[(target, key)]
+        return settled
+
+
 class DaemonCommand(Command):
     def run(self, terminator=lambda x: False):
         if not supported:
@@ -39,36 +107,163 @@ class DaemonCommand(Command):
                 return
 
         notifier = INotifyRecursive()
-        watch_flags = flags.CREATE | flags.DELETE | flags.MODIFY
+        # files are synced once they settle after CLOSE_WRITE or MOVED_TO, a
+        # CREATE or MODIFY on its own means that they are still being written
+        watch_flags = (
+            flags.CREATE
+            | flags.DELETE
+            | flags.MODIFY
+            | flags.CLOSE_WRITE
+            | flags.MOVED_FROM
+            | flags.MOVED_TO
+        )
+
+        # root of the watched tree => target
+        roots = {}
+        # root of the watched tree => ignore files its watches were added with
+        watched_rules = {}
 
-        watch_map = {}
+        # clients are kept for the lifetime of the daemon along with their
+        # indexes, ignore rules and listings, which they keep up to date with
+        # their own changes
+        boto_clients = {}
+        workers = {}
+        # targets are synced one at a time, so a shared boto client is only
+        # used by the transfers of one of them at once
+        jobs = max(self.config["targets"][target].get("jobs", 1) for target in targets)
 
         for target in targets:
             entry = self.config["targets"][target]
             path = entry["local_folder"]
             self.logger.info("Watching %s", path)
-            for wd in notifier.add_watches(path.encode("utf8"), watch_flags):
-                watch_map[wd] = target
+            root = path.encode("utf8")
+            worker = self.get_sync_worker(target, boto_clients=boto_clients, jobs=jobs)
+            notifier.add_watches(root, watch_flags, ignore=worker.client_1.is_ignored)
+            watched_rules[root] = list(worker.client_1.ignore_files)
+            roots[root] = target
 
             # Check for any pending changes
-            worker = self.get_sync_worker(target)
             worker.sync(conflict_choice=self.args.conflicts)
+            workers[target] = worker
+
+        settling = SettlingKeys(self.args.settle_time, self.args.write_timeout)
+        # targets which synced changes since their indexes were last flushed
+        unflushed = set()
+        last_flush = last_refresh = time.monotonic()
 
         index = 0
-        while not terminator(index):
-            index += 1
+        try:
+            while not terminator(index):
+                index += 1
+
+                # targets to sync in full
+                full_sync = set()
+                timeout = self.get_read_timeout(
+                    last_flush, last_refresh, unflushed, settling.get_deadline()
+                )
+                for event in notifier.read(
+                    timeout=timeout, read_delay=self.args.read_delay
+                ):
+                    if event.root is None:
+                        # events were lost, so every target is synced in full
+                        self.logger.info("Too many changes, syncing all targets")
+                        full_sync.update(workers)
+                        continue
+
+                    target = roots[event.root]
+
+                    if event.key == ".syncignore":
+                        workers[target].client_1.reload_ignore_files()
+                        self.update_watches(
+                            notifier, event.root, workers[target], watched_rules
+                        )
+
+                    writing = bool(
+                        event.mask & (flags.CREATE | flags.MODIFY)
+                        and not event.mask & flags.ISDIR
+                    )
+                    # Don't bother running for .index and friends
+                    if event.key and not is_index_file(event.key):
+                        settling.add(target, event.key, writing)
+                    # a move changes where it came from as well
+                    if event.source and not is_index_file(event.source):
+                        settling.add(target, event.source)
 
-            to_run = defaultdict(set)
-            for event in notifier.read(read_delay=self.args.read_delay):
-                target = watch_map[event.wd]
+                to_run = settling.pop_settled()
+                for target in full_sync:
+                    to_run[target] = None
 
-                # Don't bother running for .index
-                if event.name not in (".index", ".s4lock"):
-                    to_run[target].add(event.name)
+                for target, keys in to_run.items():
+                    worker = workers[target]
+
+                    if keys is None:
+                        self.logger.info("Syncing {}".format(worker))
+                        worker.sync(conflict_choice=self.args.conflicts, flush=False)
+                    else:
+                        self.logger.info(
+                            "Syncing {} ({} keys)".format(worker, len(keys))
+                        )
+                        worker.sync(
+                            conflict_choice=self.args.conflicts,
+                            keys=sorted(keys),
+                            refresh=False,
+                            flush=False,
+                        )
+                    unflushed.add(target)
+
+                now = time.monotonic()
+                if now - last_refresh >= self.args.refresh_interval:
+                    for root, target in roots.items():
+                        worker = workers[target]
+                        if target in unflushed:
+                            worker.flush_index()
+                        self.refresh_worker(worker, notifier, root, watched_rules)
+                    unflushed.clear()
+                    last_flush = last_refresh = now
+                elif unflushed and now - last_flush >= self.args.flush_interval:
+                    for target in sorted(unflushed):
+                        workers[target].flush_index()
+                    unflushed.clear()
+                    last_flush = now
+        finally:
+            for target in sorted(unflushed):
+                workers[target].flush_index()
+
+    def update_watches(self, notifier, root, worker, watched_rules):
+        """
+        Apply the ignore files of a target to its watches if they changed since
+        the watches were added.
+        """
+        ignore_files = list(worker.client_1.ignore_files)
+        if watched_rules[root] == ignore_files:
+            return
+        self.logger.info("Ignore files of {} changed".format(worker))
+        notifier.update_watches(root, ignore=worker.client_1.is_ignored)
+        watched_rules[root] = ignore_files
 
-            for target, keys in to_run.items():
-                worker = self.get_sync_worker(target)
+    def get_read_timeout(
+        self, last_flush, last_refresh, unflushed, settle_deadline=None
+    ):
+        """
+        Return how long to wait for events (in milliseconds) before the indexes
+        need to be flushed, the targets refreshed or changed keys have settled.
+        """
+        deadline = last_refresh + self.args.refresh_interval
+        if unflushed:
+            deadline = min(deadline, last_flush + self.args.flush_interval)
+        if settle_deadline is not None:
+            deadline = min(deadline, settle_deadline)
+        # rounded up, so that the deadline has passed once the wait is over
+        return max(0, math.ceil((deadline - time.monotonic()) * 1000))
 
-                # Should ideally be setting keys to sync
-                self.logger.info("Syncing {}".format(worker))
-                worker.sync(conflict_choice=self.args.conflicts)
+    def refresh_worker(self, worker, notifier, root, watched_rules):
+        """
+        Pick up changes made by anyone else: other machines syncing the same
+        target, or S4 being run by hand on this one.
+        """
+        self.logger.info("Refreshing {}".format(worker))
+        for client in (worker.client_1, worker.client_2):
+            client.reload_index()
+            client.reload_ignore_files()
+        self.update_watches(notifier, root, worker, watched_rules)
+        worker.sync(conflict_choice=self.args.conflicts)
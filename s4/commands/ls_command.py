@@ -4,7 +4,9 @@ from datetime import datetime
 
 from tabulate import tabulate
 
+from s4.clients import merge_sorted
 from s4.commands import Command
+from s4.index import iter_sorted_items
 
 
 class LsCommand(Command):
@@ -25,15 +27,19 @@ class LsCommand(Command):
         sort_by = self.args.sort_by.lower()
         descending = self.args.descending
 
-        keys = set(client_1.get_index_keys()) | set(client_2.get_index_keys())
+        # only the entries under the prefix are read from indexes which support it
+        entries = merge_sorted(
+            iter_sorted_items(client_1.index, self.args.prefix),
+            iter_sorted_items(client_2.index, self.args.prefix),
+        )
 
         total_size = 0
 
         data = []
-        for key in sorted(keys):
+        for key, (entry_1, entry_2) in entries:
             self.logger.debug("Processing %s", key)
-            entry_1 = client_1.index.get(key, {})
-            entry_2 = client_2.index.get(key, {})
+            entry_1 = entry_1 or {}
+            entry_2 = entry_2 or {}
 
             ts_1 = entry_1.get("local_timestamp")
             ts_2 = entry_2.get("local_timestamp")
@@ -1,6 +1,11 @@
 #! -*- encoding: utf -*-
 
+import concurrent.futures
+import functools
+import logging
 import sys
+import threading
+import time
 
 from clint.textui.colored import ColoredString
 
@@ -65,6 +70,47 @@ def hide_progress_bar(sync_object):
     ProgressBar.close()
 
 
+def display_shared_progress_bar(sync_object):
+    ProgressBar.start_transfer(
+        sync_object.total_size,
+        leave=False,
+        ncols=80,
+        unit="B",
+        unit_scale=True,
+        mininterval=0.2,
+    )
+
+
+def hide_shared_progress_bar(sync_object):
+    ProgressBar.finish_transfer()
+
+
+class TargetLoggerAdapter(logging.LoggerAdapter):
+    """
+    Prefix log messages with the name of the target they are about, so that the
+    output of targets synced at the same time can be told apart.
+    """
+
+    def process(self, msg, kwargs):
+        return "[{}] {}".format(self.extra["target"], msg), kwargs
+
+
+class TargetSummary(object):
+    def __init__(self, name):
+        self.name = name
+        self.duration = 0
+        self.transferred = 0
+        self.error = None
+
+    def __repr__(self):
+        return "{}: {:.2f}s, {:.2f}Mb transferred{}".format(
+            self.name,
+            self.duration,
+            self.transferred / (1024 * 1024),
+            " (failed)" if self.error is not None else "",
+        )
+
+
 class SyncCommand(Command):
     def run(self):
         all_targets = list(self.config["targets"].keys())
@@ -73,69 +119,182 @@ class SyncCommand(Command):
         else:
             targets = self.args.targets
 
-        try:
-            for name in sorted(targets):
-                if name not in self.config["targets"]:
-                    self.logger.info(
-                        '"%s" is an unknown target. Choices are: %s', name, all_targets
-                    )
-                    continue
-
-                entry = self.config["targets"][name]
-                client_1, client_2 = self.get_clients(entry)
-
-                try:
-                    worker = sync.SyncWorker(
-                        client_1,
-                        client_2,
-                        start_callback=display_progress_bar,
-                        update_callback=update_progress_bar,
-                        complete_callback=hide_progress_bar,
-                        conflict_handler=handle_conflict,
-                        action_callback=self.action_callback,
-                    )
+        names = []
+        for name in sorted(targets):
+            if name not in self.config["targets"]:
+                self.logger.info(
+                    '"%s" is an unknown target. Choices are: %s', name, all_targets
+                )
+            else:
+                names.append(name)
 
-                    self.logger.info(
-                        "Syncing %s [%s <=> %s]",
-                        name,
-                        client_1.get_uri(),
-                        client_2.get_uri(),
-                    )
-                    worker.sync(
-                        conflict_choice=self.args.conflicts, dry_run=self.args.dry_run
+        try:
+            if self.args.parallel_targets > 1 and len(names) > 1:
+                self.run_parallel(names)
+            else:
+                for name in names:
+                    entry = self.config["targets"][name]
+                    client_1, client_2 = self.get_clients(
+                        entry, jobs=self.args.jobs or entry.get("jobs", 1)
                     )
-                except Exception as e:
-                    if self.args.log_level == "DEBUG":
-                        self.logger.exception(e)
-                    else:
-                        self.logger.error(
-                            "There was an error syncing '%s':\n%s", name, e
-                        )
+                    self.sync_target(name, client_1, client_2)
 
         except KeyboardInterrupt:
             self.logger.warning("Quitting due to Keyboard Interrupt...")
 
-    def action_callback(self, resolution):
+    def run_parallel(self, names):
+        # progress bars and conflict prompts are shared by all the targets
+        callback_lock = threading.Lock()
+        conflict_lock = threading.Lock()
+
+        def locked_handle_conflict(*args):
+            with conflict_lock:
+                return handle_conflict(*args)
+
+        # set on Keyboard Interrupt so that the targets being synced stop early
+        stop_event = threading.Event()
+
+        # boto clients are created up front as creating them is not thread safe,
+        # and their connection pools are shared by the transfers of every target
+        jobs = sum(
+            self.args.jobs or self.config["targets"][name].get("jobs", 1)
+            for name in names
+        )
+        boto_clients = {}
+        clients = {}
+        for name in names:
+            clients[name] = self.get_clients(
+                self.config["targets"][name], boto_clients=boto_clients, jobs=jobs
+            )
+
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.args.parallel_targets
+        )
+        futures = []
+        try:
+            for name in names:
+                client_1, client_2 = clients[name]
+                future = executor.submit(
+                    self.sync_target,
+                    name,
+                    client_1,
+                    client_2,
+                    callback_lock=callback_lock,
+                    conflict_handler=locked_handle_conflict,
+                    prefix_logs=True,
+                    stop_event=stop_event,
+                )
+                futures.append(future)
+
+            summaries = [future.result() for future in futures]
+        except KeyboardInterrupt:
+            stop_event.set()
+            for future in futures:
+                future.cancel()
+            # the targets already running index the work they completed
+            executor.shutdown(wait=True)
+            raise
+        finally:
+            executor.shutdown(wait=False)
+
+        self.logger.info("Summary:")
+        for summary in summaries:
+            self.logger.info("  %s", summary)
+
+    def sync_target(
+        self,
+        name,
+        client_1,
+        client_2,
+        callback_lock=None,
+        conflict_handler=handle_conflict,
+        prefix_logs=False,
+        stop_event=None,
+    ):
+        summary = TargetSummary(name)
+        if prefix_logs:
+            logger = TargetLoggerAdapter(self.logger, {"target": name})
+        else:
+            logger = self.logger
+
+        entry = self.config["targets"][name]
+        jobs = self.args.jobs or entry.get("jobs", 1)
+        if jobs > 1 or callback_lock is not None:
+            start_callback = display_shared_progress_bar
+            hide_callback = hide_shared_progress_bar
+        else:
+            start_callback = display_progress_bar
+            hide_callback = hide_progress_bar
+
+        def complete_callback(sync_object):
+            hide_callback(sync_object)
+            summary.transferred += sync_object.total_size
+
+        start_time = time.time()
+        try:
+            worker = sync.SyncWorker(
+                client_1,
+                client_2,
+                start_callback=start_callback,
+                update_callback=update_progress_bar,
+                complete_callback=complete_callback,
+                conflict_handler=conflict_handler,
+                action_callback=functools.partial(self.action_callback, logger=logger),
+                jobs=jobs,
+                detect_moves=entry.get("detect_moves", False),
+                callback_lock=callback_lock,
+                stop_event=stop_event,
+            )
+            if prefix_logs:
+                worker.logger = TargetLoggerAdapter(worker.logger, {"target": name})
+
+            logger.info(
+                "Syncing %s [%s <=> %s]", name, client_1.get_uri(), client_2.get_uri()
+            )
+            worker.sync(conflict_choice=self.args.conflicts, dry_run=self.args.dry_run)
+        except Exception as e:
+            summary.error = e
+            if self.args.log_level == "DEBUG":
+                logger.exception(e)
+            else:
+                logger.error("There was an error syncing '%s':\n%s", name, e)
+
+        summary.duration = time.time() - start_time
+        return summary
+
+    def action_callback(self, resolution, logger=None):
+        logger = logger or self.logger
         if resolution.action == Resolution.UPDATE:
-            self.logger.info(
+            logger.info(
                 self._colored("YELLOW", "Updating %s (%s => %s)"),
                 resolution.key,
                 resolution.from_client.get_uri(),
                 resolution.to_client.get_uri(),
             )
         elif resolution.action == Resolution.CREATE:
-            self.logger.info(
+            logger.info(
                 self._colored("GREEN", "Creating %s (%s => %s)"),
                 resolution.key,
                 resolution.from_client.get_uri(),
                 resolution.to_client.get_uri(),
             )
         elif resolution.action == Resolution.DELETE:
-            self.logger.info(
+            logger.info(
                 self._colored("RED", "Deleting %s on %s"),
                 resolution.key,
                 resolution.to_client.get_uri(),
             )
+        elif resolution.action == Resolution.MOVE:
+            logger.info(
+                self._colored("CYAN", "Moving %s to %s on %s"),
+                resolution.source_key,
+                resolution.key,
+                resolution.to_client.get_uri(),
+            )
+        elif resolution.action == Resolution.REINDEX:
+            logger.debug(
+                "Contents of %s unchanged, updating index only", resolution.key
+            )
 
     def _colored(self, color, text):
         return text if self.args.no_colors else ColoredString(color, text)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import collections.abc
+import json
+
+from s4.clients import merge_sorted
+
+# names of the files and directories S4 keeps its indexes in, next to the
+# synced files. They are never synced themselves
+INDEX_FILE_NAMES = [
+    ".index",
+    ".index.sqlite",
+    ".index.sqlite-wal",
+    ".index.sqlite-shm",
+    ".index.journal",
+    ".index.manifest",
+    ".index.d",
+    ".index.remote",
+    ".index.deltas",
+]
+# prefix of the temporary files indexes are written to before replacing them
+TEMP_FILE_PREFIX = ".index.tmp-"
+INDEX_IGNORE_PATTERNS = INDEX_FILE_NAMES + [TEMP_FILE_PREFIX + "*"]
+
+
+def iter_sorted_items(index, prefix=None):
+    """
+    Yield (key, entry) for every entry of a dict or index, sorted by key. If a
+    prefix is given, only keys starting with it are included.
+    """
+    iter_items = getattr(index, "iter_items", None)
+    if iter_items is not None:
+        return iter_items(prefix)
+    items = index.items()
+    if prefix:
+        # filtered first, so that only the matching entries are sorted
+        items = [(key, entry) for key, entry in items if key.startswith(prefix)]
+    return iter(sorted(items))
+
+
+def find_keys_under(index, prefixes):
+    """
+    Return {prefix: sorted keys of index starting with prefix} for prefixes
+    ending with "/". Indexes which can iterate over a prefix are asked for each
+    one, other mappings are scanned once for all of them rather than sorted.
+    """
+    result = {prefix: [] for prefix in prefixes}
+    if not result:
+        return result
+
+    iter_items = getattr(index, "iter_items", None)
+    if iter_items is not None:
+        for prefix in result:
+            result[prefix] = [key for key, _ in iter_items(prefix)]
+        return result
+
+    for key in index:
+        parts = key.split("/")
+        for position in range(1, len(parts)):
+            prefix = "/".join(parts[:position]) + "/"
+            if prefix in result:
+                result[prefix].append(key)
+    for keys in result.values():
+        keys.sort()
+    return result
+
+
+def write_json_index(fp, items):
+    """
+    Write (key, entry) items to the text file object fp as a JSON object, one
+    entry at a time.
+    """
+    fp.write("{")
+    for position, (key, entry) in enumerate(items):
+        if position > 0:
+            fp.write(", ")
+        json.dump(key, fp)
+        fp.write(": ")
+        json.dump(entry, fp)
+    fp.write("}")
+
+
+class IndexItemsView(collections.abc.ItemsView):
+    def __iter__(self):
+        return self._mapping.iter_items()
+
+
+class OverlayIndex(collections.abc.MutableMapping):
+    """
+    A mutable index on top of a read only base index (such as a BinaryIndex).
+    Changes are kept in memory, so entries of the base index are only read when
+    they are looked up.
+
+    Entries are values: changing an entry means storing a new dict for its key.
+    """
+
+    def __init__(self, base):
+        self.base = base
+        # key => entry, or None for entries deleted from the base
+        self.changes = {}
+
+    def __repr__(self):
+        return "OverlayIndex<{}, changes={}>".format(self.base, len(self.changes))
+
+    def __getitem__(self, key):
+        if key in self.changes:
+            entry = self.changes[key]
+            if entry is None:
+                raise KeyError(key)
+            return entry
+        return self.base[key]
+
+    def __setitem__(self, key, entry):
+        self.changes[key] = entry
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.changes[key] = None
+
+    def __contains__(self, key):
+        if key in self.changes:
+            return self.changes[key] is not None
+        return key in self.base
+
+    def __iter__(self):
+        for key, _ in self.iter_items():
+            yield key
+
+    def __len__(self):
+        result = len(self.base)
+        for key, entry in self.changes.items():
+            in_base = key in self.base
+            if entry is None and in_base:
+                result -= 1
+            elif entry is not None and not in_base:
+                result += 1
+        return result
+
+    def items(self):
+        return IndexItemsView(self)
+
+    def iter_items(self, prefix=None):
+        """
+        Yield (key, entry) for every entry sorted by key, optionally only for the
+        keys starting with prefix. Changes made while iterating are not seen.
+        """
+        changes = sorted(
+            (key, (entry,))
+            for key, entry in self.changes.items()
+            if not prefix or key.startswith(prefix)
+        )
+        return self._iter_items(iter_sorted_items(self.base, prefix), changes)
+
+    def _iter_items(self, base_items, changes):
+        for key, (entry, change) in merge_sorted(base_items, changes):
+            if change is not None:
+                entry = change[0]
+            if entry is not None:
+                yield key, entry
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the index codecs.
+
+Reports how long every codec takes to encode and decode an index along with the
+size of the result, to help choose a codec for a target: a fast codec suits
+machines with little CPU to spare while a dense one suits slow links.
+
+Run it against a generated index, or against the index of a local folder:
+
+    python -m s4.index.benchmark --entries 200000
+    python -m s4.index.benchmark ~/myfolder --codec zlib:1 --codec lzma:6
+"""
+
+import argparse
+import hashlib
+import random
+import time
+
+from tabulate import tabulate
+
+from s4.clients.local import LocalSyncClient
+from s4.index import iter_sorted_items
+from s4.index.encoding import CODECS, dumps_index, loads_index
+
+DEFAULT_CODECS = [
+    "none",
+    "gzip:1",
+    "gzip:6",
+    "gzip:9",
+    "zlib:1",
+    "zlib:6",
+    "zlib:9",
+    "lzma:0",
+    "lzma:6",
+    "bz2:9",
+]
+
+DIRECTORIES = ["photos", "documents", "music", "projects", "backups", ".config"]
+EXTENSIONS = [".jpg", ".png", ".txt", ".pdf", ".mp3", ".py", ".json", ".tar.gz"]
+
+
+def generate_index(entries, content_hash=True, seed=0):
+    """
+    Return an index of entries which looks like the index of a real target:
+    nested directories with many files sharing a prefix, timestamps spread over
+    a few years and, optionally, content hashes.
+    """
+    generator = random.Random(seed)
+    now = 1500000000.0
+    index = {}
+    while len(index) < entries:
+        parts = [generator.choice(DIRECTORIES)]
+        for _ in range(generator.randint(0, 3)):
+            parts.append(
+                "{}{:03d}".format(
+                    generator.choice("abcdefgh"), generator.randint(0, 50)
+                )
+            )
+        parts.append(
+            "file_{:06d}{}".format(
+                generator.randint(0, 999999), generator.choice(EXTENSIONS)
+            )
+        )
+        timestamp = now - generator.uniform(0, 3 * 365 * 24 * 3600)
+        entry = {
+            "local_timestamp": timestamp,
+            "remote_timestamp": timestamp + generator.uniform(0, 10),
+        }
+        if content_hash:
+            entry["content_hash"] = hashlib.md5(str(len(index)).encode()).hexdigest()
+        index["/".join(parts)] = entry
+    return index
+
+
+def _best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def benchmark_codec(index, codec, repeat=3):
+    """
+    Return (size, encode seconds, decode seconds) for index with codec, taking
+    the best of repeat runs. Both times include converting the index to and
+    from JSON.
+    """
+    encode_time, data = _best_time(lambda: dumps_index(index, codec), repeat)
+    decode_time, decoded = _best_time(lambda: loads_index(data), repeat)
+    if decoded != index:
+        raise ValueError("Index changed when decoded", codec)
+    return len(data), encode_time, decode_time
+
+
+def run_benchmark(index, codecs=None, repeat=3):
+    """
+    Benchmark every codec with index. Returns one row for each codec holding
+    the codec, the encoded size, its ratio to the plain JSON size and the time
+    taken to encode and decode the index in milliseconds.
+    """
+    if codecs is None:
+        codecs = [spec for spec in DEFAULT_CODECS if spec.split(":")[0] in CODECS]
+
+    plain_size = len(dumps_index(index, "none"))
+    rows = []
+    for codec in codecs:
+        size, encode_time, decode_time = benchmark_codec(index, codec, repeat)
+        rows.append(
+            [
+                codec,
+                size,
+                round(size / plain_size, 3),
+                round(encode_time * 1000, 1),
+                round(decode_time * 1000, 1),
+            ]
+        )
+    return rows
+
+
+def load_index(path):
+    client = LocalSyncClient(path)
+    return dict(iter_sorted_items(client.index))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m s4.index.benchmark", description=__doc__.strip().split("\n")[0]
+    )
+    parser.add_argument(
+        "folder", nargs="?", help="benchmark the index of this local folder"
+    )
+    parser.add_argument(
+        "--entries",
+        type=int,
+        default=100000,
+        help="number of entries of the generated index (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-content-hash",
+        action="store_true",
+        help="generate an index without content hashes",
+    )
+    parser.add_argument(
+        "--codec",
+        action="append",
+        dest="codecs",
+        help="codec to benchmark, such as gzip:9 (default: a selection of all codecs)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="number of runs to take the best time of (default: %(default)s)",
+    )
+    args = parser.parse_args(arguments)
+
+    if args.folder:
+        index = load_index(args.folder)
+    else:
+        index = generate_index(args.entries, content_hash=not args.no_content_hash)
+
+    print("Benchmarking an index of {} entries".format(len(index)))
+    rows = run_benchmark(index, args.codecs, args.repeat)
+    print(
+        tabulate(
+            rows, headers=["codec", "bytes", "ratio", "encode (ms)", "decode (ms)"]
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
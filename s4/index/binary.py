@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Binary index format.
+
+The file starts with a fixed size header followed by fixed width columns for the
+values of every entry and finally the keys, sorted and front coded:
+
+    header            magic, version, restart interval, entry count, key data size
+    remote timestamps count * float64 (NaN for missing timestamps)
+    local timestamps  count * float64 (NaN for missing timestamps)
+    content hashes    count * 16 bytes (all zero for missing hashes)
+    restarts          one uint64 offset into the key data per restart interval
+    key data          varint shared prefix length, varint suffix length, suffix
+
+Every restart interval keys, a key is stored in full so that lookups can bisect
+over the restart points and only decode the keys of a single interval.
+"""
+
+import array
+import collections.abc
+import math
+import mmap
+import struct
+import sys
+
+MAGIC = b"S4IX"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQQ")
+RESTART_INTERVAL = 16
+
+TIMESTAMP = struct.Struct("<d")
+RESTART = struct.Struct("<Q")
+HASH_SIZE = 16
+EMPTY_HASH = bytes(HASH_SIZE)
+
+
+def is_binary_index(header):
+    return header[: len(MAGIC)] == MAGIC
+
+
+def _encode_varint(value):
+    result = bytearray()
+    while value >= 0x80:
+        result.append((value & 0x7F) | 0x80)
+        value >>= 7
+    result.append(value)
+    return result
+
+
+def _decode_varint(data, offset):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+
+def _common_prefix_length(a, b):
+    length = min(len(a), len(b))
+    for index in range(length):
+        if a[index] != b[index]:
+            return index
+    return length
+
+
+def _little_endian(column):
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def _to_float(timestamp):
+    return float("nan") if timestamp is None else timestamp
+
+
+def _to_timestamp(value):
+    return None if math.isnan(value) else value
+
+
+def write_binary_index(fp, items, restart_interval=RESTART_INTERVAL):
+    """
+    Write (key, entry) items, which must be sorted by key, to the binary file
+    object fp in the binary index format.
+    """
+    remote_timestamps = array.array("d")
+    local_timestamps = array.array("d")
+    content_hashes = bytearray()
+    restarts = array.array("Q")
+    keys = bytearray()
+
+    previous = None
+    for position, (key, entry) in enumerate(items):
+        data = key.encode("utf-8")
+        if previous is not None and data <= previous:
+            raise ValueError("Index keys must be unique and sorted", key)
+
+        if position % restart_interval == 0:
+            restarts.append(len(keys))
+            shared = 0
+        else:
+            shared = _common_prefix_length(previous, data)
+
+        keys += _encode_varint(shared)
+        keys += _encode_varint(len(data) - shared)
+        keys += data[shared:]
+
+        remote_timestamps.append(_to_float(entry.get("remote_timestamp")))
+        local_timestamps.append(_to_float(entry.get("local_timestamp")))
+        content_hash = entry.get("content_hash")
+        if content_hash is not None:
+            content_hash = bytes.fromhex(content_hash)
+            if len(content_hash) != HASH_SIZE:
+                raise ValueError("Content hashes must be MD5 hashes", key)
+            content_hashes += content_hash
+        else:
+            content_hashes += EMPTY_HASH
+        previous = data
+
+    fp.write(
+        HEADER.pack(MAGIC, VERSION, restart_interval, len(remote_timestamps), len(keys))
+    )
+    fp.write(_little_endian(remote_timestamps))
+    fp.write(_little_endian(local_timestamps))
+    fp.write(bytes(content_hashes))
+    fp.write(_little_endian(restarts))
+    fp.write(bytes(keys))
+
+
+class BinaryIndex(collections.abc.Mapping):
+    """
+    Read only index backed by a memory mapped file in the binary index format.
+    Entries are decoded on demand, so opening an index is cheap regardless of
+    its size.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fp:
+            self._data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._data) < HEADER.size:
+            raise ValueError("Index is truncated", path)
+
+        magic, version, interval, count, keys_size = HEADER.unpack_from(self._data)
+        if magic != MAGIC:
+            raise ValueError("Not a binary index", path)
+        if version != VERSION:
+            raise ValueError("Unsupported binary index version", version)
+
+        self.restart_interval = interval
+        self.count = count
+        self._blocks = (count + interval - 1) // interval
+
+        self._remote_offset = HEADER.size
+        self._local_offset = self._remote_offset + count * TIMESTAMP.size
+        self._hash_offset = self._local_offset + count * TIMESTAMP.size
+        self._restart_offset = self._hash_offset + count * HASH_SIZE
+        self._keys_offset = self._restart_offset + self._blocks * RESTART.size
+
+        if self._keys_offset + keys_size != len(self._data):
+            raise ValueError("Index is truncated", path)
+
+        self._remote_timestamps = self._column(self._remote_offset, count)
+        self._local_timestamps = self._column(self._local_offset, count)
+
+    def _column(self, offset, count):
+        data = memoryview(self._data)[offset : offset + count * TIMESTAMP.size]
+        if sys.byteorder == "little":
+            return data.cast("d")
+        column = array.array("d", data)
+        column.byteswap()
+        return column
+
+    def __repr__(self):
+        return "BinaryIndex<{}, count={}>".format(self.path, self.count)
+
+    def close(self):
+        # views of the memory map need to be released before it can be closed
+        for column in (self._remote_timestamps, self._local_timestamps):
+            if isinstance(column, memoryview):
+                column.release()
+        self._data.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, key):
+        position = self._find(key)
+        if position is None:
+            raise KeyError(key)
+        return self._entry(position)
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __iter__(self):
+        for _, key in self._iter_keys(0):
+            yield key.decode("utf-8")
+
+    def iter_items(self, prefix=None):
+        """
+        Yield (key, entry) for every entry sorted by key, optionally only for the
+        keys starting with prefix.
+        """
+        if not prefix:
+            for position, key in self._iter_keys(0):
+                yield key.decode("utf-8"), self._entry(position)
+            return
+
+        target = prefix.encode("utf-8")
+        for position, key in self._iter_keys(max(self._find_block(target), 0)):
+            if key.startswith(target):
+                yield key.decode("utf-8"), self._entry(position)
+            elif key > target:
+                break
+
+    def _entry(self, position):
+        entry = {
+            "remote_timestamp": _to_timestamp(self._remote_timestamps[position]),
+            "local_timestamp": _to_timestamp(self._local_timestamps[position]),
+        }
+
+        start = self._hash_offset + position * HASH_SIZE
+        content_hash = self._data[start : start + HASH_SIZE]
+        if content_hash != EMPTY_HASH:
+            entry["content_hash"] = content_hash.hex()
+        return entry
+
+    def _restart_key(self, block):
+        offset = (
+            self._keys_offset
+            + RESTART.unpack_from(
+                self._data, self._restart_offset + block * RESTART.size
+            )[0]
+        )
+        # keys at restart points do not share a prefix with the previous key
+        _, offset = _decode_varint(self._data, offset)
+        length, offset = _decode_varint(self._data, offset)
+        return self._data[offset : offset + length]
+
+    def _iter_keys(self, block, limit=None):
+        position = block * self.restart_interval
+        end = self.count if limit is None else min(self.count, position + limit)
+        if position >= end:
+            return
+
+        offset = (
+            self._keys_offset
+            + RESTART.unpack_from(
+                self._data, self._restart_offset + block * RESTART.size
+            )[0]
+        )
+        data = self._data
+        key = b""
+        while position < end:
+            # lengths nearly always fit in a single byte
+            shared = data[offset]
+            if shared < 0x80:
+                offset += 1
+            else:
+                shared, offset = _decode_varint(data, offset)
+            length = data[offset]
+            if length < 0x80:
+                offset += 1
+            else:
+                length, offset = _decode_varint(data, offset)
+            key = key[:shared] + data[offset : offset + length]
+            offset += length
+            yield position, key
+            position += 1
+
+    def _find_block(self, target):
+        """
+        Return the last block whose first key is not greater than target, or
+        -1 if target comes before every key.
+        """
+        low, high = 0, self._blocks
+        while low < high:
+            middle = (low + high) // 2
+            if self._restart_key(middle) <= target:
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1
+
+    def _find(self, key):
+        target = key.encode("utf-8")
+        block = self._find_block(target)
+        if block < 0:
+            return None
+
+        for position, current in self._iter_keys(block, self.restart_interval):
+            if current == target:
+                return position
+            elif current > target:
+                break
+        return None
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import os
+import tempfile
+
+from s4.index import OverlayIndex
+from s4.index.binary import BinaryIndex, write_binary_index
+
+logger = logging.getLogger(__name__)
+
+# the fields the binary index format can hold
+CACHED_FIELDS = {"remote_timestamp", "local_timestamp", "content_hash"}
+
+
+class IndexCache(object):
+    """
+    Local copies of index objects stored elsewhere (such as on S3), kept decoded
+    in the binary index format along with the ETag they were stored with. An
+    object only needs to be downloaded again when its ETag changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return "IndexCache<{}>".format(self.path)
+
+    def _paths(self, name):
+        file_name = hashlib.md5(name.encode("utf-8")).hexdigest()
+        data_path = os.path.join(self.path, file_name)
+        return data_path, data_path + ".etag"
+
+    def get(self, name):
+        """
+        Return (etag, index) for the cached copy of name, or (None, None) if
+        there is none.
+        """
+        data_path, etag_path = self._paths(name)
+        try:
+            with open(etag_path, "r") as fp:
+                etag = fp.read()
+            index = BinaryIndex(data_path)
+        except (OSError, ValueError) as e:
+            logger.debug("No cached copy of %s: %s", name, e)
+            return None, None
+        return etag, OverlayIndex(index)
+
+    def put(self, name, etag, items):
+        """
+        Cache the (key, entry) items of name, which must be sorted by key.
+        Indexes with entries the binary index format cannot hold are not cached.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        data_path, etag_path = self._paths(name)
+        # a copy without its ETag is never used, so it can be replaced safely
+        try:
+            os.remove(etag_path)
+        except FileNotFoundError:
+            pass
+
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=".")
+        try:
+            with open(temp_path, "wb") as fp:
+                write_binary_index(fp, self._check_items(items))
+            os.replace(temp_path, data_path)
+        except (ValueError, TypeError) as e:
+            logger.debug("Not caching %s: %s", name, e)
+            os.remove(temp_path)
+            return
+        except Exception:
+            os.remove(temp_path)
+            raise
+        finally:
+            os.close(fd)
+
+        with open(etag_path, "w") as fp:
+            fp.write(etag)
+
+    def _check_items(self, items):
+        for key, entry in items:
+            if not set(entry) <= CACHED_FIELDS:
+                raise ValueError("Unknown index fields", key, sorted(entry))
+            yield key, entry
+
+    def remove(self, name):
+        for path in self._paths(name):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
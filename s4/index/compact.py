@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Compact in memory index.
+
+Rather than a dict holding a dict for every entry, the entries are kept sorted
+by key in a handful of flat columns:
+
+    directories   every distinct directory of the keys, stored once
+    directory ids one index into the directories per entry
+    names         the file names of the keys, UTF-8 encoded back to back
+    timestamps    remote and local timestamps as doubles (NaN for None)
+    hashes        16 bytes of content hash per entry
+    fields        which of the entry's fields are set
+
+which takes a small fraction of the memory of the equivalent dicts. Entries are
+only turned back into dicts when they are looked up.
+"""
+
+import array
+import collections.abc
+import math
+
+from s4.index import IndexItemsView, OverlayIndex, iter_sorted_items
+
+HASH_SIZE = 16
+EMPTY_HASH = bytes(HASH_SIZE)
+
+REMOTE_TIMESTAMP = 1
+LOCAL_TIMESTAMP = 2
+CONTENT_HASH = 4
+FIELDS = {
+    "remote_timestamp": REMOTE_TIMESTAMP,
+    "local_timestamp": LOCAL_TIMESTAMP,
+    "content_hash": CONTENT_HASH,
+}
+
+
+def _to_float(timestamp):
+    return float("nan") if timestamp is None else float(timestamp)
+
+
+def _to_timestamp(value):
+    return None if math.isnan(value) else value
+
+
+class CompactIndex(collections.abc.Mapping):
+    """
+    Read only index held in memory in a compact form. Wrap it in an
+    OverlayIndex to change it.
+    """
+
+    def __init__(self):
+        self._directories = []
+        self._directory_ids = array.array("I")
+        self._names = bytearray()
+        self._name_offsets = array.array("Q", [0])
+        self._remote_timestamps = array.array("d")
+        self._local_timestamps = array.array("d")
+        self._content_hashes = bytearray()
+        self._fields = bytearray()
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Create an index holding (key, entry) items, which must be sorted by key.
+        Raises ValueError if an entry holds anything other than timestamps and
+        an MD5 content hash.
+        """
+        index = cls()
+        directory_ids = {}
+        previous = None
+        for key, entry in items:
+            if previous is not None and key <= previous:
+                raise ValueError("Index keys must be unique and sorted", key)
+            previous = key
+
+            # directories keep their trailing slash, so keys are rebuilt exactly
+            split = key.rfind("/") + 1
+            directory, name = key[:split], key[split:]
+            if directory not in directory_ids:
+                directory_ids[directory] = len(index._directories)
+                index._directories.append(directory)
+            index._directory_ids.append(directory_ids[directory])
+            index._names += name.encode("utf-8")
+            index._name_offsets.append(len(index._names))
+
+            fields = 0
+            for field in entry:
+                if field not in FIELDS:
+                    raise ValueError("Unknown index field", key, field)
+                fields |= FIELDS[field]
+            index._fields.append(fields)
+
+            index._remote_timestamps.append(_to_float(entry.get("remote_timestamp")))
+            index._local_timestamps.append(_to_float(entry.get("local_timestamp")))
+            content_hash = entry.get("content_hash")
+            if content_hash is not None:
+                content_hash = bytes.fromhex(content_hash)
+                if len(content_hash) != HASH_SIZE:
+                    raise ValueError("Content hashes must be MD5 hashes", key)
+                index._content_hashes += content_hash
+            else:
+                index._content_hashes += EMPTY_HASH
+        return index
+
+    def __repr__(self):
+        return "CompactIndex<count={}, directories={}>".format(
+            len(self), len(self._directories)
+        )
+
+    def __len__(self):
+        return len(self._fields)
+
+    def _key(self, position):
+        name = self._names[
+            self._name_offsets[position] : self._name_offsets[position + 1]
+        ].decode("utf-8")
+        return self._directories[self._directory_ids[position]] + name
+
+    def _entry(self, position):
+        fields = self._fields[position]
+        entry = {}
+        if fields & REMOTE_TIMESTAMP:
+            entry["remote_timestamp"] = _to_timestamp(self._remote_timestamps[position])
+        if fields & LOCAL_TIMESTAMP:
+            entry["local_timestamp"] = _to_timestamp(self._local_timestamps[position])
+        if fields & CONTENT_HASH:
+            start = position * HASH_SIZE
+            content_hash = self._content_hashes[start : start + HASH_SIZE]
+            entry["content_hash"] = (
+                content_hash.hex() if content_hash != EMPTY_HASH else None
+            )
+        return entry
+
+    def _bisect(self, key):
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _find(self, key):
+        position = self._bisect(key)
+        if position < len(self) and self._key(position) == key:
+            return position
+        return None
+
+    def __getitem__(self, key):
+        position = self._find(key)
+        if position is None:
+            raise KeyError(key)
+        return self._entry(position)
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self._key(position)
+
+    def items(self):
+        return IndexItemsView(self)
+
+    def iter_items(self, prefix=None):
+        """
+        Yield (key, entry) for every entry sorted by key, optionally only for the
+        keys starting with prefix.
+        """
+        start = self._bisect(prefix) if prefix else 0
+        for position in range(start, len(self)):
+            key = self._key(position)
+            if prefix and not key.startswith(prefix):
+                break
+            yield key, self._entry(position)
+
+
+def compact_index(index):
+    """
+    Return a mutable copy of index backed by a CompactIndex, or index itself if
+    its entries cannot be held by one.
+    """
+    try:
+        return OverlayIndex(CompactIndex.from_items(iter_sorted_items(index)))
+    except (ValueError, TypeError):
+        return index
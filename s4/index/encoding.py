@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Encoding of JSON indexes.
+
+Indexes start with a small header saying how the JSON after it is encoded:
+
+    magic    b"S4IJ"
+    version  uint8
+    codec    uint8 (0 for none, 1 for gzip, 2 for zlib, 3 for lzma, 4 for bz2)
+
+Codecs are named by a string such as "zlib" or, to choose the compression
+level, "zlib:6". The level is not needed to decode an index, so it is not part
+of the header.
+
+Indexes written before the header was introduced are plain, gzip or zlib
+encoded JSON, which can be told apart by the first bytes of the data alone.
+"""
+
+import bz2
+import collections
+import gzip
+import json
+import struct
+import zlib
+
+try:
+    import lzma
+except ImportError:  # python may be built without liblzma
+    lzma = None
+
+MAGIC = b"S4IJ"
+VERSION = 1
+HEADER = struct.Struct("<4sBB")
+
+GZIP_SIGNATURE = b"\x1f\x8b"
+
+Codec = collections.namedtuple(
+    "Codec", ["name", "id", "compress", "decompress", "levels", "default_level"]
+)
+
+# name => Codec and id => Codec
+CODECS = {}
+CODEC_IDS = {}
+
+
+def register_codec(
+    name, codec_id, compress, decompress, levels=None, default_level=None
+):
+    """
+    Make a codec available for encoding indexes. compress(data, level) and
+    decompress(data) work on bytes, and levels is the range of valid levels.
+    """
+    codec = Codec(name, codec_id, compress, decompress, levels, default_level)
+    CODECS[name] = codec
+    CODEC_IDS[codec_id] = codec
+
+
+register_codec("none", 0, lambda data, level: data, bytes)
+register_codec(
+    "gzip",
+    1,
+    lambda data, level: gzip.compress(data, compresslevel=level),
+    gzip.decompress,
+    range(0, 10),
+    9,
+)
+register_codec("zlib", 2, zlib.compress, zlib.decompress, range(0, 10), 6)
+if lzma is not None:
+    register_codec(
+        "lzma",
+        3,
+        lambda data, level: lzma.compress(data, preset=level),
+        lzma.decompress,
+        range(0, 10),
+        6,
+    )
+register_codec("bz2", 4, bz2.compress, bz2.decompress, range(1, 10), 9)
+
+
+def parse_codec(spec):
+    """
+    Return the (Codec, level) named by a codec string such as "gzip:9".
+    """
+    name, _, level = spec.partition(":")
+    if name not in CODECS:
+        raise ValueError("Unknown index codec", spec)
+    codec = CODECS[name]
+    if not level:
+        return codec, codec.default_level
+    try:
+        level = int(level)
+    except ValueError:
+        raise ValueError("Invalid index codec level", spec)
+    if codec.levels is None or level not in codec.levels:
+        raise ValueError("Invalid index codec level", spec)
+    return codec, level
+
+
+def is_zlib(data):
+    # deflate compression method and a header checksum which is a multiple of 31
+    return len(data) >= 2 and data[0] & 0x0F == 8 and (data[0] << 8 | data[1]) % 31 == 0
+
+
+def detect_codec(data):
+    """
+    Return the name of the codec data is encoded with and the offset of the
+    encoded data.
+    """
+    if data[: len(MAGIC)] == MAGIC:
+        if len(data) < HEADER.size:
+            raise ValueError("Index header is truncated")
+        _, version, codec = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError("Unsupported index version", version)
+        if codec not in CODEC_IDS:
+            raise ValueError("Unknown index codec", codec)
+        return CODEC_IDS[codec].name, HEADER.size
+
+    if data[: len(GZIP_SIGNATURE)] == GZIP_SIGNATURE:
+        return "gzip", 0
+    if is_zlib(data):
+        return "zlib", 0
+    if not data.strip() or data.lstrip()[:1] == b"{":
+        return "none", 0
+    raise ValueError("Index is of unknown type")
+
+
+def encode_index(data, codec="gzip"):
+    """
+    Encode the JSON data of an index with the codec named by the codec string,
+    behind an index header.
+    """
+    codec, level = parse_codec(codec)
+    return HEADER.pack(MAGIC, VERSION, codec.id) + codec.compress(data, level)
+
+
+def decode_index(data):
+    """
+    Return the JSON data of an index encoded with encode_index, or of a legacy
+    index without a header.
+    """
+    codec, offset = detect_codec(data)
+    return CODECS[codec].decompress(data[offset:])
+
+
+def dumps_index(index, codec="gzip"):
+    return encode_index(json.dumps(index).encode("utf-8"), codec)
+
+
+def loads_index(data):
+    data = decode_index(data)
+    if not data.strip():
+        return {}
+    return json.loads(data.decode("utf-8"))
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Append only journal of index changes.
+
+Every change to an index entry is appended to the journal as a JSON line holding
+the key and the complete new entry (or null if the entry was removed). Replaying
+the journal on top of the last index written therefore restores every change,
+and replaying a record more than once is harmless.
+"""
+
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# the journal is synced to disk once this many records are pending...
+SYNC_RECORDS = 256
+# ...or once the oldest pending record is this many seconds old
+SYNC_INTERVAL = 1.0
+
+
+def replay_journal(path, index):
+    """
+    Apply the records of the journal at path to index. Returns the number of
+    records applied.
+    """
+    if not os.path.exists(path):
+        return 0
+
+    count = 0
+    with open(path, "rb") as fp:
+        for line in fp:
+            try:
+                key, entry = json.loads(line.decode("utf-8"))
+            except ValueError:
+                # the last record is torn if the process died while writing it,
+                # journals written by older versions may hold more records after it
+                logger.warning("Ignoring incomplete record in %s", path)
+                continue
+
+            if entry is not None:
+                index[key] = entry
+            elif key in index:
+                del index[key]
+            count += 1
+    return count
+
+
+def truncate_torn_record(fp):
+    """
+    Truncate the journal open in fp back to the end of its last complete record,
+    so that the next record appended starts on its own line.
+    """
+    end = fp.seek(0, os.SEEK_END)
+    position = end
+    while position > 0:
+        start = max(0, position - 4096)
+        fp.seek(start)
+        chunk = fp.read(position - start)
+        newline = chunk.rfind(b"\n")
+        if newline != -1:
+            position = start + newline + 1
+            break
+        position = start
+
+    if position != end:
+        logger.warning("Removing incomplete record from %s", fp.name)
+        fp.truncate(position)
+        fp.flush()
+        os.fsync(fp.fileno())
+    fp.seek(position)
+
+
+class IndexJournal(object):
+    def __init__(self, path):
+        self.path = path
+        self._fp = open(path, "r+b" if os.path.exists(path) else "w+b")
+        truncate_torn_record(self._fp)
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def __repr__(self):
+        return "IndexJournal<{}>".format(self.path)
+
+    def size(self):
+        return self._fp.tell()
+
+    def append(self, key, entry):
+        record = json.dumps([key, entry]) + "\n"
+        self._fp.write(record.encode("utf-8"))
+        self._pending += 1
+        if (
+            self._pending >= SYNC_RECORDS
+            or time.monotonic() - self._last_sync >= SYNC_INTERVAL
+        ):
+            self.sync()
+
+    def sync(self):
+        if self._pending:
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self._fp.close()
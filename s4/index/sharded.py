@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Sharded index layout.
+
+Entries are split into shards by the top level directory of their key, with the
+keys at the root of the target in a shard of their own. A small manifest lists
+the shards along with the number of entries in each of them, so shards are only
+read when one of their entries is used and only the shards which changed need
+to be written again.
+"""
+
+import collections.abc
+import hashlib
+import heapq
+import json
+import logging
+import threading
+
+from s4.index import IndexItemsView
+from s4.index.encoding import dumps_index, loads_index
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE_NAME = ".index.manifest"
+MANIFEST_VERSION = 1
+SHARD_DIRECTORY = ".index.d"
+
+
+def get_shard_name(key):
+    """
+    Return the name of the shard holding key: its top level directory, or an
+    empty string for keys at the root of the target.
+    """
+    return key.split("/", 1)[0] if "/" in key else ""
+
+
+def get_shard_file_name(name):
+    # directory names can hold characters which are awkward in file names and keys
+    return hashlib.md5(name.encode("utf-8")).hexdigest()
+
+
+def encode_shard(items, codec="gzip"):
+    return dumps_index(collections.OrderedDict(items), codec)
+
+
+def decode_shard(data):
+    return loads_index(data)
+
+
+def encode_manifest(counts):
+    manifest = {"version": MANIFEST_VERSION, "shards": counts}
+    return json.dumps(manifest, sort_keys=True).encode("utf-8")
+
+
+def decode_manifest(data):
+    """
+    Return the number of entries in each shard listed in a manifest.
+    """
+    manifest = json.loads(data.decode("utf-8"))
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError("Unsupported index manifest version", manifest.get("version"))
+    return manifest["shards"]
+
+
+class ShardedIndex(collections.abc.MutableMapping):
+    """
+    Index split into shards which are read on demand with read_shard(name).
+    counts holds the number of entries of every stored shard, as listed in the
+    manifest.
+
+    Entries are values: changing an entry means storing a new dict for its key,
+    which marks its shard as dirty.
+    """
+
+    def __init__(self, read_shard, counts=None):
+        self._read_shard = read_shard
+        self.counts = dict(counts or {})
+        self.dirty = set()
+        self._shards = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Create an index holding (key, entry) items, with every shard dirty.
+        """
+        index = cls(read_shard=None)
+        for key, entry in items:
+            index[key] = entry
+        return index
+
+    def __repr__(self):
+        return "ShardedIndex<shards={}, loaded={}, dirty={}>".format(
+            len(self.shard_names()), len(self._shards), len(self.dirty)
+        )
+
+    def _shard(self, name, create=False):
+        shard = self._shards.get(name)
+        if shard is not None:
+            return shard
+
+        with self._lock:
+            if name in self._shards:
+                return self._shards[name]
+            if name in self.counts:
+                logger.debug("Loading index shard %r", name)
+                shard = self._read_shard(name)
+            elif create:
+                shard = {}
+            else:
+                return None
+            self._shards[name] = shard
+            return shard
+
+    def __getitem__(self, key):
+        shard = self._shard(get_shard_name(key))
+        if shard is None:
+            raise KeyError(key)
+        return shard[key]
+
+    def __setitem__(self, key, entry):
+        name = get_shard_name(key)
+        with self._lock:
+            self._shard(name, create=True)[key] = entry
+            self.dirty.add(name)
+
+    def __delitem__(self, key):
+        name = get_shard_name(key)
+        with self._lock:
+            shard = self._shard(name)
+            if shard is None:
+                raise KeyError(key)
+            del shard[key]
+            self.dirty.add(name)
+
+    def __contains__(self, key):
+        shard = self._shard(get_shard_name(key))
+        return shard is not None and key in shard
+
+    def __len__(self):
+        with self._lock:
+            return sum(
+                len(self._shards[name]) if name in self._shards else self.counts[name]
+                for name in self.shard_names()
+            )
+
+    def __iter__(self):
+        for key, _ in self.iter_items():
+            yield key
+
+    def items(self):
+        return IndexItemsView(self)
+
+    def shard_names(self, prefix=None):
+        """
+        Return the names of the shards which may hold keys starting with prefix.
+        """
+        with self._lock:
+            names = set(self.counts) | set(self._shards)
+        if not prefix:
+            return names
+        if "/" in prefix:
+            return names & {get_shard_name(prefix)}
+        # keys at the root may start with the prefix as well
+        return {name for name in names if name.startswith(prefix) or name == ""}
+
+    def iter_items(self, prefix=None):
+        """
+        Yield (key, entry) for every entry sorted by key, optionally only for the
+        keys starting with prefix. Only the shards which can hold such keys are
+        read. Changes made while iterating are not seen.
+        """
+        shards = []
+        for name in sorted(self.shard_names(prefix)):
+            with self._lock:
+                shard = self._shard(name)
+                items = sorted(shard.items()) if shard is not None else []
+            if prefix:
+                items = [item for item in items if item[0].startswith(prefix)]
+            shards.append(items)
+        return heapq.merge(*shards, key=lambda item: item[0])
+
+    def get_dirty_shards(self):
+        """
+        Return (name, items) for every shard changed since it was last stored,
+        where items are sorted, or None if the shard no longer has any entries.
+        """
+        result = []
+        with self._lock:
+            for name in sorted(self.dirty):
+                shard = self._shards[name]
+                result.append((name, sorted(shard.items()) if shard else None))
+        return result
+
+    def mark_clean(self, names):
+        """
+        Record that the given shards were stored, updating the entry counts
+        which go into the manifest.
+        """
+        with self._lock:
+            for name in names:
+                self.dirty.discard(name)
+                shard = self._shards[name]
+                if shard:
+                    self.counts[name] = len(shard)
+                else:
+                    self.counts.pop(name, None)
+                    del self._shards[name]
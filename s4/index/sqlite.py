@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import collections.abc
+import sqlite3
+import threading
+
+from s4.index import IndexItemsView
+
+# number of rows fetched from the database at a time while iterating
+PAGE_SIZE = 1000
+
+
+def _to_entry(remote_timestamp, local_timestamp, content_hash):
+    entry = {"remote_timestamp": remote_timestamp, "local_timestamp": local_timestamp}
+    if content_hash is not None:
+        entry["content_hash"] = content_hash
+    return entry
+
+
+def _to_row(key, entry):
+    return (
+        key,
+        entry.get("remote_timestamp"),
+        entry.get("local_timestamp"),
+        entry.get("content_hash"),
+    )
+
+
+class SQLiteIndex(collections.abc.MutableMapping):
+    """
+    Index stored in a SQLite database. Every change is written to the database
+    straight away in its own transaction, so there is nothing left to write
+    when the index is flushed and only the entries which are used are read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        # statements are run in autocommit mode, each of them in a transaction
+        self._connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, "
+            "remote_timestamp REAL, "
+            "local_timestamp REAL, "
+            "content_hash TEXT"
+            ") WITHOUT ROWID"
+        )
+
+    def __repr__(self):
+        return "SQLiteIndex<{}>".format(self.path)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _execute(self, *args):
+        with self._lock:
+            return self._connection.execute(*args).fetchall()
+
+    def __getitem__(self, key):
+        rows = self._execute(
+            "SELECT remote_timestamp, local_timestamp, content_hash "
+            "FROM entries WHERE key = ?",
+            (key,),
+        )
+        if not rows:
+            raise KeyError(key)
+        return _to_entry(*rows[0])
+
+    def __setitem__(self, key, entry):
+        self._execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", _to_row(key, entry)
+        )
+
+    def __delitem__(self, key):
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM entries WHERE key = ?", (key,)
+            )
+            if cursor.rowcount == 0:
+                raise KeyError(key)
+
+    def __contains__(self, key):
+        return bool(self._execute("SELECT 1 FROM entries WHERE key = ?", (key,)))
+
+    def __len__(self):
+        return self._execute("SELECT COUNT(*) FROM entries")[0][0]
+
+    def __iter__(self):
+        for key, _ in self.iter_items():
+            yield key
+
+    def items(self):
+        return IndexItemsView(self)
+
+    def iter_items(self, prefix=None):
+        """
+        Yield (key, entry) for every entry sorted by key, optionally only for the
+        keys starting with prefix. Rows are fetched a page at a time so the
+        database is not locked while the caller works on them.
+        """
+        # SQLite compares text as UTF-8 bytes, which sorts the same as python
+        rows = self._execute(
+            "SELECT * FROM entries WHERE key >= ? ORDER BY key LIMIT ?",
+            (prefix or "", PAGE_SIZE),
+        )
+        while rows:
+            for key, remote_timestamp, local_timestamp, content_hash in rows:
+                if prefix and not key.startswith(prefix):
+                    return
+                yield key, _to_entry(remote_timestamp, local_timestamp, content_hash)
+
+            rows = self._execute(
+                "SELECT * FROM entries WHERE key > ? ORDER BY key LIMIT ?",
+                (rows[-1][0], PAGE_SIZE),
+            )
+
+    def replace(self, items):
+        """
+        Replace every entry in the index with (key, entry) items in a single
+        transaction.
+        """
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.execute("DELETE FROM entries")
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                    (_to_row(key, entry) for key, entry in items),
+                )
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
@@ -1,17 +1,194 @@
 #! -*- encoding: utf8 -*-
 
+import collections
+import os
 from os import scandir
 
-from inotify_simple import INotify
+from inotify_simple import INotify, flags
+
+# An inotify event along with the root of the watched tree it happened in and the
+# key of the file or directory it is about, relative to that root. Moves within
+# the watched trees are reported as a single MOVED_TO event whose source is the
+# key the file or directory was moved from. Events without a root mean that the
+# event queue overflowed and events were lost.
+RecursiveEvent = collections.namedtuple(
+    "RecursiveEvent", ["wd", "mask", "cookie", "name", "root", "key", "source"]
+)
+
+
+def _join(directory, name):
+    if isinstance(directory, bytes):
+        name = os.fsencode(name)
+    return os.path.join(directory, name) if name else directory
+
+
+def _get_key(root, path):
+    key = os.fsdecode(os.path.relpath(path, root))
+    if key == os.curdir:
+        return ""
+    return key.replace(os.sep, "/")
 
 
 class INotifyRecursive(INotify):
-    def add_watches(self, path, mask):
+    # needed on every directory to keep track of the directories below it
+    DIRECTORY_FLAGS = flags.CREATE | flags.DELETE | flags.MOVED_FROM | flags.MOVED_TO
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # wd => path of the watched directory
+        self.watch_paths = {}
+        # wd => root of the tree the directory is in
+        self.watch_roots = {}
+        # root => mask its directories are watched with
+        self.root_masks = {}
+        # root => callable telling if a key below it is ignored
+        self.root_ignores = {}
+
+    def add_watches(self, path, mask, ignore=None, root=None):
+        """
+        Watch path and every directory below it. Directories created or moved
+        into the tree later on are watched as they appear. If given, ignore is
+        called with the key of every file and directory relative to path:
+        ignored directories are not watched and no events are returned for
+        ignored keys. Returns a dict of the new watch descriptors and the paths
+        they are on.
+        """
+        if root is None:
+            root = path
+            self.root_masks[root] = mask
+            self.root_ignores[root] = ignore
         results = {}
-        results[self.add_watch(path, mask)] = path
+        try:
+            wd = self.add_watch(path, mask | self.DIRECTORY_FLAGS)
+        except FileNotFoundError:
+            # removed before it could be watched
+            return results
+        results[wd] = path
+        self.watch_paths[wd] = path
+        self.watch_roots[wd] = root
 
-        for item in scandir(path):
-            if item.is_dir():
-                results.update(self.add_watches(item.path, mask))
+        try:
+            items = list(scandir(path))
+        except FileNotFoundError:
+            items = []
+        for item in items:
+            if item.is_dir() and not self._is_ignored(root, _get_key(root, item.path)):
+                results.update(self.add_watches(item.path, mask, root=root))
 
         return results
+
+    def update_watches(self, root, ignore=None):
+        """
+        Apply new ignore rules to the tree watched from root: directories which
+        are no longer ignored are watched and the ones which now are are not.
+        Directories already being watched keep their watch, so no events are
+        missed while doing so.
+        """
+        self.add_watches(root, self.root_masks[root], ignore=ignore)
+        for wd, path in list(self.watch_paths.items()):
+            if self.watch_roots.get(wd) == root and self._is_ignored(
+                root, _get_key(root, path)
+            ):
+                self.remove_watches(path)
+
+    def remove_watches(self, path):
+        """
+        Stop watching path and every directory below it.
+        """
+        for wd in self._find_watches(path):
+            try:
+                self.rm_watch(wd)
+            except OSError:
+                # the kernel already removed it along with the directory
+                pass
+            self._forget(wd)
+
+    def _find_watches(self, path):
+        prefix = _join(path, "")
+        return [
+            wd
+            for wd, watch_path in self.watch_paths.items()
+            if watch_path == path or watch_path.startswith(prefix)
+        ]
+
+    def _is_ignored(self, root, key):
+        ignore = self.root_ignores.get(root)
+        return bool(key) and ignore is not None and ignore(key)
+
+    def _forget(self, wd):
+        self.watch_paths.pop(wd, None)
+        self.watch_roots.pop(wd, None)
+
+    def _move_watches(self, source, destination, root):
+        for wd in self._find_watches(source):
+            self.watch_paths[wd] = destination + self.watch_paths[wd][len(source) :]
+            self.watch_roots[wd] = root
+
+    def read(self, timeout=None, read_delay=None):
+        """
+        Return the RecursiveEvents which happened, keeping the watches up to date
+        with the directories which were created, removed or moved.
+        """
+        results = []
+        # cookie => (position in results, path, key) of moves not yet paired up
+        moves = {}
+
+        for event in super().read(timeout=timeout, read_delay=read_delay):
+            if event.mask & flags.Q_OVERFLOW:
+                results.append(RecursiveEvent(*event, None, None, None))
+                continue
+            if event.mask & flags.IGNORED:
+                self._forget(event.wd)
+                continue
+
+            directory = self.watch_paths.get(event.wd)
+            if directory is None:
+                continue
+            root = self.watch_roots[event.wd]
+            path = _join(directory, event.name)
+            key = _get_key(root, path)
+            is_dir = event.mask & flags.ISDIR
+            ignored = self._is_ignored(root, key)
+
+            # the directory flags are added to every watch, but their events
+            # are only passed on if they were asked for
+            wanted = event.mask & self.root_masks[root] and not ignored
+
+            source = None
+            if event.mask & flags.MOVED_FROM:
+                moves[event.cookie] = (
+                    len(results) if wanted else None,
+                    path,
+                    None if ignored else key,
+                )
+            elif event.mask & flags.MOVED_TO and event.cookie in moves:
+                position, source_path, source = moves.pop(event.cookie)
+                if ignored:
+                    # only the MOVED_FROM event is left to see
+                    if is_dir:
+                        self.remove_watches(source_path)
+                else:
+                    if position is not None:
+                        results[position] = None
+                    if is_dir and source is None:
+                        # moved out of an ignored directory
+                        self.add_watches(path, self.root_masks[root], root=root)
+                    elif is_dir:
+                        self._move_watches(source_path, path, root)
+            elif (
+                is_dir and not ignored and event.mask & (flags.CREATE | flags.MOVED_TO)
+            ):
+                self.add_watches(path, self.root_masks[root], root=root)
+            elif is_dir and event.mask & flags.DELETE:
+                self.remove_watches(path)
+
+            if wanted:
+                results.append(RecursiveEvent(*event, root, key, source))
+            elif event.mask & flags.MOVED_FROM:
+                results.append(None)
+
+        # moved out of the watched trees
+        for _, path, _ in moves.values():
+            self.remove_watches(path)
+
+        return [event for event in results if event is not None]
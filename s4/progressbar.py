@@ -9,6 +9,8 @@ class ProgressBar(object):
     """
 
     pbar = None
+    # number of transfers sharing the current bar
+    active = 0
 
     def __new__(cls, *args, **kwargs):
         if cls.pbar:
@@ -23,3 +25,22 @@ class ProgressBar(object):
     @classmethod
     def close(cls):
         cls.pbar.close()
+
+    @classmethod
+    def start_transfer(cls, total, **kwargs):
+        """
+        Add a transfer to a progress bar shared by concurrent transfers,
+        creating the bar if there is no transfer currently running.
+        """
+        if cls.active == 0:
+            cls(total=total, **kwargs)
+        else:
+            cls.pbar.total += total
+            cls.pbar.refresh()
+        cls.active += 1
+
+    @classmethod
+    def finish_transfer(cls):
+        cls.active -= 1
+        if cls.active == 0:
+            cls.close()
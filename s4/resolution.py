@@ -7,13 +7,18 @@ class Resolution(object):
     UPDATE = "UPDATE"
     CREATE = "CREATE"
     DELETE = "DELETE"
+    # only the index needs updating, the contents are the same on both clients
+    REINDEX = "REINDEX"
+    # source_key was renamed to key, so it can be moved rather than transferred
+    MOVE = "MOVE"
 
-    def __init__(self, action, to_client, from_client, key, timestamp):
+    def __init__(self, action, to_client, from_client, key, timestamp, source_key=None):
         self.action = action
         self.to_client = to_client
         self.from_client = from_client
         self.key = key
         self.timestamp = timestamp
+        self.source_key = source_key
 
     def __eq__(self, other):
         if not isinstance(other, Resolution):
@@ -24,16 +29,20 @@ class Resolution(object):
             and self.from_client == other.from_client
             and self.key == other.key
             and self.timestamp == other.timestamp
+            and self.source_key == other.source_key
         )
 
     def __repr__(self):
-        return "Resolution<action={}, to={}, from={}, key={}, timestamp={}>".format(
+        result = "Resolution<action={}, to={}, from={}, key={}, timestamp={}".format(
             self.action,
             self.to_client.get_uri() if self.to_client is not None else None,
             self.from_client.get_uri() if self.from_client is not None else None,
             self.key,
             self.timestamp,
         )
+        if self.source_key is not None:
+            result += ", source_key={}".format(self.source_key)
+        return result + ">"
 
     @staticmethod
     def get_resolution(key, sync_state, to_client, from_client):
@@ -1,13 +1,29 @@
 # -*- coding: utf-8 -*-
 
+import collections
+import concurrent.futures
+import functools
+import itertools
 import logging
+import threading
+import time
 import traceback
 
-from s4.clients import SyncState
+from s4.clients import SyncState, merge_sorted
+from s4.index import find_keys_under
 from s4.resolution import Resolution
 
 
 class SyncWorker(object):
+    # the most keys S3 accepts in a single delete_objects request
+    DELETE_BATCH_SIZE = 1000
+    # seconds between writing the indexes during a sync, so that a crash only
+    # loses track of the work done since then
+    CHECKPOINT_INTERVAL = 300
+    # transfers queued per job before planning waits for some to complete, so
+    # that memory use does not grow with the number of keys being synced
+    PENDING_PER_JOB = 4
+
     def __init__(
         self,
         client_1,
@@ -17,6 +33,10 @@ class SyncWorker(object):
         complete_callback=None,
         action_callback=None,
         conflict_handler=None,
+        jobs=1,
+        detect_moves=False,
+        callback_lock=None,
+        stop_event=None,
     ):
         self.client_1 = client_1
         self.client_2 = client_2
@@ -26,52 +46,105 @@ class SyncWorker(object):
         self.complete_callback = complete_callback
         self.action_callback = action_callback
         self.conflict_handler = conflict_handler
+        self.jobs = jobs
+        self.detect_moves = detect_moves
+        # callbacks are not expected to be thread safe, so they are serialised
+        # (across several workers if they share the same lock)
+        self._callback_lock = callback_lock or threading.Lock()
+        # once set, no more work is started and the work done so far is indexed
+        self.stop_event = stop_event
 
     def __repr__(self):
         return "SyncWorker<{}, {}>".format(
             self.client_1.get_uri(), self.client_2.get_uri()
         )
 
-    def sync(self, conflict_choice=None, keys=None, dry_run=False):
+    def stopped(self):
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def sync(
+        self, conflict_choice=None, keys=None, dry_run=False, refresh=True, flush=True
+    ):
+        """
+        Synchronise both clients. Unless refresh is set to False, the listings
+        the clients cached during earlier sessions are dropped first, and the
+        indexes are only written when flush is True: long running callers can
+        rely on the clients keeping track of their own changes in between.
+        """
         self.client_1.lock()
         self.client_2.lock()
         try:
-            resolutions, unhandled_events = self.get_sync_states(keys)
-
-            self.logger.debug(
-                "There are %s unhandled events for the user to solve",
-                len(unhandled_events),
+            if refresh:
+                self.client_1.invalidate_listing()
+                self.client_2.invalidate_listing()
+
+            # Resolutions which can be decided automatically are run while the rest
+            # of the keys are still being classified. Only conflicts are held back
+            # until every key has been seen so they can be handed to the user
+            # (as well as creations and deletions when looking for moved keys).
+            unhandled_events = {}
+            resolutions = self.iter_resolutions(keys, unhandled_events)
+            conflict_resolutions = self.iter_conflict_resolutions(
+                unhandled_events, conflict_choice
             )
-            self.logger.debug(
-                "There are %s automatically resolved calls", len(resolutions)
+            self.execute_resolutions(
+                itertools.chain(resolutions, conflict_resolutions), dry_run, flush
             )
-            for key in sorted(unhandled_events.keys()):
-                action_1, action_2 = unhandled_events[key]
-                if conflict_choice == "1":
-                    resolutions[key] = Resolution.get_resolution(
-                        key, action_1, self.client_2, self.client_1
-                    )
-                elif conflict_choice == "2":
-                    resolutions[key] = Resolution.get_resolution(
-                        key, action_2, self.client_1, self.client_2
-                    )
-                if self.conflict_handler is not None:
-                    resolution = self.conflict_handler(
-                        key, action_1, self.client_1, action_2, self.client_2
-                    )
-                    if resolution is not None:
-                        resolutions[key] = resolution
-                    else:
-                        self.logger.info("Ignoring sync conflict for %s", key)
-                else:
-                    self.logger.info("Unable to resolve conflict for %s", key)
-
-            self.run_resolutions(resolutions, dry_run)
 
         finally:
             self.client_1.unlock()
             self.client_2.unlock()
 
+    def iter_resolutions(self, keys, unhandled_events):
+        held_back = {}
+        for key, resolution, unhandled_event in self.iter_sync_states(keys):
+            if resolution is None:
+                unhandled_events[key] = unhandled_event
+            elif self.detect_moves and resolution.action in (
+                Resolution.CREATE,
+                Resolution.DELETE,
+            ):
+                held_back[key] = resolution
+            else:
+                yield key, resolution
+
+        if held_back:
+            resolutions = self.pair_moves(held_back)
+            for key in sorted(resolutions.keys()):
+                yield key, resolutions[key]
+
+    def iter_conflict_resolutions(self, unhandled_events, conflict_choice=None):
+        self.logger.debug(
+            "There are %s unhandled events for the user to solve",
+            len(unhandled_events),
+        )
+        for key in sorted(unhandled_events.keys()):
+            if self.stopped():
+                return
+            action_1, action_2 = unhandled_events[key]
+            resolution = None
+            if conflict_choice == "1":
+                resolution = Resolution.get_resolution(
+                    key, action_1, self.client_2, self.client_1
+                )
+            elif conflict_choice == "2":
+                resolution = Resolution.get_resolution(
+                    key, action_2, self.client_1, self.client_2
+                )
+            if self.conflict_handler is not None:
+                handler_resolution = self.conflict_handler(
+                    key, action_1, self.client_1, action_2, self.client_2
+                )
+                if handler_resolution is not None:
+                    resolution = handler_resolution
+                else:
+                    self.logger.info("Ignoring sync conflict for %s", key)
+            else:
+                self.logger.info("Unable to resolve conflict for %s", key)
+
+            if resolution is not None:
+                yield key, resolution
+
     def get_sync_states(self, keys=None):
         # we store a list of resolutions to make sure we can handle everything before
         # running any updates on the file system and indexes
@@ -81,9 +154,80 @@ class SyncWorker(object):
         # the automated solution has not yet been implemented)
         unhandled_events = {}
 
+        for key, resolution, unhandled_event in self.iter_sync_states(keys):
+            if resolution is not None:
+                resolutions[key] = resolution
+            else:
+                unhandled_events[key] = unhandled_event
+
+        if self.detect_moves:
+            resolutions = self.pair_moves(resolutions)
+
+        return resolutions, unhandled_events
+
+    def pair_moves(self, resolutions):
+        """
+        Replace a DELETE and a CREATE on the same client which refer to the same
+        contents with a single MOVE resolution, so that renamed keys are moved on
+        the other client rather than being transferred all over again.
+        """
+        deleted = collections.defaultdict(list)
+        for key in sorted(resolutions.keys()):
+            resolution = resolutions[key]
+            if resolution.action != Resolution.DELETE:
+                continue
+            # the key still exists on the client it is being deleted from. If that
+            # client cannot hash it (e.g. a multipart upload), fall back to the hash
+            # recorded when the key was last synced on the other client
+            client = resolution.to_client
+            other_client = self.client_2 if client is self.client_1 else self.client_1
+            content_hash = client.get_content_hash(key)
+            if content_hash is None:
+                content_hash = other_client.get_index_content_hash(key)
+            if content_hash is not None:
+                deleted[client, client.get_size(key), content_hash].append(key)
+
+        if not deleted:
+            return resolutions
+
+        results = dict(resolutions)
+        for key in sorted(resolutions.keys()):
+            resolution = resolutions[key]
+            if resolution.action != Resolution.CREATE:
+                continue
+            client = resolution.from_client
+            content_hash = client.get_content_hash(key)
+            if content_hash is None:
+                continue
+            source_keys = deleted.get(
+                (resolution.to_client, client.get_size(key), content_hash)
+            )
+            if not source_keys:
+                continue
+
+            source_key = source_keys.pop(0)
+            del results[source_key]
+            results[key] = Resolution(
+                Resolution.MOVE,
+                resolution.to_client,
+                resolution.from_client,
+                key,
+                resolution.timestamp,
+                source_key=source_key,
+            )
+            self.logger.debug("Detected move of %s to %s", source_key, key)
+
+        return results
+
+    def iter_sync_states(self, keys=None):
+        """
+        Yields (key, resolution, unhandled_event) tuples for every key which needs
+        attention. Exactly one of resolution or unhandled_event is set.
+        """
         self.logger.debug("Generating deferred calls based on client states")
         for key, state_1, state_2 in self.get_states(keys):
             self.logger.debug("%s: %s %s", key, state_1, state_2)
+            resolution = None
             if (
                 state_1.state == SyncState.NOCHANGES
                 and state_2.state == SyncState.NOCHANGES
@@ -91,7 +235,7 @@ class SyncWorker(object):
                 if state_1.remote_timestamp == state_2.remote_timestamp:
                     continue
                 elif state_1.remote_timestamp > state_2.remote_timestamp:
-                    resolutions[key] = Resolution(
+                    resolution = Resolution(
                         Resolution.UPDATE,
                         self.client_2,
                         self.client_1,
@@ -99,7 +243,7 @@ class SyncWorker(object):
                         state_1.remote_timestamp,
                     )
                 elif state_2.remote_timestamp > state_1.remote_timestamp:
-                    resolutions[key] = Resolution(
+                    resolution = Resolution(
                         Resolution.UPDATE,
                         self.client_1,
                         self.client_2,
@@ -111,7 +255,7 @@ class SyncWorker(object):
                 state_1.state == SyncState.CREATED
                 and state_2.state == SyncState.DOESNOTEXIST
             ):
-                resolutions[key] = Resolution(
+                resolution = Resolution(
                     Resolution.CREATE,
                     self.client_2,
                     self.client_1,
@@ -123,7 +267,7 @@ class SyncWorker(object):
                 state_2.state == SyncState.CREATED
                 and state_1.state == SyncState.DOESNOTEXIST
             ):
-                resolutions[key] = Resolution(
+                resolution = Resolution(
                     Resolution.CREATE,
                     self.client_1,
                     self.client_2,
@@ -135,7 +279,7 @@ class SyncWorker(object):
                 state_1.state == SyncState.NOCHANGES
                 and state_2.state == SyncState.DOESNOTEXIST
             ):
-                resolutions[key] = Resolution(
+                resolution = Resolution(
                     Resolution.CREATE,
                     self.client_2,
                     self.client_1,
@@ -147,7 +291,7 @@ class SyncWorker(object):
                 state_2.state == SyncState.NOCHANGES
                 and state_1.state == SyncState.DOESNOTEXIST
             ):
-                resolutions[key] = Resolution(
+                resolution = Resolution(
                     Resolution.CREATE,
                     self.client_1,
                     self.client_2,
@@ -158,7 +302,7 @@ class SyncWorker(object):
                 state_1.state == SyncState.UPDATED
                 and state_2.state == SyncState.DOESNOTEXIST
             ):
-                resolutions[key] = Resolution(
+                resolution = Resolution(
                     Resolution.CREATE,
                     self.client_2,
                     self.client_1,
@@ -170,7 +314,7 @@ class SyncWorker(object):
                 state_2.state == SyncState.UPDATED
                 and state_1.state == SyncState.DOESNOTEXIST
             ):
-                resolutions[key] = Resolution(
+                resolution = Resolution(
                     Resolution.CREATE,
                     self.client_2,
                     self.client_1,
@@ -185,12 +329,40 @@ class SyncWorker(object):
                 # nothing to do, they have already both been deleted/do not exist
                 continue
 
+            elif (
+                state_1.state == SyncState.UPDATED
+                and state_2.state == SyncState.NOCHANGES
+                and state_1.remote_timestamp == state_2.remote_timestamp
+                and self.has_same_contents(self.client_1, key)
+            ):
+                resolution = Resolution(
+                    Resolution.REINDEX,
+                    self.client_1,
+                    None,
+                    key,
+                    state_1.local_timestamp,
+                )
+
+            elif (
+                state_2.state == SyncState.UPDATED
+                and state_1.state == SyncState.NOCHANGES
+                and state_1.remote_timestamp == state_2.remote_timestamp
+                and self.has_same_contents(self.client_2, key)
+            ):
+                resolution = Resolution(
+                    Resolution.REINDEX,
+                    self.client_2,
+                    None,
+                    key,
+                    state_2.local_timestamp,
+                )
+
             elif (
                 state_1.state == SyncState.UPDATED
                 and state_2.state == SyncState.NOCHANGES
                 and state_1.remote_timestamp == state_2.remote_timestamp
             ):
-                resolutions[key] = Resolution(
+                resolution = Resolution(
                     Resolution.UPDATE,
                     self.client_2,
                     self.client_1,
@@ -203,7 +375,7 @@ class SyncWorker(object):
                 and state_1.state == SyncState.NOCHANGES
                 and state_1.remote_timestamp == state_2.remote_timestamp
             ):
-                resolutions[key] = Resolution(
+                resolution = Resolution(
                     Resolution.UPDATE,
                     self.client_1,
                     self.client_2,
@@ -216,7 +388,7 @@ class SyncWorker(object):
                 and state_2.state == SyncState.NOCHANGES
                 and state_1.remote_timestamp == state_2.remote_timestamp
             ):
-                resolutions[key] = Resolution(
+                resolution = Resolution(
                     Resolution.DELETE,
                     self.client_2,
                     None,
@@ -229,7 +401,7 @@ class SyncWorker(object):
                 and state_1.state == SyncState.NOCHANGES
                 and state_1.remote_timestamp == state_2.remote_timestamp
             ):
-                resolutions[key] = Resolution(
+                resolution = Resolution(
                     Resolution.DELETE,
                     self.client_1,
                     None,
@@ -242,7 +414,7 @@ class SyncWorker(object):
                 and state_2.state == SyncState.CREATED
                 and state_1.remote_timestamp == state_2.remote_timestamp
             ):
-                resolutions[key] = Resolution(
+                resolution = Resolution(
                     Resolution.CREATE,
                     self.client_1,
                     self.client_2,
@@ -255,7 +427,7 @@ class SyncWorker(object):
                 and state_1.state == SyncState.CREATED
                 and state_1.remote_timestamp == state_2.remote_timestamp
             ):
-                resolutions[key] = Resolution(
+                resolution = Resolution(
                     Resolution.CREATE,
                     self.client_2,
                     self.client_1,
@@ -264,94 +436,365 @@ class SyncWorker(object):
                 )
 
             else:
-                unhandled_events[key] = (state_1, state_2)
-
-            self.logger.debug("Action=%s", resolutions.get(key))
+                yield key, None, (state_1, state_2)
+                continue
 
-        return resolutions, unhandled_events
+            self.logger.debug("Action=%s", resolution)
+            if resolution is not None:
+                yield key, resolution, None
 
     def run_resolutions(self, resolutions, dry_run=False):
         # call everything once we know we can handle all of it
         self.logger.debug("There are %s total deferred calls", len(resolutions))
+        return self.execute_resolutions(
+            ((key, resolutions[key]) for key in sorted(resolutions.keys())), dry_run
+        )
+
+    def execute_resolutions(self, resolutions, dry_run=False, flush=True):
+        """
+        Run an iterable of (key, resolution) pairs. Each resolution is started as
+        soon as it is produced, so transfers overlap with the planning of later
+        keys when running with more than one job (up to PENDING_PER_JOB transfers
+        per job are queued at a time). Deletions on clients which support it are
+        collected and run in batches of DELETE_BATCH_SIZE keys, other deletions
+        are run straight away.
+        """
+        if self.jobs > 1 and not dry_run:
+            self.logger.debug("Running with %s concurrent jobs", self.jobs)
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs)
+        else:
+            executor = None
+
         success = []
+        # future => key of the transfer, or None for a batch of deletions
+        futures = collections.OrderedDict()
+        last_checkpoint = time.monotonic()
+        pending_deletes = collections.OrderedDict()
+        # client => set of the keys in its pending deletes
+        pending_delete_keys = collections.defaultdict(set)
+
+        def submit_deletes(client, wait=False):
+            batch = pending_deletes.pop(client)
+            pending_delete_keys.pop(client)
+            if executor is None:
+                success.extend(self.run_delete_batch(batch))
+            else:
+                future = executor.submit(self.run_delete_batch, batch)
+                futures[future] = None
+                if wait:
+                    future.result()
+
+        def collect(limit=0):
+            # results are collected in the order the work was submitted, waiting
+            # for the oldest future while more than limit are pending
+            while futures:
+                future, key = next(iter(futures.items()))
+                if len(futures) <= limit and not future.done():
+                    break
+                del futures[future]
+                if future.cancelled():
+                    continue
+                if key is None:
+                    success.extend(future.result())
+                elif future.result():
+                    success.append(key)
+
+        def has_pending_parent(client, key):
+            # whether a file in the way of one of the directories of key is
+            # still to be deleted
+            pending_keys = pending_delete_keys.get(client)
+            if not pending_keys:
+                return False
+            parts = key.split("/")
+            return any(
+                "/".join(parts[:position]) in pending_keys
+                for position in range(1, len(parts))
+            )
+
         try:
-            for key in sorted(resolutions.keys()):
-                resolution = resolutions[key]
-                if self.action_callback is not None:
-                    self.action_callback(resolution)
-
-                if resolution.action == Resolution.UPDATE:
-                    deferred_function = self.move_client
-                elif resolution.action == Resolution.CREATE:
-                    deferred_function = self.move_client
-                elif resolution.action == Resolution.DELETE:
-                    deferred_function = self.delete_client
+            try:
+                for key, resolution in resolutions:
+                    if self.stopped():
+                        break
+                    if self.action_callback is not None:
+                        self.action_callback(resolution)
+
+                    deferred_function = self.get_deferred_function(resolution)
+
+                    if dry_run:
+                        continue
+
+                    client = resolution.to_client
+                    if resolution.action == Resolution.DELETE and client.BATCH_DELETES:
+                        pending_deletes.setdefault(client, []).append(resolution)
+                        pending_delete_keys[client].add(key)
+                        if len(pending_deletes[client]) >= self.DELETE_BATCH_SIZE:
+                            submit_deletes(client)
+                        continue
+
+                    if has_pending_parent(client, key):
+                        # a file being replaced by a directory needs to be
+                        # deleted before anything is written in the directory
+                        submit_deletes(client, wait=True)
+
+                    if executor is None or resolution.action == Resolution.DELETE:
+                        # other deletions are run in key order along with the
+                        # transfers for the same reason
+                        if self.run_deferred_function(
+                            key, deferred_function, resolution
+                        ):
+                            success.append(key)
+                    else:
+                        collect(limit=self.jobs * self.PENDING_PER_JOB - 1)
+                        future = executor.submit(
+                            self.run_deferred_function,
+                            key,
+                            deferred_function,
+                            resolution,
+                        )
+                        futures[future] = key
+
+                    if (
+                        flush
+                        and time.monotonic() - last_checkpoint
+                        >= self.CHECKPOINT_INTERVAL
+                    ):
+                        # the entries of the transfers which completed so far
+                        # are written, including those of the remote client
+                        # which is otherwise only written once the sync is done
+                        self.flush_index()
+                        last_checkpoint = time.monotonic()
+
+                if self.stopped():
+                    # transfers which are queued are skipped, the ones already
+                    # running are waited for so that they can be indexed
+                    self.logger.warning("Session stopped. Cleaning up....")
                 else:
-                    raise ValueError("Unknown resolution", resolution)
+                    for client in list(pending_deletes.keys()):
+                        submit_deletes(client)
 
-                if dry_run:
-                    continue
+                collect()
+            except KeyboardInterrupt:
+                self.logger.warning(
+                    "Session interrupted by Keyboard Interrupt. Cleaning up...."
+                )
+                for future in futures:
+                    future.cancel()
+            finally:
+                if executor is not None:
+                    executor.shutdown(wait=True)
+        finally:
+            # transfers which completed before an interrupt still need to be
+            # indexed, as do the ones which were started before any other error
+            # (which is only raised once they are)
+            collect()
+
+            self.logger.debug("Ran %s deferred calls successfully", len(success))
+            if len(success) > 0 and flush:
+                self.flush_index()
+            elif len(success) > 0:
+                self.client_1.resolve_deferred_index_entries()
+                self.client_2.resolve_deferred_index_entries()
+            else:
+                self.logger.info("Nothing to update")
 
-                try:
-                    deferred_function(resolution)
-                    self.client_1.update_index_entry(key)
-                    self.client_2.update_index_entry(key)
-                    success.append(key)
-                except Exception as e:
-                    self.logger.error(
-                        "An error occurred while trying to update %s:\n%s", key, e
-                    )
-                    self.logger.debug(traceback.format_exc())
-        except KeyboardInterrupt:
-            self.logger.warning(
-                "Session interrupted by Keyboard Interrupt. Cleaning up...."
-            )
+        return success
 
-        if len(success) > 0:
-            self.logger.info("Flushing Index to Storage")
-            self.client_1.flush_index()
-            self.client_2.flush_index()
+    def flush_index(self):
+        self.logger.info("Flushing Index to Storage")
+        self.client_1.flush_index()
+        self.client_2.flush_index()
+
+    def has_same_contents(self, client, key):
+        """
+        Check whether the contents of key on client are the same as when it was
+        last synced, so that a changed timestamp alone does not cause a transfer.
+        """
+        index_hash = client.get_index_content_hash(key)
+        if index_hash is None:
+            return False
+        return client.get_content_hash(key) == index_hash
+
+    def get_deferred_function(self, resolution):
+        if resolution.action == Resolution.UPDATE:
+            return self.move_client
+        elif resolution.action == Resolution.CREATE:
+            return self.move_client
+        elif resolution.action == Resolution.DELETE:
+            return self.delete_client
+        elif resolution.action == Resolution.REINDEX:
+            return self.reindex_client
+        elif resolution.action == Resolution.MOVE:
+            return self.rename_client
         else:
-            self.logger.info("Nothing to update")
+            raise ValueError("Unknown resolution", resolution)
+
+    def run_deferred_function(self, key, deferred_function, resolution):
+        if self.stopped():
+            return False
+        try:
+            deferred_function(resolution)
+            self.client_1.update_index_entry(key)
+            self.client_2.update_index_entry(key)
+            if resolution.source_key is not None:
+                self.client_1.update_index_entry(resolution.source_key)
+                self.client_2.update_index_entry(resolution.source_key)
+            return True
+        except Exception as e:
+            self.logger.error(
+                "An error occurred while trying to update %s:\n%s", key, e
+            )
+            self.logger.debug(traceback.format_exc())
+            return False
+
+    def run_delete_batch(self, resolutions):
+        """
+        Delete the keys of several DELETE resolutions for the same client with a
+        single call to delete_many. Returns the keys which were deleted and indexed
+        successfully.
+        """
+        if self.stopped():
+            return []
+        client = resolutions[0].to_client
+        keys = [resolution.key for resolution in resolutions]
+        try:
+            errors = client.delete_many(keys)
+        except Exception as e:
+            self.logger.error(
+                "An error occurred while trying to delete %s keys:\n%s", len(keys), e
+            )
+            self.logger.debug(traceback.format_exc())
+            return []
 
+        success = []
+        for resolution in resolutions:
+            key = resolution.key
+            if key in errors:
+                self.logger.error(
+                    "An error occurred while trying to delete %s:\n%s",
+                    key,
+                    errors[key],
+                )
+                continue
+            try:
+                client.set_remote_timestamp(key, resolution.timestamp)
+                self.client_1.update_index_entry(key)
+                self.client_2.update_index_entry(key)
+                success.append(key)
+            except Exception as e:
+                self.logger.error(
+                    "An error occurred while trying to update %s:\n%s", key, e
+                )
+                self.logger.debug(traceback.format_exc())
         return success
 
     def get_states(self, keys=None):
-        client_1_actions = self.client_1.get_all_actions()
-        client_2_actions = self.client_2.get_all_actions()
-
-        all_keys = set(client_1_actions) | set(client_2_actions)
-        self.logger.debug(
-            "%s keys in total (%s for %s and %s for %s)",
-            len(all_keys),
-            len(client_1_actions),
-            self.client_1.get_uri(),
-            len(client_2_actions),
-            self.client_2.get_uri(),
+        # Both clients produce their states sorted by key, so they can be merge-joined
+        # without holding the full keys of either client in memory
+        states = merge_sorted(
+            self.client_1.iter_actions(), self.client_2.iter_actions()
         )
+
+        DOES_NOT_EXIST = SyncState(SyncState.DOESNOTEXIST, None, None)
         if keys is None:
-            target_keys = sorted(all_keys)
+            total = 0
+            for key, (action_1, action_2) in states:
+                total += 1
+                yield key, action_1 or DOES_NOT_EXIST, action_2 or DOES_NOT_EXIST
+            self.logger.debug(
+                "%s keys in total for %s and %s",
+                total,
+                self.client_1.get_uri(),
+                self.client_2.get_uri(),
+            )
         else:
-            target_keys = keys
+            # only the given keys are looked at, so the cost does not depend on
+            # the number of keys the clients hold
+            for key in self.expand_keys(keys):
+                self.client_1.invalidate_listing(key)
+                self.client_2.invalidate_listing(key)
+                yield key, self.client_1.get_action(key), self.client_2.get_action(key)
+
+    def expand_keys(self, keys):
+        """
+        Return the keys to sync for the given keys: each key which is not ignored
+        by either client, followed by the keys under it if it is a directory.
+        Only keys which are directories on disk, or which are missing from an
+        index, are looked for in the indexes.
+        """
+        clients = (self.client_1, self.client_2)
+        given = collections.OrderedDict()
+        # prefixes to look up in the index of each client
+        prefixes = ([], [])
+        for key in keys:
+            key = key.strip("/")
+            if not key or key in given:
+                continue
+            if self.client_1.is_ignored(key) or self.client_2.is_ignored(key):
+                self.logger.debug("Ignoring %s", key)
+                continue
 
-        DOES_NOT_EXIST = SyncState(SyncState.DOESNOTEXIST, None, None)
-        for key in target_keys:
-            action_1 = client_1_actions.get(key, DOES_NOT_EXIST)
-            action_2 = client_2_actions.get(key, DOES_NOT_EXIST)
-            yield key, action_1, action_2
+            prefix = key + "/"
+            found = set()
+            for position, client in enumerate(clients):
+                found.update(client.iter_local_keys(prefix))
+                # a key held by an index is a file there, so nothing is under it
+                if key not in client.index:
+                    prefixes[position].append(prefix)
+            given[key] = found
+
+        for position, client in enumerate(clients):
+            for prefix, index_keys in find_keys_under(
+                client.index, prefixes[position]
+            ).items():
+                given[prefix[:-1]].update(index_keys)
+
+        result = collections.OrderedDict()
+        for key, found in given.items():
+            result[key] = None
+            for child in sorted(found):
+                if not (
+                    self.client_1.is_ignored(child) or self.client_2.is_ignored(child)
+                ):
+                    result[child] = None
+        return list(result)
 
     def move_client(self, resolution):
         sync_object = resolution.from_client.get(resolution.key)
 
-        if self.start_callback is not None:
-            self.start_callback(sync_object)
+        self.invoke_callback(self.start_callback, sync_object)
+
+        if self.update_callback is not None:
+            update_callback = functools.partial(
+                self.invoke_callback, self.update_callback
+            )
+        else:
+            update_callback = None
+
+        try:
+            resolution.to_client.put(
+                resolution.key, sync_object, callback=update_callback
+            )
+        finally:
+            # always balance start_callback so shared progress bars are closed
+            self.invoke_callback(self.complete_callback, sync_object)
 
-        resolution.to_client.put(
-            resolution.key, sync_object, callback=self.update_callback
+        resolution.to_client.set_remote_timestamp(resolution.key, resolution.timestamp)
+        resolution.from_client.set_remote_timestamp(
+            resolution.key, resolution.timestamp
         )
 
-        if self.complete_callback is not None:
-            self.complete_callback(sync_object)
+    def invoke_callback(self, callback, *args):
+        if callback is not None:
+            with self._callback_lock:
+                callback(*args)
+
+    def reindex_client(self, resolution):
+        # nothing to transfer, the index entries are refreshed once this returns
+        self.logger.debug("Contents of %s have not changed", resolution.key)
+
+    def rename_client(self, resolution):
+        resolution.to_client.move(resolution.source_key, resolution.key)
 
         resolution.to_client.set_remote_timestamp(resolution.key, resolution.timestamp)
         resolution.from_client.set_remote_timestamp(
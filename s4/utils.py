@@ -2,29 +2,13 @@
 
 import datetime
 import getpass
-import gzip
 import json
 import os
-import zlib
 
 CONFIG_FOLDER_PATH = os.path.expanduser("~/.config/s4")
 CONFIG_FILE_PATH = os.path.join(CONFIG_FOLDER_PATH, "sync.conf")
 
 
-def try_decompress(body):
-    # Attempt multiple levels of fallback in case we cannot
-    # figure out the compression type using `magic`
-    try:
-        return gzip.decompress(body)
-    except OSError:
-        pass
-
-    try:
-        return zlib.decompress(body)
-    except zlib.error:
-        raise ValueError("Unknown compression format")
-
-
 def to_timestamp(dt):
     epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
     return (dt - epoch) / datetime.timedelta(seconds=1)
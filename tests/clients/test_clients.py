@@ -4,7 +4,13 @@ import datetime
 
 import pytest
 
-from s4.clients import SyncClient, SyncObject, SyncState, get_sync_state
+from s4.clients import (
+    SyncClient,
+    SyncObject,
+    SyncState,
+    get_sync_state,
+    merge_sorted,
+)
 
 
 class TestSyncState(object):
@@ -60,6 +66,12 @@ class TestSyncClient(object):
         with pytest.raises(NotImplementedError):
             client.get_size("test")
 
+    def test_delete_many(self):
+        client = SyncClient()
+        errors = client.delete_many(["foo", "bar"])
+        assert sorted(errors.keys()) == ["bar", "foo"]
+        assert isinstance(errors["foo"], NotImplementedError)
+
     def test_get_client_name(self):
         client = SyncClient()
         with pytest.raises(NotImplementedError):
@@ -195,3 +207,32 @@ class TestGetSyncState(object):
         )
         expected_state = SyncState(SyncState.NOCHANGES, 8000, 6000)
         assert actual_state == expected_state
+
+
+class TestMergeSorted(object):
+    def test_empty(self):
+        assert list(merge_sorted([], [])) == []
+
+    def test_correct_output(self):
+        actual_output = list(
+            merge_sorted(
+                [("a", 1), ("c", 3), ("d", 4)], [("b", 20), ("c", 30)], [("d", 400)]
+            )
+        )
+        assert actual_output == [
+            ("a", [1, None, None]),
+            ("b", [None, 20, None]),
+            ("c", [3, 30, None]),
+            ("d", [4, None, 400]),
+        ]
+
+    def test_lazy(self):
+        def infinite():
+            index = 0
+            while True:
+                yield "key{:08}".format(index), index
+                index += 1
+
+        merged = merge_sorted(infinite(), [("key00000001", "x")])
+        assert next(merged) == ("key00000000", [0, None])
+        assert next(merged) == ("key00000001", [1, "x"])
@@ -6,12 +6,18 @@ import json
 import os
 import shutil
 import tempfile
+import threading
 
 import filelock
 import mock
+import pathspec
 import pytest
 
 from s4.clients import SyncObject, local
+from s4.index import encoding, journal
+from s4.index.binary import BinaryIndex
+from s4.index.sharded import ShardedIndex
+from s4.index.sqlite import SQLiteIndex
 
 from tests import utils
 
@@ -62,6 +68,14 @@ class TestTraverse(object):
         ]
         assert sorted(actual_output) == sorted(expected_output)
 
+    def test_sorted_output(self):
+        items = ["a.txt", "a/b", "a-b/c", "a/a/z", "ab", "A"]
+        for item in items:
+            utils.write_local(os.path.join(self.target_folder, item))
+
+        actual_output = list(local.traverse(self.target_folder))
+        assert actual_output == sorted(items)
+
     def test_ignore_subfolder(self):
         items = [
             "dev/files/test.txt",
@@ -79,6 +93,129 @@ class TestTraverse(object):
         assert sorted(actual_output) == sorted(expected_output)
 
 
+class TestScan(object):
+    def setup_method(self):
+        self.target_folder = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        shutil.rmtree(self.target_folder)
+
+    def test_non_existent_folder(self):
+        assert list(local.scan("/i/definetely/do/not/exist")) == []
+
+    def test_entries(self):
+        path = os.path.join(self.target_folder, "foo/bar.txt")
+        utils.write_local(path, "hello")
+        os.utime(path, (5000, 5000))
+
+        actual_output = list(local.scan(self.target_folder))
+        assert actual_output == [
+            local.LocalEntry("foo/bar.txt", 5000, 5, os.stat(path).st_ino)
+        ]
+
+    def test_prunes_ignored_directories(self):
+        items = ["src/main.py", "build/lib/main.py", "node_modules/a/b/index.js"]
+        for item in items:
+            utils.write_local(os.path.join(self.target_folder, item))
+
+        ignore_spec = local.compile_ignore_spec(["build/", "node_modules"])
+        with mock.patch("s4.clients.local.scandir", wraps=os.scandir) as scandir:
+            keys = [entry.key for entry in local.scan(self.target_folder, ignore_spec)]
+
+        assert keys == ["src/main.py"]
+        scanned = sorted(
+            os.path.relpath(call[0][0], self.target_folder)
+            for call in scandir.call_args_list
+        )
+        assert scanned == [".", "src"]
+
+    def test_compiles_ignore_files_once(self):
+        for item in ["a/b/c", "a/d", "e", "f/g"]:
+            utils.write_local(os.path.join(self.target_folder, item))
+
+        with mock.patch(
+            "pathspec.PathSpec.from_lines", wraps=pathspec.PathSpec.from_lines
+        ) as from_lines:
+            assert list(local.traverse(self.target_folder, ["*.pyc"])) == [
+                "a/b/c",
+                "a/d",
+                "e",
+                "f/g",
+            ]
+        assert from_lines.call_count == 1
+
+
+class TestParallelScan(object):
+    def setup_method(self):
+        self.target_folder = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        shutil.rmtree(self.target_folder)
+
+    def test_same_as_serial(self):
+        items = [
+            "a.txt",
+            "a/b/c.txt",
+            "a/b.txt",
+            "a-b/c",
+            "dev/venv/lib/file",
+            "dev/.git/index",
+            "dev/main.py",
+            "dev/main.pyc",
+        ]
+        for index in range(20):
+            items.append("many/dir{}/file{}".format(index, index))
+        for item in items:
+            utils.write_local(os.path.join(self.target_folder, item))
+
+        ignore_spec = local.compile_ignore_spec(["venv/", ".git", "*.pyc"])
+        expected_output = list(local.scan(self.target_folder, ignore_spec))
+        actual_output = list(local.scan(self.target_folder, ignore_spec, workers=4))
+
+        assert actual_output == expected_output
+        assert [entry.key for entry in actual_output] == sorted(
+            item
+            for item in items
+            if "venv" not in item and ".git" not in item and ".pyc" not in item
+        )
+
+    @pytest.mark.parametrize(
+        "keys",
+        [
+            ["dir{:03d}/file".format(index) for index in range(500)],
+            [
+                "dir{:02d}/sub{}/file".format(index // 10, index % 10)
+                for index in range(500)
+            ],
+        ],
+        ids=["wide", "nested"],
+    )
+    def test_reads_are_off_main_thread(self, keys):
+        for key in keys:
+            utils.write_local(os.path.join(self.target_folder, key))
+
+        main_thread = threading.current_thread()
+        threads = []
+
+        def read_dir(path):
+            threads.append(threading.current_thread() is main_thread)
+            return local._list_dir(path)
+
+        with mock.patch.object(local, "_read_dir", side_effect=read_dir):
+            entries = list(local.scan(self.target_folder, workers=4))
+
+        assert len(entries) == 500
+        # only the top level directory is listed on the main thread
+        assert threads.count(True) <= 5
+
+    def test_client(self):
+        utils.write_local(os.path.join(self.target_folder, "foo/bar"))
+        utils.write_local(os.path.join(self.target_folder, "baz"))
+
+        client = local.LocalSyncClient(self.target_folder, scan_workers=2)
+        assert client.get_local_keys() == ["baz", "foo/bar"]
+
+
 class TestLocalSyncClient(object):
     def test_get_client_name(self, local_client):
         assert local_client.get_client_name() == "local"
@@ -166,6 +303,22 @@ class TestLocalSyncClient(object):
     def test_delete_non_existent(self, local_client):
         assert local_client.delete("idontexist.txt") is False
 
+    def test_delete_many(self, local_client):
+        utils.set_local_contents(local_client, "foo")
+        utils.set_local_contents(local_client, "bar/baz")
+
+        assert local_client.delete_many(["foo", "bar/baz", "idontexist"]) == {}
+        assert local_client.get_local_keys() == []
+
+    def test_move(self, local_client):
+        utils.set_local_contents(local_client, "foo", 222222, data="hello")
+
+        local_client.move("foo", "bar/baz")
+
+        assert local_client.get("foo") is None
+        assert utils.get_local_contents(local_client, "bar/baz") == b"hello"
+        assert local_client.get_real_local_timestamp("bar/baz") == 222222
+
     def test_index_path(self):
         client = local.LocalSyncClient("/hello/from/the/magic/tavern")
         assert client.index_path() == "/hello/from/the/magic/tavern/.index"
@@ -191,6 +344,26 @@ class TestLocalSyncClient(object):
         expected_output = ["foo", "bar", ".bashrc"]
         assert sorted(expected_output) == sorted(actual_output)
 
+    def test_index_files_are_not_listed(self, local_client):
+        for key in [
+            ".index.sqlite",
+            ".index.sqlite-wal",
+            ".index.journal",
+            ".index.manifest",
+            ".index.d/0a",
+            ".index.remote/index",
+            ".index.tmp-x1y2z3",
+        ]:
+            utils.set_local_contents(local_client, key)
+        # files which only look like index files are synced as usual
+        utils.set_local_contents(local_client, ".index.html")
+        utils.set_local_contents(local_client, "docs/.index.md")
+
+        assert sorted(local_client.get_local_keys()) == [
+            ".index.html",
+            "docs/.index.md",
+        ]
+
     def test_get_index_keys(self, local_client):
         data = {
             "foo": {"local_timestamp": 4000, "remote_timestamp": 4000},
@@ -325,9 +498,10 @@ class TestLocalSyncClient(object):
     @pytest.mark.parametrize(
         ["compressed", "method"], [(True, gzip.open), (False, open)]
     )
-    def test_flush_index(self, compressed, method, local_client):
+    def test_flush_json_index(self, compressed, method, local_client):
         target_index = {"foo": {"local_timestamp": 4000, "remote_timestamp": 6000}}
 
+        local_client.index_format = "json"
         local_client.index = target_index
         local_client.flush_index(compressed=compressed)
 
@@ -336,11 +510,29 @@ class TestLocalSyncClient(object):
 
         assert index == target_index
 
+    @pytest.mark.parametrize("index_codec", ["gzip:1", "bz2"])
+    def test_flush_json_index_codec(self, index_codec, local_client):
+        target_index = {"foo": {"local_timestamp": 4000, "remote_timestamp": 6000}}
+
+        client = local.LocalSyncClient(
+            local_client.path, index_format="json", index_codec=index_codec
+        )
+        client.index = target_index
+        client.flush_index()
+
+        with open(client.index_path(), "rb") as fp:
+            body = fp.read()
+        assert encoding.detect_codec(body)[0] == index_codec.split(":")[0]
+
+        client.reload_index()
+        assert client.index == target_index
+
     def test_interrupted_flush_index(self, local_client):
         target_index = {"red": {"local_timestamp": 4000, "remote_timestamp": 4000}}
 
         utils.set_local_index(local_client, target_index)
 
+        local_client.index_format = "json"
         local_client.index = {"invalid_data": []}
 
         with mock.patch("json.dump") as json_dump:
@@ -353,6 +545,217 @@ class TestLocalSyncClient(object):
 
         assert index == target_index
 
+    def test_flush_index(self, local_client):
+        target_index = {
+            "foo": {"local_timestamp": 4000, "remote_timestamp": 6000},
+            "bar/baz": {"local_timestamp": None, "remote_timestamp": 5000},
+        }
+        local_client.index = target_index
+        local_client.flush_index()
+
+        with open(local_client.index_path(), "rb") as fp:
+            assert fp.read(4) == b"S4IX"
+        assert isinstance(local_client.index.base, BinaryIndex)
+        assert dict(local_client.index) == target_index
+
+        local_client.reload_index()
+        assert dict(local_client.index.items()) == target_index
+
+    def test_upgrade_json_index(self, local_client):
+        target_index = {"foo": {"local_timestamp": 4000, "remote_timestamp": 6000}}
+        utils.set_local_index(local_client, target_index)
+        assert local_client.index == target_index
+
+        local_client.set_remote_timestamp("foo", 7000)
+        local_client.flush_index()
+        local_client.reload_index()
+
+        assert isinstance(local_client.index.base, BinaryIndex)
+        assert local_client.index == {
+            "foo": {"local_timestamp": 4000, "remote_timestamp": 7000}
+        }
+
+    def test_interrupted_flush_binary_index(self, local_client):
+        target_index = {"red": {"local_timestamp": 4000, "remote_timestamp": 4000}}
+        local_client.index = target_index
+        local_client.flush_index()
+
+        # keys out of order cannot be written
+        local_client.index = mock.MagicMock()
+        local_client.index.iter_items.return_value = iter([("b", {}), ("a", {})])
+        with pytest.raises(ValueError):
+            local_client.flush_index()
+
+        local_client.reload_index()
+        assert local_client.index == target_index
+        assert sorted(os.listdir(local_client.path)) == [".index"]
+
+    def test_flush_index_journal(self, local_client):
+        local_client.set_remote_timestamp("foo", 6000)
+        local_client.flush_index()
+        with open(local_client.index_path(), "rb") as fp:
+            index_data = fp.read()
+
+        local_client.set_remote_timestamp("foo", 7000)
+        local_client.set_index_local_timestamp("bar", 4000)
+        local_client.flush_index()
+
+        # only the journal is written
+        with open(local_client.index_path(), "rb") as fp:
+            assert fp.read() == index_data
+        assert os.path.getsize(local_client.journal_path()) > 0
+
+        client = local.LocalSyncClient(local_client.path)
+        assert dict(client.index.items()) == {
+            "foo": {"remote_timestamp": 7000, "local_timestamp": None},
+            "bar": {"local_timestamp": 4000},
+        }
+
+    def test_index_journal_without_flush(self, local_client, monkeypatch):
+        monkeypatch.setattr(journal, "SYNC_RECORDS", 1)
+        local_client.set_remote_timestamp("foo", 6000)
+        local_client.flush_index()
+
+        # the process dies before the index is flushed again
+        local_client.set_remote_timestamp("bar", 7000)
+
+        client = local.LocalSyncClient(local_client.path)
+        assert dict(client.index.items()) == {
+            "foo": {"remote_timestamp": 6000, "local_timestamp": None},
+            "bar": {"remote_timestamp": 7000},
+        }
+
+    def test_compact_index_journal(self, local_client):
+        local_client.COMPACT_JOURNAL_SIZE = 0
+        local_client.set_remote_timestamp("foo", 6000)
+        local_client.flush_index()
+
+        # the journal grows larger than the index
+        for timestamp in range(6001, 7001):
+            local_client.set_remote_timestamp("foo", timestamp)
+        local_client.flush_index()
+
+        assert sorted(os.listdir(local_client.path)) == [".index"]
+        local_client.reload_index()
+        assert local_client.index.base["foo"] == {
+            "remote_timestamp": 7000,
+            "local_timestamp": None,
+        }
+
+    def test_sqlite_index(self, local_client):
+        client = local.LocalSyncClient(local_client.path, index_format="sqlite")
+        assert isinstance(client.index, SQLiteIndex)
+
+        client.set_remote_timestamp("foo", 6000)
+        client.set_index_local_timestamp("foo", 4000)
+        client.flush_index()
+        assert not os.path.exists(client.index_path())
+
+        client.reload_index()
+        assert client.index["foo"] == {
+            "local_timestamp": 4000,
+            "remote_timestamp": 6000,
+        }
+
+    def test_flush_sqlite_index_replaced(self, local_client):
+        client = local.LocalSyncClient(local_client.path, index_format="sqlite")
+        target_index = {"foo": {"local_timestamp": 4000, "remote_timestamp": 6000}}
+        client.index = target_index
+        client.flush_index()
+
+        assert isinstance(client.index, SQLiteIndex)
+        assert dict(client.index.items()) == target_index
+
+    def test_migrate_to_sqlite_index(self, local_client):
+        target_index = {"foo": {"local_timestamp": 4000, "remote_timestamp": 6000}}
+        utils.set_local_index(local_client, target_index)
+
+        client = local.LocalSyncClient(local_client.path, index_format="sqlite")
+        assert dict(client.index.items()) == target_index
+        assert not os.path.exists(client.index_path())
+
+    def test_migrate_from_sqlite_index(self, local_client):
+        target_index = {"foo": {"local_timestamp": 4000, "remote_timestamp": 6000}}
+        client = local.LocalSyncClient(local_client.path, index_format="sqlite")
+        client.index.replace(target_index.items())
+        client.index.close()
+
+        local_client.reload_index()
+        assert local_client.index == target_index
+
+        local_client.flush_index()
+        assert sorted(os.listdir(local_client.path)) == [".index"]
+        local_client.reload_index()
+        assert dict(local_client.index.items()) == target_index
+
+    def test_sharded_index(self, local_client):
+        client = local.LocalSyncClient(local_client.path, index_format="sharded")
+        client.set_remote_timestamp("fruit/apple", 4000)
+        client.set_remote_timestamp("readme", 5000)
+        client.flush_index()
+
+        assert sorted(os.listdir(client.path)) == [".index.d", ".index.manifest"]
+        assert len(os.listdir(os.path.join(client.path, ".index.d"))) == 2
+
+        client.reload_index()
+        assert isinstance(client.index, ShardedIndex)
+        assert dict(client.index.items()) == {
+            "fruit/apple": {"remote_timestamp": 4000},
+            "readme": {"remote_timestamp": 5000},
+        }
+
+    def test_migrate_sharded_index(self, local_client):
+        target_index = {
+            "fruit/apple": {"local_timestamp": 3000, "remote_timestamp": 4000},
+            "readme": {"local_timestamp": 3000, "remote_timestamp": 5000},
+        }
+        local_client.index = target_index
+        local_client.flush_index()
+
+        client = local.LocalSyncClient(local_client.path, index_format="sharded")
+        client.flush_index()
+        assert sorted(os.listdir(client.path)) == [".index.d", ".index.manifest"]
+
+        local_client.reload_index()
+        assert dict(local_client.index.items()) == target_index
+        local_client.set_remote_timestamp("readme", 6000)
+        local_client.flush_index()
+
+        assert sorted(os.listdir(local_client.path)) == [".index"]
+        local_client.reload_index()
+        assert local_client.index["readme"]["remote_timestamp"] == 6000
+
+    def test_is_ignored(self, local_client):
+        utils.set_local_contents(
+            local_client, ".syncignore", data="*.zip\nbuild/\nnode_modules\n"
+        )
+        local_client.reload_ignore_files()
+        utils.set_local_contents(local_client, "build/output")
+
+        assert local_client.is_ignored("test.zip")
+        assert local_client.is_ignored("node_modules/left-pad/index.js")
+        assert local_client.is_ignored("build/output")
+        assert local_client.is_ignored("build")
+        assert not local_client.is_ignored("src/build")
+        assert not local_client.is_ignored("src/main.py")
+
+    def test_iter_local_keys(self, local_client):
+        utils.set_local_contents(local_client, "colors/red")
+        utils.set_local_contents(local_client, "colors/dark/blue")
+        utils.set_local_contents(local_client, "colors.txt")
+
+        assert list(local_client.iter_local_keys("colors/")) == [
+            "colors/dark/blue",
+            "colors/red",
+        ]
+        assert list(local_client.iter_local_keys("shapes/")) == []
+
+    def test_directory_has_no_timestamp(self, local_client):
+        utils.set_local_contents(local_client, "colors/red", timestamp=1000)
+
+        assert local_client.get_real_local_timestamp("colors") is None
+        assert local_client.get_real_local_timestamp("colors/red") == 1000
+
     def test_ignore_files(self, local_client):
         utils.set_local_contents(
             local_client, ".syncignore", timestamp=3200, data=("*.zip\n" "foo*\n")
@@ -376,3 +779,99 @@ class TestLocalSyncClient(object):
             "pony.tar": {"local_timestamp": 8000, "remote_timestamp": 3000},
         }
         assert local_client.index == expected_index
+
+
+class TestContentHash(object):
+    def test_disabled(self, local_client):
+        utils.set_local_contents(local_client, "foo", data="hello")
+        assert local_client.get_content_hash("foo") is None
+
+    def test_get_content_hash(self):
+        folder = tempfile.mkdtemp()
+        try:
+            client = local.LocalSyncClient(folder, content_hash=True)
+            utils.set_local_contents(client, "foo", timestamp=1000, data="hello")
+
+            assert client.get_content_hash("idontexist") is None
+            with mock.patch(
+                "s4.clients.local.open", create=True, wraps=open
+            ) as open_mock:
+                expected_hash = "5d41402abc4b2a76b9719d911017c592"
+                assert client.get_content_hash("foo") == expected_hash
+                assert client.get_content_hash("foo") == expected_hash
+            # unchanged files are only read once
+            assert open_mock.call_count == 1
+
+            utils.set_local_contents(client, "foo", timestamp=2000, data="world")
+            assert client.get_content_hash("foo") == "7d793037a0760186574b0282f2f435e7"
+        finally:
+            shutil.rmtree(folder)
+
+    def test_persisted_cache(self):
+        folder = tempfile.mkdtemp()
+        try:
+            client = local.LocalSyncClient(folder, content_hash=True)
+            utils.set_local_contents(client, "foo", timestamp=1000, data="hello")
+            client.update_index_entry("foo")
+            client.flush_index()
+
+            assert client.index["foo"]["content_hash"] == (
+                "5d41402abc4b2a76b9719d911017c592"
+            )
+            assert client.get_local_keys() == ["foo"]
+
+            client = local.LocalSyncClient(folder, content_hash=True)
+            with mock.patch(
+                "s4.clients.local.open", create=True, wraps=open
+            ) as open_mock:
+                client.get_content_hash("foo")
+            assert open_mock.call_count == 0
+        finally:
+            shutil.rmtree(folder)
+
+    def test_cache_only_written_when_changed(self):
+        folder = tempfile.mkdtemp()
+        try:
+            client = local.LocalSyncClient(folder, content_hash=True)
+            utils.set_local_contents(client, "foo", timestamp=1000, data="hello")
+            utils.set_local_contents(client, "bar", timestamp=1000, data="world")
+            client.update_index_entry("foo")
+            client.update_index_entry("bar")
+
+            with mock.patch.object(
+                client, "_replace_file", wraps=client._replace_file
+            ) as replace_file:
+                client.flush_index()
+                client.flush_index()
+                client.get_content_hash("foo")
+                client.flush_index()
+            # the cache is written next to the index, and only once
+            assert replace_file.call_count == 1
+            assert replace_file.call_args[0][0] == client.hash_cache_path()
+
+            os.remove(client.get_uri("bar"))
+            client.update_index_entry("bar")
+            client.flush_index()
+
+            client = local.LocalSyncClient(folder, content_hash=True)
+            assert sorted(client._load_hash_cache()) == ["foo"]
+        finally:
+            shutil.rmtree(folder)
+
+    def test_put(self):
+        folder = tempfile.mkdtemp()
+        try:
+            client = local.LocalSyncClient(folder, content_hash=True)
+            data = b"hello"
+            client.put("foo", SyncObject(io.BytesIO(data), len(data), 4000))
+
+            with mock.patch(
+                "s4.clients.local.open", create=True, wraps=open
+            ) as open_mock:
+                client.update_index_entry("foo")
+            assert open_mock.call_count == 0
+            assert client.index["foo"]["content_hash"] == (
+                "5d41402abc4b2a76b9719d911017c592"
+            )
+        finally:
+            shutil.rmtree(folder)
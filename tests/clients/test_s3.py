@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import datetime
+import gzip
 import io
+import json
 import os
 
 import boto3
@@ -11,6 +13,8 @@ from botocore.exceptions import ClientError
 from moto import mock_s3
 
 from s4.clients import SyncObject, s3
+from s4.index import encoding, sharded
+from s4.index.compact import CompactIndex
 from s4.utils import to_timestamp
 
 from tests import utils
@@ -43,6 +47,14 @@ class TestIsIgnoredFile(object):
     def test_file(self):
         assert s3.is_ignored_key("foo/ignoreme", ["ignore*"]) is True
 
+    def test_index_files(self):
+        ignore_files = s3.S3SyncClient.DEFAULT_IGNORE_FILES
+        assert s3.is_ignored_key(".index.deltas/0001", ignore_files) is True
+        assert s3.is_ignored_key(".index.d/0a", ignore_files) is True
+        assert s3.is_ignored_key(".index.manifest", ignore_files) is True
+        assert s3.is_ignored_key(".index.html", ignore_files) is False
+        assert s3.is_ignored_key("site/.index.html", ignore_files) is False
+
 
 class TestS3SyncClient(object):
     def test_get_client_name(self, s3_client):
@@ -75,6 +87,13 @@ class TestS3SyncClient(object):
         client = s3.S3SyncClient(s3_client, "testbucket", "foo/bar")
         assert client.index_path() == "foo/bar/.index"
 
+    def test_get_boto_client_pool_size(self):
+        boto_client = s3.get_boto_client("", "", None, "us-east-1")
+        assert boto_client.meta.config.max_pool_connections == 10
+
+        boto_client = s3.get_boto_client("", "", None, "us-east-1", jobs=32)
+        assert boto_client.meta.config.max_pool_connections == 32
+
     def test_put(self, s3_client):
         # given
         data = b"munchkin"
@@ -166,6 +185,65 @@ class TestS3SyncClient(object):
     def test_delete_non_existent(self, s3_client):
         assert s3_client.delete("idontexist.png") is False
 
+    def test_delete_many(self, s3_client):
+        for key in ["war.png", "peace.png", "love.png"]:
+            utils.set_s3_contents(s3_client, key, data="bang")
+
+        with mock.patch.object(
+            s3_client.boto, "delete_objects", wraps=s3_client.boto.delete_objects
+        ) as delete_objects, mock.patch.object(s3_client, "MAX_DELETE_OBJECTS", 2):
+            errors = s3_client.delete_many(["war.png", "peace.png", "idontexist.png"])
+
+        assert errors == {}
+        assert delete_objects.call_count == 2
+        assert s3_client.get_local_keys() == ["love.png"]
+
+    def test_delete_many_errors(self, s3_client):
+        utils.set_s3_contents(s3_client, "war.png", data="bang")
+        utils.set_s3_contents(s3_client, "peace.png", data="bang")
+        assert sorted(s3_client.get_local_keys()) == ["peace.png", "war.png"]
+
+        s3_client.boto.delete_objects = mock.MagicMock(
+            return_value={
+                "Errors": [
+                    {
+                        "Key": os.path.join(s3_client.prefix, "war.png"),
+                        "Code": "AccessDenied",
+                        "Message": "Access Denied",
+                    }
+                ]
+            }
+        )
+        errors = s3_client.delete_many(["war.png", "peace.png"])
+
+        assert errors == {"war.png": "AccessDenied: Access Denied"}
+        # the failed key is requested again rather than assumed to be deleted
+        assert s3_client.get_local_keys() == ["war.png"]
+
+    def test_move(self, s3_client):
+        utils.set_s3_contents(s3_client, "war.png", timestamp=1000, data="bang")
+
+        with freezegun.freeze_time(datetime.datetime.utcfromtimestamp(2000)):
+            s3_client.move("war.png", "peace/war.png")
+
+        assert s3_client.get("war.png") is None
+        output_object = s3_client.get("peace/war.png")
+        assert output_object.fp.read() == b"bang"
+        assert output_object.timestamp == 2000
+
+    def test_get_content_hash(self, s3_client):
+        utils.set_s3_contents(s3_client, "colors/blue", data="#0000ff")
+        assert s3_client.get_content_hash("colors/blue") == (
+            "7515b6c7081af86552f8ed478ef87bc5"
+        )
+        assert s3_client.get_content_hash("colors/red") is None
+
+    def test_get_content_hash_multipart(self, s3_client):
+        s3_client.record_listing_entry(
+            "big", s3.ListingEntry(100, '"7515b6c7081af86552f8ed478ef87bc5-2"', 1000)
+        )
+        assert s3_client.get_content_hash("big") is None
+
     def test_get_local_keys(self, s3_client):
         # given
         utils.set_s3_contents(s3_client, "war.png")
@@ -194,38 +272,78 @@ class TestS3SyncClient(object):
         )
         assert sorted(s3_client.get_index_keys()) == sorted(["cow", "chicken"])
 
-    @pytest.mark.parametrize(
-        ("magic_result", "compression"),
-        [
-            ("text/plain", None),
-            ("application/json", None),
-            ("application/gzip", "gzip"),
-            ("application/x-gzip", "gzip"),
-            ("application/zlib", "zlib"),
-            ("application/octet-stream", "gzip"),
-            ("application/octet-stream", "zlib"),
-        ],
-    )
-    def test_get_index_timestamps(self, s3_client, compression, magic_result):
-        with mock.patch("magic.from_buffer") as from_buffer:
-            # given
-            from_buffer.return_value = magic_result
-
-            utils.set_s3_index(
-                s3_client,
-                {
-                    "hello": {"remote_timestamp": 1234, "local_timestamp": 1200},
-                    "world": {"remote_timestamp": 5000},
-                },
-                compression=compression,
+    @pytest.mark.parametrize("compression", [None, "gzip", "zlib"])
+    def test_get_index_timestamps(self, s3_client, compression):
+        # given
+        utils.set_s3_index(
+            s3_client,
+            {
+                "hello": {"remote_timestamp": 1234, "local_timestamp": 1200},
+                "world": {"remote_timestamp": 5000},
+            },
+            compression=compression,
+        )
+
+        # then
+        assert s3_client.get_remote_timestamp("hello") == 1234
+        assert s3_client.get_index_local_timestamp("hello") == 1200
+
+        assert s3_client.get_remote_timestamp("world") == 5000
+        assert s3_client.get_index_local_timestamp("world") is None
+
+    @pytest.mark.parametrize("compressed", [True, False])
+    def test_flush_index_without_header(self, s3_client, compressed):
+        s3_client.set_remote_timestamp("hello", 1234)
+        s3_client.flush_index(compressed=compressed)
+
+        # the same encoding older versions wrote, so that they can still read it
+        body = s3_client.boto.get_object(
+            Bucket=s3_client.bucket, Key=s3_client.index_path()
+        )["Body"].read()
+        if compressed:
+            body = gzip.decompress(body)
+        assert json.loads(body.decode("utf-8")) == {"hello": {"remote_timestamp": 1234}}
+
+        s3_client.reload_index()
+        assert s3_client.get_remote_timestamp("hello") == 1234
+
+    def test_flush_index_codec(self, s3_client):
+        client = s3.S3SyncClient(
+            s3_client.boto, s3_client.bucket, s3_client.prefix, index_codec="lzma:1"
+        )
+        client.set_remote_timestamp("hello", 1234)
+        client.flush_index()
+
+        body = client.boto.get_object(Bucket=client.bucket, Key=client.index_path())[
+            "Body"
+        ].read()
+        assert encoding.detect_codec(body) == ("lzma", encoding.HEADER.size)
+
+        s3_client.reload_index()
+        assert s3_client.get_remote_timestamp("hello") == 1234
+
+    def test_unknown_index_codec(self, s3_client):
+        with pytest.raises(ValueError):
+            s3.S3SyncClient(
+                s3_client.boto, s3_client.bucket, s3_client.prefix, index_codec="lz4"
             )
 
-            # then
-            assert s3_client.get_remote_timestamp("hello") == 1234
-            assert s3_client.get_index_local_timestamp("hello") == 1200
+    def test_unknown_index_type(self, s3_client):
+        utils.write_s3(
+            s3_client.boto,
+            s3_client.bucket,
+            os.path.join(s3_client.prefix, ".index"),
+            b"\x00\x01 not an index",
+        )
+        with pytest.raises(ValueError) as exc:
+            s3_client.reload_index()
+        assert exc.value.args == ("Index is of unknown type",)
+
+    def test_index_is_compact(self, s3_client):
+        utils.set_s3_index(s3_client, {"hello": {"remote_timestamp": 1234}})
 
-            assert s3_client.get_remote_timestamp("world") == 5000
-            assert s3_client.get_index_local_timestamp("world") is None
+        assert isinstance(s3_client.index.base, CompactIndex)
+        assert s3_client.get_remote_timestamp("hello") == 1234
 
     def test_get_all_index_timestamps(self, s3_client):
         # given
@@ -348,3 +466,445 @@ class TestS3SyncClient(object):
             "foo/mobile.py": {"local_timestamp": 1290, "remote_timestamp": None},
         }
         assert s3_client.index == expected_index
+
+
+class TestListingSnapshot(object):
+    def test_single_listing(self, s3_client):
+        utils.set_s3_contents(s3_client, "red", timestamp=1000)
+        utils.set_s3_contents(s3_client, "green", timestamp=2000)
+
+        with mock.patch.object(
+            s3_client.boto, "get_paginator", wraps=s3_client.boto.get_paginator
+        ) as get_paginator, mock.patch.object(
+            s3_client.boto, "head_object", wraps=s3_client.boto.head_object
+        ) as head_object:
+            assert sorted(s3_client.get_local_keys()) == ["green", "red"]
+            assert s3_client.get_all_real_local_timestamps() == {
+                "red": 1000,
+                "green": 2000,
+            }
+            s3_client.update_index()
+            assert s3_client.get_real_local_timestamp("red") == 1000
+            assert s3_client.get_real_local_timestamp("idontexist") is None
+            assert s3_client.get_size("green") == 0
+
+        assert get_paginator.call_count == 1
+        assert head_object.call_count == 0
+
+    def test_listing_is_published_while_listing(self, s3_client):
+        utils.set_s3_contents(s3_client, "blue", timestamp=1000)
+        utils.set_s3_contents(s3_client, "green", timestamp=2000)
+        utils.set_s3_contents(s3_client, "red", timestamp=3000)
+        utils.set_s3_contents(s3_client, "yellow", timestamp=4000)
+
+        with mock.patch.object(
+            s3_client.boto, "head_object", wraps=s3_client.boto.head_object
+        ) as head_object:
+            listing = s3_client.iter_listing()
+            assert next(listing)[0] == "blue"
+            assert next(listing)[0] == "green"
+            # the keys listed so far are known, including ones which don't exist
+            assert s3_client.get_real_local_timestamp("blue") == 1000
+            assert s3_client.get_real_local_timestamp("cyan") is None
+            assert head_object.call_count == 0
+
+            # but the last key is not listed yet
+            assert s3_client.get_real_local_timestamp("yellow") == 4000
+            assert head_object.call_count == 1
+            assert [key for key, _ in listing] == ["red", "yellow"]
+
+    def test_listing_entry(self, s3_client):
+        utils.set_s3_contents(s3_client, "colors/blue", timestamp=3000, data="#0000ff")
+
+        entry = s3_client.get_listing_entry("colors/blue")
+        assert entry.size == 7
+        assert entry.timestamp == 3000
+        assert entry.etag.strip('"') == "7515b6c7081af86552f8ed478ef87bc5"
+        assert s3_client.get_listing_entry("colors/red") is None
+
+    def test_put_invalidates_key(self, s3_client):
+        utils.set_s3_contents(s3_client, "red", timestamp=1000)
+        assert s3_client.get_local_keys() == ["red"]
+
+        data = b"#00ff00"
+        with freezegun.freeze_time(datetime.datetime.utcfromtimestamp(5000)):
+            s3_client.put("green", SyncObject(io.BytesIO(data), len(data), 5000))
+
+        with mock.patch.object(
+            s3_client.boto, "get_paginator", wraps=s3_client.boto.get_paginator
+        ) as get_paginator:
+            assert list(s3_client.iter_real_local_timestamps()) == [
+                ("green", 5000),
+                ("red", 1000),
+            ]
+        assert get_paginator.call_count == 0
+
+    def test_delete_invalidates_key(self, s3_client):
+        utils.set_s3_contents(s3_client, "red", timestamp=1000)
+        utils.set_s3_contents(s3_client, "blue", timestamp=2000)
+        assert sorted(s3_client.get_local_keys()) == ["blue", "red"]
+
+        s3_client.delete("red")
+
+        assert s3_client.get_local_keys() == ["blue"]
+        assert s3_client.get_real_local_timestamp("red") is None
+
+    def test_move_records_entry(self, s3_client):
+        utils.set_s3_contents(s3_client, "red", timestamp=1000, data="#ff0000")
+        assert s3_client.get_local_keys() == ["red"]
+
+        with freezegun.freeze_time(datetime.datetime.utcfromtimestamp(2000)):
+            s3_client.move("red", "crimson")
+
+        with mock.patch.object(
+            s3_client.boto, "head_object", wraps=s3_client.boto.head_object
+        ) as head_object:
+            assert list(s3_client.iter_real_local_timestamps()) == [("crimson", 2000)]
+            assert s3_client.get_size("crimson") == 7
+        assert head_object.call_count == 0
+
+    def test_invalidate_listing(self, s3_client):
+        utils.set_s3_contents(s3_client, "red", timestamp=1000)
+        assert s3_client.get_local_keys() == ["red"]
+
+        # changes made behind the client's back are only seen after invalidating
+        utils.set_s3_contents(s3_client, "blue", timestamp=2000)
+        assert s3_client.get_local_keys() == ["red"]
+
+        s3_client.invalidate_listing()
+        assert s3_client.get_local_keys() == ["blue", "red"]
+
+
+class TestDeferredIndexEntries(object):
+    def test_no_head_requests_after_upload(self, s3_client):
+        assert s3_client.get_local_keys() == []
+
+        with mock.patch.object(
+            s3_client.boto, "head_object", wraps=s3_client.boto.head_object
+        ) as head_object:
+            for index, key in enumerate(["red", "green", "blue"]):
+                data = key.encode("utf8")
+                with freezegun.freeze_time(
+                    datetime.datetime.utcfromtimestamp(1000 + index)
+                ):
+                    s3_client.put(key, SyncObject(io.BytesIO(data), len(data), index))
+                s3_client.update_index_entry(key)
+            s3_client.flush_index()
+
+        assert head_object.call_count == 0
+        assert s3_client.index == {
+            "red": {"remote_timestamp": 0, "local_timestamp": 1000},
+            "green": {"remote_timestamp": 1, "local_timestamp": 1001},
+            "blue": {"remote_timestamp": 2, "local_timestamp": 1002},
+        }
+
+    def test_head_fallback(self, s3_client):
+        data = b"#ff0000"
+        with freezegun.freeze_time(datetime.datetime.utcfromtimestamp(3000)):
+            s3_client.put("red", SyncObject(io.BytesIO(data), len(data), 2000))
+        s3_client.update_index_entry("red")
+
+        assert s3_client.index["red"]["local_timestamp"] is None
+
+        with mock.patch.object(
+            s3_client.boto, "head_object", wraps=s3_client.boto.head_object
+        ) as head_object:
+            s3_client.flush_index()
+
+        assert head_object.call_count == 1
+        assert s3_client.index["red"] == {
+            "remote_timestamp": 2000,
+            "local_timestamp": 3000,
+        }
+
+    def test_delete(self, s3_client):
+        utils.set_s3_contents(s3_client, "red", timestamp=1000)
+        utils.set_s3_index(
+            s3_client, {"red": {"remote_timestamp": 1000, "local_timestamp": 1000}}
+        )
+        assert s3_client.get_local_keys() == ["red"]
+
+        with mock.patch.object(
+            s3_client.boto, "head_object", wraps=s3_client.boto.head_object
+        ) as head_object:
+            s3_client.delete("red")
+            s3_client.update_index_entry("red")
+
+        assert head_object.call_count == 0
+        assert s3_client.index["red"] == {
+            "remote_timestamp": 1000,
+            "local_timestamp": None,
+        }
+
+
+class TestShardedIndex(object):
+    def get_sharded_client(self, s3_client):
+        return s3.S3SyncClient(
+            s3_client.boto, s3_client.bucket, s3_client.prefix, sharded_index=True
+        )
+
+    def test_flush_changed_shards(self, s3_client):
+        client = self.get_sharded_client(s3_client)
+        for key in ["fruit/apple", "fruit/banana", "vegetables/carrot", "readme"]:
+            client.set_remote_timestamp(key, 4000)
+        client.flush_index()
+
+        client = self.get_sharded_client(s3_client)
+        with mock.patch.object(
+            client.boto, "get_object", wraps=client.boto.get_object
+        ) as get_object, mock.patch.object(
+            client.boto, "put_object", wraps=client.boto.put_object
+        ) as put_object:
+            client.set_remote_timestamp("vegetables/carrot", 5000)
+            client.flush_index()
+
+        assert [call[1]["Key"] for call in get_object.call_args_list] == [
+            client.manifest_path(),
+            client.shard_path("vegetables"),
+        ]
+        assert [call[1]["Key"] for call in put_object.call_args_list] == [
+            client.shard_path("vegetables"),
+            client.manifest_path(),
+        ]
+
+        client = self.get_sharded_client(s3_client)
+        assert len(client.index) == 4
+        assert dict(client.index.items()) == {
+            "fruit/apple": {"remote_timestamp": 4000},
+            "fruit/banana": {"remote_timestamp": 4000},
+            "vegetables/carrot": {"remote_timestamp": 5000},
+            "readme": {"remote_timestamp": 4000},
+        }
+
+    def test_remove_empty_shard(self, s3_client):
+        client = self.get_sharded_client(s3_client)
+        client.set_remote_timestamp("fruit/apple", 4000)
+        client.set_remote_timestamp("readme", 4000)
+        client.flush_index()
+
+        del client.index["fruit/apple"]
+        client.flush_index()
+
+        assert (
+            s3_client.boto.list_objects_v2(
+                Bucket=s3_client.bucket, Prefix=s3_client.prefix
+            )["KeyCount"]
+            == 2
+        )
+        client = self.get_sharded_client(s3_client)
+        assert dict(client.index.items()) == {"readme": {"remote_timestamp": 4000}}
+
+    def test_migrate_to_sharded_index(self, s3_client):
+        target_index = {
+            "fruit/apple": {"remote_timestamp": 4000, "local_timestamp": 3000},
+            "readme": {"remote_timestamp": 5000, "local_timestamp": 3000},
+        }
+        utils.set_s3_index(s3_client, target_index)
+
+        client = self.get_sharded_client(s3_client)
+        assert dict(client.index.items()) == target_index
+        client.flush_index()
+
+        with pytest.raises(ClientError):
+            s3_client.boto.get_object(
+                Bucket=s3_client.bucket, Key=s3_client.index_path()
+            )
+        client = self.get_sharded_client(s3_client)
+        assert dict(client.index.items()) == target_index
+
+    def test_migrate_from_sharded_index(self, s3_client):
+        target_index = {
+            "fruit/apple": {"remote_timestamp": 4000, "local_timestamp": 3000},
+            "readme": {"remote_timestamp": 5000, "local_timestamp": 3000},
+        }
+        client = self.get_sharded_client(s3_client)
+        client.index = target_index
+        client.flush_index()
+
+        s3_client.reload_index()
+        assert s3_client.index == target_index
+        s3_client.flush_index()
+
+        resp = s3_client.boto.list_objects_v2(
+            Bucket=s3_client.bucket, Prefix=s3_client.prefix
+        )
+        assert [obj["Key"] for obj in resp["Contents"]] == [s3_client.index_path()]
+        s3_client.reload_index()
+        assert s3_client.index == target_index
+
+
+class TestIndexCache(object):
+    def get_cached_client(self, s3_client, path, **kwargs):
+        return s3.S3SyncClient(
+            s3_client.boto,
+            s3_client.bucket,
+            s3_client.prefix,
+            index_cache_path=os.path.join(path, ".index.remote"),
+            **kwargs
+        )
+
+    def test_not_modified(self, s3_client, tmpdir):
+        target_index = {"red": {"remote_timestamp": 4000, "local_timestamp": 3000}}
+        utils.set_s3_index(s3_client, target_index, compression="gzip")
+
+        client = self.get_cached_client(s3_client, str(tmpdir))
+        assert dict(client.index.items()) == target_index
+
+        client = self.get_cached_client(s3_client, str(tmpdir))
+        with mock.patch.object(
+            client.boto, "get_object", wraps=client.boto.get_object
+        ) as get_object, mock.patch.object(
+            encoding, "decode_index", wraps=encoding.decode_index
+        ) as decode_index:
+            assert dict(client.index.items()) == target_index
+
+        assert get_object.call_count == 1
+        assert "IfNoneMatch" in get_object.call_args[1]
+        assert decode_index.call_count == 0
+
+    def test_flush_updates_cache(self, s3_client, tmpdir):
+        client = self.get_cached_client(s3_client, str(tmpdir))
+        client.set_remote_timestamp("red", 4000)
+        client.flush_index()
+
+        client = self.get_cached_client(s3_client, str(tmpdir))
+        with mock.patch.object(
+            encoding, "decode_index", wraps=encoding.decode_index
+        ) as decode_index:
+            assert client.index["red"]["remote_timestamp"] == 4000
+        assert decode_index.call_count == 0
+
+    def test_modified(self, s3_client, tmpdir):
+        utils.set_s3_index(s3_client, {"red": {"remote_timestamp": 4000}})
+        client = self.get_cached_client(s3_client, str(tmpdir))
+        assert client.index["red"]["remote_timestamp"] == 4000
+
+        # another machine updates the index
+        utils.set_s3_index(s3_client, {"red": {"remote_timestamp": 5000}})
+        client = self.get_cached_client(s3_client, str(tmpdir))
+        assert client.index["red"]["remote_timestamp"] == 5000
+
+        # and deletes it
+        s3_client.boto.delete_object(
+            Bucket=s3_client.bucket, Key=s3_client.index_path()
+        )
+        client = self.get_cached_client(s3_client, str(tmpdir))
+        assert client.index == {}
+        assert client.index_cache.get(client.index_path()) == (None, None)
+
+    def test_sharded_index(self, s3_client, tmpdir):
+        client = self.get_cached_client(s3_client, str(tmpdir), sharded_index=True)
+        client.set_remote_timestamp("fruit/apple", 4000)
+        client.flush_index()
+
+        client = self.get_cached_client(s3_client, str(tmpdir), sharded_index=True)
+        with mock.patch.object(
+            client.boto, "get_object", wraps=client.boto.get_object
+        ) as get_object:
+            assert client.index["fruit/apple"]["remote_timestamp"] == 4000
+
+        keys = [call[1]["Key"] for call in get_object.call_args_list]
+        assert keys == [client.manifest_path(), client.shard_path("fruit")]
+        assert "IfNoneMatch" in get_object.call_args[1]
+
+
+class TestIndexDeltas(object):
+    def get_delta_client(self, s3_client, **kwargs):
+        return s3.S3SyncClient(
+            s3_client.boto,
+            s3_client.bucket,
+            s3_client.prefix,
+            index_deltas=True,
+            **kwargs
+        )
+
+    def list_keys(self, s3_client):
+        resp = s3_client.boto.list_objects_v2(
+            Bucket=s3_client.bucket, Prefix=s3_client.prefix
+        )
+        return [
+            os.path.relpath(obj["Key"], s3_client.prefix)
+            for obj in resp.get("Contents", [])
+        ]
+
+    def test_write_deltas(self, s3_client):
+        client = self.get_delta_client(s3_client)
+        client.set_remote_timestamp("red", 4000)
+        client.set_remote_timestamp("green", 4000)
+        client.flush_index()
+
+        client = self.get_delta_client(s3_client)
+        client.set_remote_timestamp("red", 5000)
+        with mock.patch.object(
+            client.boto, "put_object", wraps=client.boto.put_object
+        ) as put_object:
+            client.flush_index()
+
+        assert put_object.call_count == 1
+        delta = put_object.call_args[1]
+        assert delta["Key"].startswith(client.delta_prefix())
+        assert sharded.decode_shard(delta["Body"]) == {
+            "red": {"remote_timestamp": 5000}
+        }
+
+        keys = self.list_keys(s3_client)
+        assert len(keys) == 2
+        assert all(key.startswith(".index.deltas/") for key in keys)
+
+        client = self.get_delta_client(s3_client)
+        assert dict(client.index.items()) == {
+            "red": {"remote_timestamp": 5000},
+            "green": {"remote_timestamp": 4000},
+        }
+
+    def test_no_changes(self, s3_client):
+        client = self.get_delta_client(s3_client)
+        with mock.patch.object(client.boto, "put_object") as put_object:
+            client.flush_index()
+        assert put_object.call_count == 0
+
+    def test_concurrent_writers(self, s3_client):
+        utils.set_s3_index(s3_client, {"red": {"remote_timestamp": 4000}})
+        client_1 = self.get_delta_client(s3_client)
+        client_2 = self.get_delta_client(s3_client)
+
+        client_1.set_remote_timestamp("green", 5000)
+        client_2.set_remote_timestamp("blue", 6000)
+        client_1.flush_index()
+        client_2.flush_index()
+
+        client = self.get_delta_client(s3_client)
+        assert dict(client.index.items()) == {
+            "red": {"remote_timestamp": 4000},
+            "green": {"remote_timestamp": 5000},
+            "blue": {"remote_timestamp": 6000},
+        }
+
+    @pytest.mark.parametrize("sharded_index", [False, True])
+    def test_compaction(self, s3_client, sharded_index):
+        client = self.get_delta_client(s3_client, sharded_index=sharded_index)
+        client.MAX_INDEX_DELTAS = 3
+        for timestamp in [4000, 5000, 6000]:
+            client.set_remote_timestamp("fruit/apple", timestamp)
+            client.flush_index()
+
+        keys = self.list_keys(s3_client)
+        assert not any(key.startswith(".index.deltas/") for key in keys)
+
+        client = self.get_delta_client(s3_client, sharded_index=sharded_index)
+        assert dict(client.index.items()) == {"fruit/apple": {"remote_timestamp": 6000}}
+
+    def test_read_without_deltas(self, s3_client):
+        utils.set_s3_index(s3_client, {"red": {"remote_timestamp": 4000}})
+        client = self.get_delta_client(s3_client)
+        client.set_remote_timestamp("red", 5000)
+        client.flush_index()
+
+        s3_client.reload_index()
+        assert dict(s3_client.index.items()) == {"red": {"remote_timestamp": 5000}}
+
+        # clients which do not write deltas compact them
+        s3_client.flush_index()
+        assert self.list_keys(s3_client) == [".index"]
+        s3_client.reload_index()
+        assert s3_client.index == {"red": {"remote_timestamp": 5000}}
@@ -1,28 +1,73 @@
 # -*- encoding: utf-8 -*-
 
 import argparse
+import time
 
 import mock
 import pytest
-from inotify_simple import Event, flags
+from inotify_simple import flags
 
-from s4.commands.daemon_command import DaemonCommand
+from s4.commands.daemon_command import DaemonCommand, SettlingKeys, is_index_file
+from s4.inotify_recursive import RecursiveEvent
 
 from tests.utils import create_logger
 
 
 class FakeINotify(object):
-    def __init__(self, events, wd_map):
+    def __init__(self, events):
         self.events = events
-        self.wd_map = wd_map
+        self.watches = []
 
-    def add_watches(self, *args, **kwargs):
-        return self.wd_map
+    def add_watches(self, path, mask, ignore=None):
+        self.watches.append((path, ignore))
+        return {}
+
+    def update_watches(self, path, ignore=None):
+        self.watches.append((path, ignore))
 
     def read(self, *args, **kwargs):
         return self.events
 
 
+def get_event(mask, key, source=None, root=b"/home/jon/code"):
+    return RecursiveEvent(
+        wd=1,
+        mask=mask,
+        cookie=0,
+        name=key.split("/")[-1],
+        root=root,
+        key=key,
+        source=source,
+    )
+
+
+def get_args(**kwargs):
+    defaults = {
+        "conflicts": "ignore",
+        "read_delay": 0,
+        "settle_time": 0,
+        "write_timeout": 0,
+        "flush_interval": 10,
+        "refresh_interval": 300,
+    }
+    defaults.update(kwargs)
+    return argparse.Namespace(**defaults)
+
+
+CONFIG = {
+    "targets": {
+        "foo": {
+            "local_folder": "/home/jon/code",
+            "s3_uri": "s3://bucket/code",
+            "aws_secret_access_key": "23232323",
+            "aws_access_key_id": "########",
+            "region_name": "eu-west-2",
+        },
+        "bar": {},
+    }
+}
+
+
 @mock.patch("s4.sync.SyncWorker")
 @mock.patch("s4.commands.daemon_command.INotifyRecursive")
 class TestDaemonCommand(object):
@@ -32,7 +77,7 @@ class TestDaemonCommand(object):
 
     @mock.patch("s4.commands.daemon_command.supported", False)
     def test_os_not_supported(self, INotifyRecursive, SyncWorker, capsys):
-        args = argparse.Namespace(targets=None, conflicts="ignore", read_delay=0)
+        args = get_args(targets=None)
 
         command = DaemonCommand(args, {}, create_logger())
         command.run(terminator=self.single_term)
@@ -48,7 +93,7 @@ class TestDaemonCommand(object):
 
     @pytest.mark.timeout(5)
     def test_no_targets(self, INotifyRecursive, SyncWorker, capsys):
-        args = argparse.Namespace(targets=None, conflicts="ignore", read_delay=0)
+        args = get_args(targets=None)
 
         command = DaemonCommand(args, {"targets": {}}, create_logger())
         command.run(terminator=self.single_term)
@@ -61,7 +106,7 @@ class TestDaemonCommand(object):
 
     @pytest.mark.timeout(5)
     def test_wrong_target(self, INotifyRecursive, SyncWorker, capsys):
-        args = argparse.Namespace(targets=["foo"], conflicts="ignore", read_delay=0)
+        args = get_args(targets=["foo"])
 
         command = DaemonCommand(args, {"targets": {"bar": {}}}, create_logger())
         command.run(terminator=self.single_term)
@@ -75,14 +120,14 @@ class TestDaemonCommand(object):
     @pytest.mark.timeout(5)
     def test_specific_target(self, INotifyRecursive, SyncWorker):
         INotifyRecursive.return_value = FakeINotify(
-            events={
-                Event(wd=1, mask=flags.CREATE, cookie=None, name="hello.txt"),
-                Event(wd=2, mask=flags.CREATE, cookie=None, name="bar.txt"),
-            },
-            wd_map={1: "/home/jon/code/", 2: "/home/jon/code/hoot"},
+            events=[
+                get_event(flags.CREATE, "hello.txt"),
+                get_event(flags.CREATE, "hoot/bar.txt"),
+                get_event(flags.MODIFY, "hoot/.index"),
+            ]
         )
 
-        args = argparse.Namespace(targets=["foo"], conflicts="ignore", read_delay=0)
+        args = get_args(targets=["foo"])
         config = {
             "targets": {
                 "foo": {
@@ -98,5 +143,232 @@ class TestDaemonCommand(object):
         command = DaemonCommand(args, config, create_logger())
         command.run(terminator=self.single_term)
 
-        assert SyncWorker.call_count == 2
+        # the clients are created once and kept for every later sync
+        assert SyncWorker.call_count == 1
         assert INotifyRecursive.call_count == 1
+
+        worker = SyncWorker.return_value
+        assert worker.sync.call_args_list == [
+            mock.call(conflict_choice="ignore"),
+            mock.call(
+                conflict_choice="ignore",
+                keys=["hello.txt", "hoot/bar.txt"],
+                refresh=False,
+                flush=False,
+            ),
+        ]
+        # flushed when the daemon stops
+        assert worker.flush_index.call_count == 1
+
+        # ignored directories are not watched
+        notifier = INotifyRecursive.return_value
+        assert notifier.watches == [(b"/home/jon/code", worker.client_1.is_ignored)]
+
+    @pytest.mark.timeout(5)
+    def test_flush_interval(self, INotifyRecursive, SyncWorker):
+        INotifyRecursive.return_value = FakeINotify(
+            events=[get_event(flags.MODIFY, "hello.txt")]
+        )
+
+        args = get_args(targets=["foo"], flush_interval=0)
+        command = DaemonCommand(args, CONFIG, create_logger())
+        command.run(terminator=lambda index: index >= 2)
+
+        worker = SyncWorker.return_value
+        assert worker.sync.call_count == 3
+        assert worker.flush_index.call_count == 2
+
+    @pytest.mark.timeout(5)
+    def test_refresh_interval(self, INotifyRecursive, SyncWorker):
+        INotifyRecursive.return_value = FakeINotify(events=[])
+
+        args = get_args(targets=["foo"], refresh_interval=0)
+        command = DaemonCommand(args, CONFIG, create_logger())
+        command.run(terminator=self.single_term)
+
+        worker = SyncWorker.return_value
+        assert worker.client_1.reload_index.call_count == 1
+        assert worker.client_2.reload_index.call_count == 1
+        assert worker.client_2.reload_ignore_files.call_count == 1
+        assert worker.sync.call_args_list == [
+            mock.call(conflict_choice="ignore"),
+            mock.call(conflict_choice="ignore"),
+        ]
+        assert worker.flush_index.call_count == 0
+
+        # the ignore files did not change, so neither did the watches
+        notifier = INotifyRecursive.return_value
+        assert notifier.watches == [(b"/home/jon/code", worker.client_1.is_ignored)]
+
+    @pytest.mark.timeout(5)
+    def test_syncignore_changed(self, INotifyRecursive, SyncWorker):
+        INotifyRecursive.return_value = FakeINotify(
+            events=[get_event(flags.MODIFY, ".syncignore")]
+        )
+        client_1 = SyncWorker.return_value.client_1
+        client_1.ignore_files = [".index"]
+
+        def reload_ignore_files():
+            client_1.ignore_files = [".index", "node_modules"]
+
+        client_1.reload_ignore_files.side_effect = reload_ignore_files
+
+        command = DaemonCommand(get_args(targets=["foo"]), CONFIG, create_logger())
+        command.run(terminator=self.single_term)
+
+        worker = SyncWorker.return_value
+        assert worker.client_1.reload_ignore_files.call_count == 1
+        # the watches were updated for the new ignore rules
+        notifier = INotifyRecursive.return_value
+        assert notifier.watches == [
+            (b"/home/jon/code", worker.client_1.is_ignored),
+            (b"/home/jon/code", worker.client_1.is_ignored),
+        ]
+
+    @pytest.mark.timeout(5)
+    def test_moved(self, INotifyRecursive, SyncWorker):
+        INotifyRecursive.return_value = FakeINotify(
+            events=[
+                get_event(flags.MOVED_TO | flags.ISDIR, "new/photos", source="photos"),
+                get_event(flags.MOVED_FROM, "gone.txt"),
+            ]
+        )
+
+        command = DaemonCommand(get_args(targets=["foo"]), CONFIG, create_logger())
+        command.run(terminator=self.single_term)
+
+        worker = SyncWorker.return_value
+        assert worker.sync.call_args_list[-1] == mock.call(
+            conflict_choice="ignore",
+            keys=["gone.txt", "new/photos", "photos"],
+            refresh=False,
+            flush=False,
+        )
+
+    @pytest.mark.timeout(5)
+    def test_overflow(self, INotifyRecursive, SyncWorker):
+        INotifyRecursive.return_value = FakeINotify(
+            events=[
+                get_event(flags.CREATE, "hello.txt"),
+                RecursiveEvent(-1, flags.Q_OVERFLOW, 0, "", None, None, None),
+                get_event(flags.CREATE, "world.txt"),
+            ]
+        )
+
+        command = DaemonCommand(get_args(targets=["foo"]), CONFIG, create_logger())
+        command.run(terminator=self.single_term)
+
+        # every change may not have been seen, so the whole target is synced
+        worker = SyncWorker.return_value
+        assert worker.sync.call_args_list == [
+            mock.call(conflict_choice="ignore"),
+            mock.call(conflict_choice="ignore", flush=False),
+        ]
+
+    @pytest.mark.timeout(5)
+    def test_settle_time(self, INotifyRecursive, SyncWorker):
+        INotifyRecursive.return_value = FakeINotify(
+            events=[
+                get_event(flags.MODIFY, "big.iso"),
+                get_event(flags.CLOSE_WRITE, "big.iso"),
+            ]
+        )
+
+        args = get_args(targets=["foo"], settle_time=60)
+        command = DaemonCommand(args, CONFIG, create_logger())
+        command.run(terminator=lambda index: index >= 2)
+
+        # still within its settle time, so not synced yet
+        worker = SyncWorker.return_value
+        assert worker.sync.call_args_list == [mock.call(conflict_choice="ignore")]
+        assert worker.flush_index.call_count == 0
+
+    @pytest.mark.timeout(5)
+    def test_open_file_is_held_back(self, INotifyRecursive, SyncWorker):
+        events = [
+            [get_event(flags.MODIFY, "big.iso"), get_event(flags.MODIFY, "a.txt")],
+            [get_event(flags.CLOSE_WRITE, "a.txt")],
+            [],
+        ]
+        notifier = FakeINotify(events=[])
+        notifier.read = mock.MagicMock(side_effect=events)
+        INotifyRecursive.return_value = notifier
+
+        args = get_args(targets=["foo"], settle_time=0, write_timeout=60)
+        command = DaemonCommand(args, CONFIG, create_logger())
+        command.run(terminator=lambda index: index >= 3)
+
+        # big.iso was never closed, so it is not synced after settle_time
+        worker = SyncWorker.return_value
+        assert worker.sync.call_args_list == [
+            mock.call(conflict_choice="ignore"),
+            mock.call(
+                conflict_choice="ignore", keys=["a.txt"], refresh=False, flush=False
+            ),
+        ]
+
+    def test_get_read_timeout(self, INotifyRecursive, SyncWorker):
+        command = DaemonCommand(get_args(), CONFIG, create_logger())
+        now = time.monotonic()
+
+        assert 299000 < command.get_read_timeout(now, now, set()) <= 300000
+        assert 9000 < command.get_read_timeout(now, now, {"foo"}) <= 10000
+        assert 1000 < command.get_read_timeout(now, now, set(), now + 2) <= 2000
+        assert command.get_read_timeout(now, now, set(), now - 2) == 0
+
+
+class TestSettlingKeys(object):
+    def test_pop_settled(self):
+        settling = SettlingKeys(settle_time=2, write_timeout=60)
+        assert settling.get_deadline() is None
+
+        settling.add("foo", "big.iso", now=10)
+        settling.add("foo", "hello.txt", now=11)
+        settling.add("bar", "hello.txt", now=11)
+        assert len(settling) == 3
+        assert settling.get_deadline() == 12
+
+        assert settling.pop_settled(now=11) == {}
+        assert settling.pop_settled(now=12) == {"foo": {"big.iso"}}
+        assert settling.pop_settled(now=13) == {
+            "foo": {"hello.txt"},
+            "bar": {"hello.txt"},
+        }
+        assert len(settling) == 0
+
+    def test_open_files(self):
+        settling = SettlingKeys(settle_time=2, write_timeout=60)
+
+        settling.add("foo", "big.iso", writing=True, now=10)
+        assert settling.get_deadline() == 70
+        assert settling.pop_settled(now=20) == {}
+
+        # closed after writing
+        settling.add("foo", "big.iso", now=30)
+        assert settling.pop_settled(now=32) == {"foo": {"big.iso"}}
+
+        # writers which never close the file are synced eventually
+        settling.add("foo", "app.log", writing=True, now=40)
+        assert settling.pop_settled(now=100) == {"foo": {"app.log"}}
+
+    def test_events_restart_settle_time(self):
+        settling = SettlingKeys(settle_time=2, write_timeout=60)
+
+        # a file being written keeps changing until it is closed
+        settling.add("foo", "big.iso", now=10)
+        settling.add("foo", "big.iso", now=11.5)
+        settling.add("foo", "big.iso", now=13)
+
+        assert settling.pop_settled(now=14) == {}
+        assert settling.get_deadline() == 15
+        assert settling.pop_settled(now=15) == {"foo": {"big.iso"}}
+
+
+def test_is_index_file():
+    assert is_index_file(".index")
+    assert is_index_file(".index.sqlite-wal")
+    assert is_index_file(".index.d/0a")
+    assert is_index_file(".index.tmp-abc123")
+    assert is_index_file(".s4lock")
+    assert not is_index_file(".index.html")
+    assert not is_index_file("docs/.index.md")
@@ -41,7 +41,9 @@ class TestLsCommand(object):
                 }
             }
         }
-        args = argparse.Namespace(target="foo", sort_by="key", descending=False)
+        args = argparse.Namespace(
+            target="foo", sort_by="key", descending=False, prefix=None
+        )
         command = LsCommand(args, config, create_logger())
         command.run()
 
@@ -83,7 +85,7 @@ class TestLsCommand(object):
         )
 
         args = argparse.Namespace(
-            target="foo", sort_by="key", show_all=False, descending=False
+            target="foo", sort_by="key", show_all=False, descending=False, prefix=None
         )
         command = LsCommand(args, config, create_logger())
         command.run()
@@ -128,7 +130,7 @@ class TestLsCommand(object):
         )
 
         args = argparse.Namespace(
-            target="foo", sort_by="key", show_all=True, descending=False
+            target="foo", sort_by="key", show_all=True, descending=False, prefix=None
         )
         command = LsCommand(args, config, create_logger())
         command.run()
@@ -143,3 +145,56 @@ class TestLsCommand(object):
             "crackers  <deleted>\n"
             "Total Size: 0.00Mb\n"
         )
+
+    def test_prefix(self, s3_client, local_client, capsys):
+        config = {
+            "targets": {
+                "foo": {
+                    "local_folder": local_client.get_uri(),
+                    "s3_uri": s3_client.get_uri(),
+                    "aws_access_key_id": "",
+                    "aws_secret_access_key": "",
+                    "region_name": "eu-west-2",
+                }
+            }
+        }
+        set_s3_index(
+            s3_client,
+            {
+                "fruit/apple": {"local_timestamp": get_timestamp(2017, 12, 12, 8, 30)},
+                "vegetables/carrot": {
+                    "local_timestamp": get_timestamp(2017, 12, 12, 8, 30)
+                },
+            },
+        )
+        set_local_index(
+            local_client,
+            {
+                "fruit/apple": {"local_timestamp": get_timestamp(2017, 2, 2, 8, 30)},
+                "fruit/banana": {"local_timestamp": get_timestamp(2017, 2, 2, 8, 30)},
+                "vegetables/carrot": {
+                    "local_timestamp": get_timestamp(2017, 2, 2, 8, 30)
+                },
+            },
+        )
+
+        args = argparse.Namespace(
+            target="foo",
+            sort_by="key",
+            show_all=False,
+            descending=False,
+            prefix="fruit/",
+        )
+        command = LsCommand(args, config, create_logger())
+        command.run()
+
+        out, err = capsys.readouterr()
+
+        assert err == ""
+        assert out == (
+            "key           local                s3\n"
+            "------------  -------------------  -------------------\n"
+            "fruit/apple   2017-02-02 08:30:00  2017-12-12 08:30:00\n"
+            "fruit/banana  2017-02-02 08:30:00\n"
+            "Total Size: 0.00Mb\n"
+        )
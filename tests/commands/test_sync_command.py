@@ -1,11 +1,13 @@
 #! -*- encoding: utf-8 -*-
 import argparse
+import concurrent.futures
 
 import mock
 
 from s4.clients import SyncState
 from s4.commands.sync_command import (
     SyncCommand,
+    TargetSummary,
     display_progress_bar,
     handle_conflict,
     hide_progress_bar,
@@ -78,7 +80,9 @@ def test_progressbar_smoketest(s3_client, local_client):
 @mock.patch("s4.sync.SyncWorker")
 class TestSyncCommand(object):
     def test_no_targets(self, SyncWorker, capsys):
-        args = argparse.Namespace(targets=None, conflicts=None, dry_run=False)
+        args = argparse.Namespace(
+            targets=None, conflicts=None, dry_run=False, jobs=None, parallel_targets=1
+        )
         command = SyncCommand(args, {"targets": {}}, create_logger())
         command.run()
 
@@ -87,7 +91,13 @@ class TestSyncCommand(object):
         assert SyncWorker.call_count == 0
 
     def test_wrong_target(self, SyncWorker, capsys):
-        args = argparse.Namespace(targets=["foo", "bar"], conflicts=None, dry_run=False)
+        args = argparse.Namespace(
+            targets=["foo", "bar"],
+            conflicts=None,
+            dry_run=False,
+            jobs=None,
+            parallel_targets=1,
+        )
         command = SyncCommand(args, {"targets": {"baz": {}}}, create_logger())
         command.run()
 
@@ -101,7 +111,12 @@ class TestSyncCommand(object):
 
     def test_sync_error(self, SyncWorker, capsys):
         args = argparse.Namespace(
-            targets=None, conflicts=None, dry_run=False, log_level="INFO"
+            targets=None,
+            conflicts=None,
+            dry_run=False,
+            jobs=None,
+            parallel_targets=1,
+            log_level="INFO",
         )
         config = {
             "targets": {
@@ -136,7 +151,12 @@ class TestSyncCommand(object):
 
     def test_sync_error_debug(self, SyncWorker, capsys):
         args = argparse.Namespace(
-            targets=None, conflicts=None, dry_run=False, log_level="DEBUG"
+            targets=None,
+            conflicts=None,
+            dry_run=False,
+            jobs=None,
+            parallel_targets=1,
+            log_level="DEBUG",
         )
         config = {
             "targets": {
@@ -163,7 +183,9 @@ class TestSyncCommand(object):
         ]
 
     def test_keyboard_interrupt(self, SyncWorker, capsys):
-        args = argparse.Namespace(targets=None, conflicts=None, dry_run=False)
+        args = argparse.Namespace(
+            targets=None, conflicts=None, dry_run=False, jobs=None, parallel_targets=1
+        )
         config = {
             "targets": {
                 "foo": {
@@ -193,7 +215,9 @@ class TestSyncCommand(object):
         assert err == ("Quitting due to Keyboard Interrupt...\n")
 
     def test_all_targets(self, SyncWorker, capsys):
-        args = argparse.Namespace(targets=None, conflicts=None, dry_run=False)
+        args = argparse.Namespace(
+            targets=None, conflicts=None, dry_run=False, jobs=None, parallel_targets=1
+        )
         config = {
             "targets": {
                 "foo": {
@@ -223,3 +247,197 @@ class TestSyncCommand(object):
             "Syncing foo [/home/mike/docs/ <=> s3://foobar/docs/]\n"
         )
         assert SyncWorker.call_count == 2
+
+    def test_jobs(self, SyncWorker, capsys):
+        args = argparse.Namespace(
+            targets=None, conflicts=None, dry_run=False, jobs=None, parallel_targets=1
+        )
+        config = {
+            "targets": {
+                "foo": {
+                    "local_folder": "/home/mike/docs",
+                    "s3_uri": "s3://foobar/docs",
+                    "aws_access_key_id": "3223323",
+                    "aws_secret_access_key": "23#@423#@",
+                    "region_name": "us-east-1",
+                    "jobs": 8,
+                }
+            }
+        }
+
+        command = SyncCommand(args, config, create_logger())
+        command.run()
+        assert SyncWorker.call_args[1]["jobs"] == 8
+
+        args.jobs = 3
+        command.run()
+        assert SyncWorker.call_args[1]["jobs"] == 3
+
+    def test_parallel_targets(self, SyncWorker, capsys):
+        args = argparse.Namespace(
+            targets=None, conflicts=None, dry_run=False, jobs=None, parallel_targets=2
+        )
+        config = {
+            "targets": {
+                "foo": {
+                    "local_folder": "/home/mike/docs",
+                    "s3_uri": "s3://foobar/docs",
+                    "aws_access_key_id": "3223323",
+                    "aws_secret_access_key": "23#@423#@",
+                    "region_name": "us-east-1",
+                },
+                "bar": {
+                    "local_folder": "/home/mike/barmil",
+                    "s3_uri": "s3://foobar/barrel",
+                    "aws_access_key_id": "3223323",
+                    "aws_secret_access_key": "23#@423#@",
+                    "region_name": "us-east-1",
+                },
+            }
+        }
+
+        command = SyncCommand(args, config, create_logger())
+        command.run()
+
+        out, err = capsys.readouterr()
+        assert out == ""
+        lines = err.splitlines()
+        assert sorted(lines[:2]) == [
+            "[bar] Syncing bar [/home/mike/barmil/ <=> s3://foobar/barrel/]",
+            "[foo] Syncing foo [/home/mike/docs/ <=> s3://foobar/docs/]",
+        ]
+        assert lines[2] == "Summary:"
+        assert lines[3].startswith("  bar: ")
+        assert lines[3].endswith("s, 0.00Mb transferred")
+        assert lines[4].startswith("  foo: ")
+
+        assert SyncWorker.call_count == 2
+        (_, client_1), kwargs_1 = SyncWorker.call_args_list[0]
+        (_, client_2), kwargs_2 = SyncWorker.call_args_list[1]
+        # both targets use the same credentials
+        assert client_1.boto is client_2.boto
+        assert client_1.boto.meta.config.max_pool_connections == 10
+        assert kwargs_1["callback_lock"] is kwargs_2["callback_lock"]
+
+    def test_parallel_targets_pool_size(self, SyncWorker):
+        args = argparse.Namespace(
+            targets=None, conflicts=None, dry_run=False, jobs=8, parallel_targets=2
+        )
+        config = {
+            "targets": {
+                "foo": {
+                    "local_folder": "/home/mike/docs",
+                    "s3_uri": "s3://foobar/docs",
+                    "aws_access_key_id": "3223323",
+                    "aws_secret_access_key": "23#@423#@",
+                    "region_name": "us-east-1",
+                },
+                "bar": {
+                    "local_folder": "/home/mike/barmil",
+                    "s3_uri": "s3://foobar/barrel",
+                    "aws_access_key_id": "3223323",
+                    "aws_secret_access_key": "23#@423#@",
+                    "region_name": "us-east-1",
+                },
+            }
+        }
+
+        command = SyncCommand(args, config, create_logger())
+        command.run()
+
+        # the shared connection pool has room for the transfers of both targets
+        (_, client), _ = SyncWorker.call_args
+        assert client.boto.meta.config.max_pool_connections == 16
+
+    def test_parallel_targets_error(self, SyncWorker, capsys):
+        args = argparse.Namespace(
+            targets=None,
+            conflicts=None,
+            dry_run=False,
+            jobs=None,
+            parallel_targets=2,
+            log_level="INFO",
+        )
+        config = {
+            "targets": {
+                "foo": {
+                    "local_folder": "/home/mike/docs",
+                    "s3_uri": "s3://foobar/docs",
+                    "aws_access_key_id": "3223323",
+                    "aws_secret_access_key": "23#@423#@",
+                    "region_name": "us-east-1",
+                },
+                "bar": {
+                    "local_folder": "/home/mike/barmil",
+                    "s3_uri": "s3://foobar/barrel",
+                    "aws_access_key_id": "3223",
+                    "aws_secret_access_key": "23#eWEa@423#@",
+                    "region_name": "us-west-2",
+                },
+            }
+        }
+        SyncWorker.side_effect = ValueError("something bad happened")
+
+        command = SyncCommand(args, config, create_logger())
+        command.run()
+
+        out, err = capsys.readouterr()
+        lines = err.splitlines()
+        assert "[bar] There was an error syncing 'bar':" in lines
+        assert "[foo] There was an error syncing 'foo':" in lines
+        assert lines[-2].endswith("(failed)")
+        assert lines[-1].endswith("(failed)")
+
+    def test_parallel_targets_interrupt(self, SyncWorker, capsys):
+        args = argparse.Namespace(
+            targets=None, conflicts=None, dry_run=False, jobs=None, parallel_targets=2
+        )
+        config = {
+            "targets": {
+                "foo": {
+                    "local_folder": "/home/mike/docs",
+                    "s3_uri": "s3://foobar/docs",
+                    "aws_access_key_id": "3223323",
+                    "aws_secret_access_key": "23#@423#@",
+                    "region_name": "us-east-1",
+                },
+                "bar": {
+                    "local_folder": "/home/mike/barmil",
+                    "s3_uri": "s3://foobar/barrel",
+                    "aws_access_key_id": "3223323",
+                    "aws_secret_access_key": "23#@423#@",
+                    "region_name": "us-east-1",
+                },
+            }
+        }
+
+        stopped = []
+
+        def sync(**kwargs):
+            # both targets keep syncing until they are asked to stop
+            stop_event = SyncWorker.call_args[1]["stop_event"]
+            stopped.append(stop_event.wait(5))
+
+        SyncWorker.return_value.sync.side_effect = sync
+
+        command = SyncCommand(args, config, create_logger())
+        with mock.patch.object(
+            concurrent.futures.Future, "result", side_effect=KeyboardInterrupt
+        ):
+            command.run()
+
+        # the running targets were stopped and waited for
+        assert stopped == [True, True]
+        out, err = capsys.readouterr()
+        assert err.splitlines()[-1] == "Quitting due to Keyboard Interrupt..."
+
+
+class TestTargetSummary(object):
+    def test_repr(self):
+        summary = TargetSummary("foo")
+        summary.duration = 1.5
+        summary.transferred = 3 * 1024 * 1024
+        assert repr(summary) == "foo: 1.50s, 3.00Mb transferred"
+
+        summary.error = ValueError("oops")
+        assert repr(summary) == "foo: 1.50s, 3.00Mb transferred (failed)"
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from s4.index import benchmark
+
+
+def test_generate_index():
+    index = benchmark.generate_index(100)
+    assert len(index) == 100
+    assert index == benchmark.generate_index(100)
+    assert all("content_hash" in entry for entry in index.values())
+
+    index = benchmark.generate_index(10, content_hash=False)
+    assert not any("content_hash" in entry for entry in index.values())
+
+
+def test_run_benchmark():
+    index = benchmark.generate_index(100)
+    rows = benchmark.run_benchmark(index, ["none", "zlib:1"], repeat=1)
+
+    assert [row[0] for row in rows] == ["none", "zlib:1"]
+    assert rows[0][2] == 1
+    assert rows[1][1] < rows[0][1]
+
+
+def test_main(capsys):
+    benchmark.main(["--entries", "50", "--repeat", "1", "--codec", "bz2"])
+
+    out, _ = capsys.readouterr()
+    assert "Benchmarking an index of 50 entries" in out
+    assert "bz2" in out
+
+
+def test_main_folder(tmpdir, capsys):
+    tmpdir.join(".index").write('{"foo": {"local_timestamp": 4000}}')
+    benchmark.main([str(tmpdir), "--repeat", "1", "--codec", "gzip"])
+
+    out, _ = capsys.readouterr()
+    assert "Benchmarking an index of 1 entries" in out
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from s4.index import binary
+
+
+def write_index(path, items, **kwargs):
+    with open(path, "wb") as fp:
+        binary.write_binary_index(fp, items, **kwargs)
+    return binary.BinaryIndex(path)
+
+
+class TestBinaryIndex(object):
+    def setup_method(self):
+        self.target_folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.target_folder, ".index")
+
+    def teardown_method(self):
+        shutil.rmtree(self.target_folder)
+
+    def test_empty(self):
+        index = write_index(self.path, [])
+        assert len(index) == 0
+        assert list(index) == []
+        assert "foo" not in index
+
+    def test_round_trip(self):
+        items = [
+            ("bar/baz.txt", {"local_timestamp": 5000.5, "remote_timestamp": 4000}),
+            ("foo", {"local_timestamp": None, "remote_timestamp": 4000}),
+            (
+                "foo/ünicode",
+                {
+                    "local_timestamp": 1,
+                    "remote_timestamp": None,
+                    "content_hash": "5d41402abc4b2a76b9719d911017c592",
+                },
+            ),
+        ]
+        index = write_index(self.path, items)
+
+        assert len(index) == 3
+        assert list(index.iter_items()) == items
+        assert index["foo"] == {"local_timestamp": None, "remote_timestamp": 4000}
+        assert index["foo/ünicode"]["content_hash"] == (
+            "5d41402abc4b2a76b9719d911017c592"
+        )
+
+    @pytest.mark.parametrize("restart_interval", [1, 3, 16])
+    def test_lookup(self, restart_interval):
+        keys = sorted("dir{}/file{}".format(i // 10, i % 10) for i in range(0, 200, 2))
+        items = [(key, {"remote_timestamp": i}) for i, key in enumerate(keys)]
+        index = write_index(self.path, items, restart_interval=restart_interval)
+
+        assert list(index) == keys
+        for i, key in enumerate(keys):
+            assert key in index
+            assert index[key]["remote_timestamp"] == i
+
+        # keys before, between and after the stored keys
+        for key in ["a", "dir0/file1", "dir5/file", "dir9/file9", "z"]:
+            assert key not in index
+            with pytest.raises(KeyError):
+                index[key]
+
+    def test_unsorted(self):
+        with pytest.raises(ValueError):
+            binary.write_binary_index(io.BytesIO(), [("b", {}), ("a", {})])
+
+        with pytest.raises(ValueError):
+            binary.write_binary_index(io.BytesIO(), [("a", {}), ("a", {})])
+
+    def test_not_binary_index(self):
+        with open(self.path, "w") as fp:
+            fp.write('{"foo": {"local_timestamp": 4000}}')
+
+        with pytest.raises(ValueError):
+            binary.BinaryIndex(self.path)
+
+    def test_truncated(self):
+        write_index(self.path, [("foo", {"remote_timestamp": 4000})])
+        with open(self.path, "r+b") as fp:
+            fp.truncate(os.path.getsize(self.path) - 1)
+
+        with pytest.raises(ValueError):
+            binary.BinaryIndex(self.path)
+
+    @pytest.mark.parametrize("restart_interval", [1, 3, 16])
+    def test_iter_items_prefix(self, restart_interval):
+        keys = sorted("dir{}/file{}".format(i // 10, i % 10) for i in range(100))
+        items = [(key, {"remote_timestamp": 4000}) for key in keys]
+        index = write_index(self.path, items, restart_interval=restart_interval)
+
+        assert [key for key, _ in index.iter_items("dir3/")] == [
+            "dir3/file{}".format(i) for i in range(10)
+        ]
+        assert [key for key, _ in index.iter_items("dir9/file9")] == ["dir9/file9"]
+        assert list(index.iter_items("a")) == []
+        assert list(index.iter_items("dir3/x")) == []
+        assert list(index.iter_items("z")) == []
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+from s4.index.cache import IndexCache
+
+
+class TestIndexCache(object):
+    def setup_method(self):
+        self.target_folder = tempfile.mkdtemp()
+        self.cache = IndexCache(os.path.join(self.target_folder, ".index.remote"))
+
+    def teardown_method(self):
+        shutil.rmtree(self.target_folder)
+
+    def test_empty(self):
+        assert self.cache.get("foo/.index") == (None, None)
+
+    def test_put_get(self):
+        items = [
+            ("bar", {"local_timestamp": 4000, "remote_timestamp": None}),
+            ("foo", {"local_timestamp": 5000, "remote_timestamp": 6000}),
+        ]
+        self.cache.put("foo/.index", '"abc"', iter(items))
+
+        etag, index = self.cache.get("foo/.index")
+        assert etag == '"abc"'
+        assert list(index.items()) == items
+
+        self.cache.remove("foo/.index")
+        assert self.cache.get("foo/.index") == (None, None)
+
+    def test_unknown_fields(self):
+        self.cache.put("foo/.index", '"abc"', iter([("bar", {"local_timestamp": 1})]))
+        self.cache.put("foo/.index", '"def"', iter([("bar", {"colour": "red"})]))
+
+        # the previous copy is not used for the new ETag
+        assert self.cache.get("foo/.index") == (None, None)
+        assert [name for name in os.listdir(self.cache.path) if "." in name] == []
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from s4.index import OverlayIndex
+from s4.index.compact import CompactIndex, compact_index
+
+ITEMS = [
+    ("/absolute", {"remote_timestamp": None}),
+    ("apple", {"remote_timestamp": 1000, "local_timestamp": 1000.5}),
+    ("fruit/", {}),
+    ("fruit/banana", {"local_timestamp": 2000, "content_hash": "00" * 15 + "ff"}),
+    ("fruit/citrus/lemon", {"remote_timestamp": 3000, "content_hash": None}),
+    ("fruit/citrus/lime", {"remote_timestamp": 4000}),
+    ("vegetables/ñame", {"local_timestamp": 5000}),
+]
+
+
+class TestCompactIndex(object):
+    def setup_method(self):
+        self.index = CompactIndex.from_items(ITEMS)
+
+    def test_entries(self):
+        assert len(self.index) == len(ITEMS)
+        assert dict(self.index.items()) == dict(ITEMS)
+        assert list(self.index) == [key for key, _ in ITEMS]
+
+    def test_lookup(self):
+        assert self.index["fruit/citrus/lemon"] == {
+            "remote_timestamp": 3000,
+            "content_hash": None,
+        }
+        assert "vegetables/ñame" in self.index
+        assert "fruit" not in self.index
+        assert "zucchini" not in self.index
+        with pytest.raises(KeyError):
+            self.index["fruit/citrus"]
+
+    def test_directories_interned(self):
+        assert self.index._directories == [
+            "/",
+            "",
+            "fruit/",
+            "fruit/citrus/",
+            "vegetables/",
+        ]
+
+    @pytest.mark.parametrize(
+        ["prefix", "expected"],
+        [
+            ("fruit/citrus/", ["fruit/citrus/lemon", "fruit/citrus/lime"]),
+            ("fruit/c", ["fruit/citrus/lemon", "fruit/citrus/lime"]),
+            ("a", ["apple"]),
+            ("zucchini", []),
+            (None, [key for key, _ in ITEMS]),
+        ],
+    )
+    def test_iter_items_prefix(self, prefix, expected):
+        assert [key for key, _ in self.index.iter_items(prefix)] == expected
+
+    def test_unsorted(self):
+        with pytest.raises(ValueError):
+            CompactIndex.from_items(reversed(ITEMS))
+
+    @pytest.mark.parametrize(
+        "entry", [{"size": 10}, {"content_hash": "abc"}, {"remote_timestamp": "x"}]
+    )
+    def test_bad_entry(self, entry):
+        with pytest.raises((ValueError, TypeError)):
+            CompactIndex.from_items([("foo", entry)])
+
+
+def test_compact_index():
+    index = compact_index(dict(ITEMS))
+    assert isinstance(index, OverlayIndex)
+    assert isinstance(index.base, CompactIndex)
+    assert dict(index.items()) == dict(ITEMS)
+
+    index["apple"] = {"remote_timestamp": 6000}
+    del index["fruit/"]
+    assert index["apple"] == {"remote_timestamp": 6000}
+    assert "fruit/" not in index
+    assert index.base["apple"] == dict(ITEMS)["apple"]
+
+
+def test_compact_index_unknown_fields():
+    index = {"foo": {"remote_timestamp": 1000, "owner": "me"}}
+    assert compact_index(index) is index
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import gzip
+import zlib
+
+import pytest
+
+from s4.index import encoding
+
+
+@pytest.mark.parametrize("codec", ["none", "gzip", "zlib"])
+def test_encode_index(codec):
+    data = encoding.encode_index(b'{"foo": {}}', codec)
+    assert data[:4] == b"S4IJ"
+    assert encoding.detect_codec(data) == (codec, encoding.HEADER.size)
+    assert encoding.decode_index(data) == b'{"foo": {}}'
+
+
+def test_encode_unknown_codec():
+    with pytest.raises(ValueError):
+        encoding.encode_index(b"{}", "snappy")
+
+
+@pytest.mark.parametrize(
+    ["data", "codec"],
+    [
+        (b'{"foo": {}}', "none"),
+        (b'  \n{"foo": {}}', "none"),
+        (gzip.compress(b'{"foo": {}}'), "gzip"),
+        (zlib.compress(b'{"foo": {}}'), "zlib"),
+        (zlib.compress(b'{"foo": {}}', 9), "zlib"),
+        (zlib.compress(b'{"foo": {}}', 1), "zlib"),
+    ],
+)
+def test_legacy_index(data, codec):
+    assert encoding.detect_codec(data) == (codec, 0)
+    assert encoding.loads_index(data) == {"foo": {}}
+
+
+def test_empty_index():
+    assert encoding.loads_index(b"") == {}
+    assert encoding.loads_index(encoding.encode_index(b"", "gzip")) == {}
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"\x00\x01\x02",
+        b"[]",
+        b"S4IJ",
+        b"S4IJ\x02\x00{}",
+        b"S4IJ\x01\x09{}",
+    ],
+)
+def test_bad_index(data):
+    with pytest.raises(ValueError):
+        encoding.loads_index(data)
+
+
+def test_dumps_index():
+    index = {"foo": {"local_timestamp": 4000}}
+    assert encoding.loads_index(encoding.dumps_index(index)) == index
+
+
+@pytest.mark.parametrize(
+    "codec", ["gzip:1", "gzip:9", "zlib:0", "zlib:9", "lzma", "lzma:9", "bz2:1"]
+)
+def test_codec_levels(codec):
+    data = encoding.encode_index(b'{"foo": {}}', codec)
+    assert encoding.detect_codec(data) == (codec.split(":")[0], encoding.HEADER.size)
+    assert encoding.loads_index(data) == {"foo": {}}
+
+
+@pytest.mark.parametrize("codec", ["gzip:10", "bz2:0", "zlib:fast", "none:1", "lz4"])
+def test_parse_bad_codec(codec):
+    with pytest.raises(ValueError):
+        encoding.parse_codec(codec)
+
+
+def test_parse_codec():
+    assert encoding.parse_codec("zlib:1") == (encoding.CODECS["zlib"], 1)
+    assert encoding.parse_codec("gzip") == (encoding.CODECS["gzip"], 9)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+
+import pytest
+
+from s4.clients.local import LocalSyncClient
+from s4.clients.s3 import S3SyncClient
+from s4.index import (
+    INDEX_FILE_NAMES,
+    OverlayIndex,
+    find_keys_under,
+    iter_sorted_items,
+    write_json_index,
+)
+from s4.index import sharded
+
+
+class TestOverlayIndex(object):
+    def setup_method(self):
+        self.base = {
+            "bar": {"local_timestamp": 1000, "remote_timestamp": 1000},
+            "foo": {"local_timestamp": 2000, "remote_timestamp": 2000},
+        }
+        self.index = OverlayIndex(self.base)
+
+    def test_get(self):
+        assert self.index["foo"] == {"local_timestamp": 2000, "remote_timestamp": 2000}
+        assert self.index.get("baz") is None
+        assert len(self.index) == 2
+
+    def test_set(self):
+        self.index["foo"] = {"local_timestamp": 3000, "remote_timestamp": 3000}
+        self.index["baz"] = {"local_timestamp": 4000, "remote_timestamp": 4000}
+
+        assert self.index["foo"]["local_timestamp"] == 3000
+        assert list(self.index) == ["bar", "baz", "foo"]
+        assert len(self.index) == 3
+        # the base index is never changed
+        assert self.base["foo"]["local_timestamp"] == 2000
+
+    def test_delete(self):
+        del self.index["bar"]
+
+        assert "bar" not in self.index
+        assert list(self.index.items()) == [
+            ("foo", {"local_timestamp": 2000, "remote_timestamp": 2000})
+        ]
+        assert len(self.index) == 1
+        with pytest.raises(KeyError):
+            del self.index["bar"]
+
+        self.index["bar"] = {"local_timestamp": 5000, "remote_timestamp": 5000}
+        assert len(self.index) == 2
+
+    def test_iter_items_snapshot(self):
+        items = self.index.iter_items()
+        self.index["baz"] = {"local_timestamp": 4000, "remote_timestamp": 4000}
+        assert [key for key, _ in items] == ["bar", "foo"]
+
+    def test_iter_items_prefix(self):
+        self.index["bar/baz"] = {"local_timestamp": 4000, "remote_timestamp": 4000}
+        del self.index["bar"]
+        assert [key for key, _ in self.index.iter_items("bar")] == ["bar/baz"]
+        assert [key for key, _ in self.index.iter_items("f")] == ["foo"]
+
+
+def test_iter_sorted_items():
+    assert list(iter_sorted_items({"b": 1, "a": 2})) == [("a", 2), ("b", 1)]
+
+
+def test_iter_sorted_items_prefix():
+    index = {"b/c": 1, "a": 2, "b/a": 3}
+    assert list(iter_sorted_items(index, "b/")) == [("b/a", 3), ("b/c", 1)]
+
+
+def test_find_keys_under():
+    index = {"b/c": 1, "a": 2, "b/a": 3, "b/d/e": 4, "c/a": 5}
+    expected = {"b/": ["b/a", "b/c", "b/d/e"], "b/d/": ["b/d/e"], "x/": []}
+    assert find_keys_under(index, ["b/", "b/d/", "x/"]) == expected
+    assert find_keys_under(OverlayIndex(index), ["b/", "b/d/", "x/"]) == expected
+    assert find_keys_under(index, []) == {}
+
+
+def test_write_json_index():
+    fp = io.StringIO()
+    write_json_index(fp, [("a", {"local_timestamp": 4000}), ("b", {})])
+    assert json.loads(fp.getvalue()) == {"a": {"local_timestamp": 4000}, "b": {}}
+
+    fp = io.StringIO()
+    write_json_index(fp, [])
+    assert json.loads(fp.getvalue()) == {}
+
+
+def test_index_file_names():
+    for name in [
+        LocalSyncClient.SQLITE_INDEX_FILE_NAME,
+        LocalSyncClient.JOURNAL_FILE_NAME,
+        S3SyncClient.DELTA_DIRECTORY,
+        sharded.MANIFEST_FILE_NAME,
+        sharded.SHARD_DIRECTORY,
+    ]:
+        assert name in INDEX_FILE_NAMES
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+import mock
+
+from s4.index import journal
+
+
+class TestIndexJournal(object):
+    def setup_method(self):
+        self.target_folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.target_folder, ".index.journal")
+
+    def teardown_method(self):
+        shutil.rmtree(self.target_folder)
+
+    def test_replay(self):
+        index_journal = journal.IndexJournal(self.path)
+        index_journal.append("foo", {"local_timestamp": 4000})
+        index_journal.append("bar", {"local_timestamp": 5000})
+        index_journal.append("foo", {"local_timestamp": 6000})
+        index_journal.append("bar", None)
+        index_journal.close()
+
+        index = {"baz": {"local_timestamp": 3000}}
+        assert journal.replay_journal(self.path, index) == 4
+        assert index == {
+            "baz": {"local_timestamp": 3000},
+            "foo": {"local_timestamp": 6000},
+        }
+
+    def test_replay_missing(self):
+        index = {}
+        assert journal.replay_journal(self.path, index) == 0
+        assert index == {}
+
+    def test_replay_torn_record(self):
+        index_journal = journal.IndexJournal(self.path)
+        index_journal.append("foo", {"local_timestamp": 4000})
+        index_journal.close()
+        with open(self.path, "ab") as fp:
+            fp.write(b'["bar", {"local_ti')
+
+        index = {}
+        assert journal.replay_journal(self.path, index) == 1
+        assert index == {"foo": {"local_timestamp": 4000}}
+
+    def test_append_after_torn_record(self):
+        index_journal = journal.IndexJournal(self.path)
+        index_journal.append("foo", {"local_timestamp": 4000})
+        index_journal.close()
+        with open(self.path, "ab") as fp:
+            fp.write(b'["bar", {"local_ti')
+
+        index_journal = journal.IndexJournal(self.path)
+        index_journal.append("bar", {"local_timestamp": 5000})
+        index_journal.append("baz", {"local_timestamp": 6000})
+        index_journal.close()
+
+        index = {}
+        assert journal.replay_journal(self.path, index) == 3
+        assert index == {
+            "foo": {"local_timestamp": 4000},
+            "bar": {"local_timestamp": 5000},
+            "baz": {"local_timestamp": 6000},
+        }
+
+    def test_replay_skips_merged_record(self):
+        # written by older versions which appended straight after a torn record
+        with open(self.path, "wb") as fp:
+            fp.write(b'["foo", {"local_timestamp": 4000}]\n')
+            fp.write(b'["bar", {"local_ti["baz", {"local_timestamp": 5000}]\n')
+            fp.write(b'["qux", {"local_timestamp": 6000}]\n')
+
+        index = {}
+        assert journal.replay_journal(self.path, index) == 2
+        assert index == {
+            "foo": {"local_timestamp": 4000},
+            "qux": {"local_timestamp": 6000},
+        }
+
+    def test_torn_record_without_newline(self):
+        with open(self.path, "wb") as fp:
+            fp.write(b'["bar", {"local_ti')
+
+        index_journal = journal.IndexJournal(self.path)
+        assert index_journal.size() == 0
+        index_journal.append("bar", {"local_timestamp": 5000})
+        index_journal.close()
+
+        index = {}
+        assert journal.replay_journal(self.path, index) == 1
+        assert index == {"bar": {"local_timestamp": 5000}}
+
+    def test_sync_in_batches(self, monkeypatch):
+        monkeypatch.setattr(journal, "SYNC_RECORDS", 3)
+        monkeypatch.setattr(journal, "SYNC_INTERVAL", 60)
+
+        index_journal = journal.IndexJournal(self.path)
+        with mock.patch("os.fsync") as fsync:
+            for key in ("a", "b"):
+                index_journal.append(key, {"local_timestamp": 4000})
+            assert fsync.call_count == 0
+
+            index_journal.append("c", {"local_timestamp": 4000})
+            assert fsync.call_count == 1
+
+            # records which are synced can be read back straight away
+            index = {}
+            assert journal.replay_journal(self.path, index) == 3
+
+            index_journal.close()
+            assert fsync.call_count == 1
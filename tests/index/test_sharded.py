@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from s4.index import sharded
+
+
+def test_get_shard_name():
+    assert sharded.get_shard_name("foo/bar/baz") == "foo"
+    assert sharded.get_shard_name("foo") == ""
+
+
+@pytest.mark.parametrize("codec", ["gzip", "none", "lzma:1"])
+def test_encode_shard(codec):
+    items = [("foo/bar", {"local_timestamp": 4000}), ("foo/baz", {})]
+    data = sharded.encode_shard(items, codec)
+    assert sharded.decode_shard(data) == dict(items)
+
+
+def test_decode_manifest():
+    assert sharded.decode_manifest(sharded.encode_manifest({"foo": 2})) == {"foo": 2}
+
+    with pytest.raises(ValueError):
+        sharded.decode_manifest(b'{"version": 1000, "shards": {}}')
+
+
+class TestShardedIndex(object):
+    def setup_method(self):
+        self.stored = {
+            "": {"readme": {"local_timestamp": 1000}},
+            "fruit": {
+                "fruit/apple": {"local_timestamp": 2000},
+                "fruit/banana": {"local_timestamp": 3000},
+            },
+            "vegetables": {"vegetables/carrot": {"local_timestamp": 4000}},
+        }
+        self.read = []
+        self.index = sharded.ShardedIndex(
+            self.read_shard, {name: len(shard) for name, shard in self.stored.items()}
+        )
+
+    def read_shard(self, name):
+        self.read.append(name)
+        return dict(self.stored[name])
+
+    def test_lazy_loading(self):
+        assert len(self.index) == 4
+        assert self.index["fruit/apple"] == {"local_timestamp": 2000}
+        assert "fruit/cherry" not in self.index
+        assert "meat/beef" not in self.index
+        assert self.read == ["fruit"]
+
+    def test_set(self):
+        self.index["fruit/cherry"] = {"local_timestamp": 5000}
+        self.index["meat/beef"] = {"local_timestamp": 6000}
+        assert len(self.index) == 6
+        assert self.index.dirty == {"fruit", "meat"}
+        assert self.read == ["fruit"]
+
+    def test_delete(self):
+        del self.index["vegetables/carrot"]
+        assert "vegetables/carrot" not in self.index
+        assert len(self.index) == 3
+
+        with pytest.raises(KeyError):
+            del self.index["meat/beef"]
+
+    def test_iter_items(self):
+        assert [key for key, _ in self.index.iter_items()] == [
+            "fruit/apple",
+            "fruit/banana",
+            "readme",
+            "vegetables/carrot",
+        ]
+        assert [key for key, _ in self.index.iter_items("fruit/b")] == ["fruit/banana"]
+        assert [key for key, _ in self.index.iter_items("re")] == ["readme"]
+
+    def test_iter_items_prefix_reads_shard(self):
+        list(self.index.iter_items("fruit/"))
+        assert self.read == ["fruit"]
+
+    def test_dirty_shards(self):
+        self.index["fruit/cherry"] = {"local_timestamp": 5000}
+        del self.index["vegetables/carrot"]
+
+        dirty = self.index.get_dirty_shards()
+        assert dirty == [
+            (
+                "fruit",
+                [
+                    ("fruit/apple", {"local_timestamp": 2000}),
+                    ("fruit/banana", {"local_timestamp": 3000}),
+                    ("fruit/cherry", {"local_timestamp": 5000}),
+                ],
+            ),
+            ("vegetables", None),
+        ]
+
+        self.index.mark_clean(name for name, _ in dirty)
+        assert self.index.dirty == set()
+        assert self.index.counts == {"": 1, "fruit": 3}
+
+    def test_from_items(self):
+        index = sharded.ShardedIndex.from_items(
+            [("readme", {}), ("fruit/apple", {"local_timestamp": 2000})]
+        )
+        assert index.dirty == {"", "fruit"}
+        assert dict(index.items()) == {
+            "readme": {},
+            "fruit/apple": {"local_timestamp": 2000},
+        }
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from s4.index import sqlite
+
+
+class TestSQLiteIndex(object):
+    def setup_method(self):
+        self.target_folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.target_folder, ".index.sqlite")
+        self.index = sqlite.SQLiteIndex(self.path)
+
+    def teardown_method(self):
+        self.index.close()
+        shutil.rmtree(self.target_folder)
+
+    def test_empty(self):
+        assert len(self.index) == 0
+        assert list(self.index) == []
+        assert "foo" not in self.index
+        with pytest.raises(KeyError):
+            self.index["foo"]
+
+    def test_set(self):
+        self.index["foo"] = {"local_timestamp": 4000, "remote_timestamp": None}
+        self.index["bar"] = {
+            "local_timestamp": 5000.5,
+            "remote_timestamp": 5000,
+            "content_hash": "5d41402abc4b2a76b9719d911017c592",
+        }
+        self.index["foo"] = {"local_timestamp": 6000, "remote_timestamp": 6000}
+
+        assert len(self.index) == 2
+        assert self.index["foo"] == {"local_timestamp": 6000, "remote_timestamp": 6000}
+        assert self.index["bar"]["content_hash"] == "5d41402abc4b2a76b9719d911017c592"
+
+        # changes are written straight away
+        other = sqlite.SQLiteIndex(self.path)
+        assert dict(other.items()) == dict(self.index.items())
+        other.close()
+
+    def test_delete(self):
+        self.index["foo"] = {"local_timestamp": 4000}
+        del self.index["foo"]
+        assert "foo" not in self.index
+
+        with pytest.raises(KeyError):
+            del self.index["foo"]
+
+    def test_iter_items(self, monkeypatch):
+        monkeypatch.setattr(sqlite, "PAGE_SIZE", 3)
+        keys = ["dir{}/file{}".format(i // 5, i % 5) for i in range(20)]
+        self.index.replace((key, {"remote_timestamp": 4000}) for key in keys)
+
+        assert list(self.index) == keys
+        assert [key for key, _ in self.index.iter_items("dir2/")] == keys[10:15]
+        assert list(self.index.iter_items("dir9/")) == []
+
+    def test_replace(self):
+        self.index["foo"] = {"local_timestamp": 4000}
+        self.index.replace([("bar", {"local_timestamp": 5000})])
+        assert list(self.index.items()) == [
+            ("bar", {"local_timestamp": 5000, "remote_timestamp": None})
+        ]
+
+    def test_replace_error(self):
+        def items():
+            yield "bar", {"local_timestamp": 5000}
+            raise ValueError("something went wrong")
+
+        self.index["foo"] = {"local_timestamp": 4000}
+        with pytest.raises(ValueError):
+            self.index.replace(items())
+
+        assert list(self.index) == ["foo"]
@@ -34,3 +34,178 @@ class TestINotifyRecursive(object):
 
         assert events[2].name == "bong"
         assert result_2[events[2].wd] == str(baz)
+
+    @pytest.mark.timeout(5)
+    def test_event_keys(self, tmpdir):
+        foo = tmpdir.mkdir("foo")
+        foo.mkdir("bar")
+
+        notifier = INotifyRecursive()
+        notifier.add_watches(str(foo), flags.CREATE)
+        foo.join("bar", "hello.txt").write("hello")
+
+        events = notifier.read()
+        assert len(events) == 1
+        assert events[0].root == str(foo)
+        assert events[0].key == "bar/hello.txt"
+        assert events[0].source is None
+
+    @pytest.mark.timeout(5)
+    def test_new_directories_are_watched(self, tmpdir):
+        foo = tmpdir.mkdir("foo")
+
+        notifier = INotifyRecursive()
+        notifier.add_watches(str(foo), flags.CREATE)
+        foo.mkdir("bar")
+
+        events = notifier.read()
+        assert [event.key for event in events] == ["bar"]
+        assert sorted(notifier.watch_paths.values()) == [
+            str(foo),
+            str(foo.join("bar")),
+        ]
+
+        foo.join("bar", "hello.txt").write("hello")
+        events = notifier.read()
+        assert [event.key for event in events] == ["bar/hello.txt"]
+
+    @pytest.mark.timeout(5)
+    def test_deleted_directories_are_not_watched(self, tmpdir):
+        foo = tmpdir.mkdir("foo")
+        bar = foo.mkdir("bar")
+        bar.mkdir("baz")
+
+        notifier = INotifyRecursive()
+        notifier.add_watches(str(foo), flags.CREATE | flags.DELETE)
+        assert len(notifier.watch_paths) == 3
+
+        bar.remove()
+
+        events = notifier.read()
+        assert ("bar", flags.DELETE) in [
+            (event.key, event.mask & flags.DELETE) for event in events
+        ]
+        assert list(notifier.watch_paths.values()) == [str(foo)]
+
+    @pytest.mark.timeout(5)
+    def test_moves_are_paired(self, tmpdir):
+        foo = tmpdir.mkdir("foo")
+        bar = foo.mkdir("bar")
+        bar.join("hello.txt").write("hello")
+
+        notifier = INotifyRecursive()
+        notifier.add_watches(str(foo), flags.MOVED_FROM | flags.MOVED_TO)
+        bar.join("hello.txt").rename(foo.join("world.txt"))
+        bar.rename(foo.join("baz"))
+
+        events = notifier.read()
+        assert [(event.source, event.key) for event in events] == [
+            ("bar/hello.txt", "world.txt"),
+            ("bar", "baz"),
+        ]
+        assert all(event.mask & flags.MOVED_TO for event in events)
+
+        # the watches follow the directory
+        foo.join("baz", "owl.txt").write("hoot")
+        foo.join("baz", "owl.txt").rename(foo.join("baz", "fennek.txt"))
+        events = notifier.read()
+        assert [(event.source, event.key) for event in events] == [
+            ("baz/owl.txt", "baz/fennek.txt")
+        ]
+
+    @pytest.mark.timeout(5)
+    def test_moved_out_of_tree(self, tmpdir):
+        foo = tmpdir.mkdir("foo")
+        foo.mkdir("bar")
+
+        notifier = INotifyRecursive()
+        notifier.add_watches(str(foo), flags.MOVED_FROM | flags.MOVED_TO)
+        foo.join("bar").rename(tmpdir.join("bar"))
+
+        events = notifier.read()
+        assert [(event.source, event.key) for event in events] == [(None, "bar")]
+        assert events[0].mask & flags.MOVED_FROM
+        assert list(notifier.watch_paths.values()) == [str(foo)]
+
+    @pytest.mark.timeout(5)
+    def test_ignored_directories(self, tmpdir):
+        foo = tmpdir.mkdir("foo")
+        foo.mkdir("node_modules").mkdir("left-pad")
+        foo.mkdir("src")
+
+        def ignore(key):
+            return key.split("/")[0] == "node_modules" or key.endswith(".pyc")
+
+        notifier = INotifyRecursive()
+        result = notifier.add_watches(str(foo), flags.CREATE, ignore=ignore)
+        assert sorted(result.values()) == [str(foo), str(foo.join("src"))]
+
+        foo.join("src", "main.pyc").write("")
+        foo.join("src", "main.py").write("")
+        foo.join("node_modules", "index.js").write("")
+        foo.mkdir("node_modules2").mkdir("bar")
+        foo.join("node_modules2", "bar", "index.js").write("")
+        foo.join("node_modules").mkdir("is-odd")
+
+        events = notifier.read()
+        keys = [event.key for event in events]
+        assert keys[:2] == ["src/main.py", "node_modules2"]
+        assert "node_modules/is-odd" not in keys
+        assert str(foo.join("node_modules", "is-odd")) not in (
+            notifier.watch_paths.values()
+        )
+
+    @pytest.mark.timeout(5)
+    def test_moved_into_ignored_directory(self, tmpdir):
+        foo = tmpdir.mkdir("foo")
+        foo.mkdir("build")
+        foo.mkdir("src").mkdir("lib")
+
+        def ignore(key):
+            return key.split("/")[0] == "build"
+
+        notifier = INotifyRecursive()
+        notifier.add_watches(str(foo), flags.MOVED_FROM | flags.MOVED_TO, ignore=ignore)
+        foo.join("src", "lib").rename(foo.join("build", "lib"))
+
+        events = notifier.read()
+        assert [(event.source, event.key) for event in events] == [(None, "src/lib")]
+        assert events[0].mask & flags.MOVED_FROM
+        assert sorted(notifier.watch_paths.values()) == [
+            str(foo),
+            str(foo.join("src")),
+        ]
+
+        # and back out again
+        foo.join("build", "lib").rename(foo.join("lib"))
+        events = notifier.read()
+        assert [(event.source, event.key) for event in events] == [(None, "lib")]
+        assert str(foo.join("lib")) in notifier.watch_paths.values()
+
+    @pytest.mark.timeout(5)
+    def test_update_watches(self, tmpdir):
+        foo = tmpdir.mkdir("foo")
+        foo.mkdir("build")
+        foo.mkdir("src")
+
+        notifier = INotifyRecursive()
+        watches = notifier.add_watches(str(foo), flags.CREATE)
+
+        notifier.update_watches(str(foo), ignore=lambda key: key == "src")
+        assert sorted(notifier.watch_paths.values()) == [
+            str(foo),
+            str(foo.join("build")),
+        ]
+
+        notifier.update_watches(str(foo), ignore=lambda key: key == "build")
+        assert sorted(notifier.watch_paths.values()) == [
+            str(foo),
+            str(foo.join("src")),
+        ]
+
+        # directories which stay watched keep their watch
+        foo_wd = {path: wd for wd, path in notifier.watch_paths.items()}[str(foo)]
+        assert foo_wd in watches
+        foo.join("hello.txt").write("hello")
+        foo.join("build", "ignored.txt").write("hello")
+        assert [event.key for event in notifier.read()] == ["hello.txt"]
@@ -39,6 +39,20 @@ class TestResolution(object):
         )
         assert repr(resolution) == expected_repr
 
+    def test_repr_move(self):
+        s3_client = s3.S3SyncClient(None, "mortybucket", "dimensional/portals")
+        local_client = local.LocalSyncClient("/home/picklerick")
+        resolution = Resolution(
+            Resolution.MOVE, s3_client, local_client, "foo", 20023, source_key="bar"
+        )
+        expected_repr = (
+            "Resolution<action=MOVE, "
+            "to=s3://mortybucket/dimensional/portals/, "
+            "from=/home/picklerick/, "
+            "key=foo, timestamp=20023, source_key=bar>"
+        )
+        assert repr(resolution) == expected_repr
+
     @pytest.mark.parametrize(
         ["state", "action"],
         [
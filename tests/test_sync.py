@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import time
+
 import mock
 import pytest
 
 from s4 import sync
 from s4.clients import SyncState, local, s3
+from s4.progressbar import ProgressBar
 from s4.sync import Resolution
 
 from tests import utils
@@ -15,6 +22,117 @@ class TestGetStates(object):
         actual_output = list(worker.get_states())
         assert actual_output == []
 
+    def test_sorted_merge(self, s3_client, local_client):
+        utils.set_local_contents(local_client, "a/b", timestamp=1000)
+        utils.set_local_contents(local_client, "a.txt", timestamp=2000)
+        utils.set_s3_contents(s3_client, "a-c", timestamp=3000)
+        utils.set_s3_contents(s3_client, "a.txt", timestamp=4000)
+        utils.set_local_index(
+            local_client, {"0": {"local_timestamp": 500, "remote_timestamp": 500}}
+        )
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        actual_output = list(worker.get_states())
+
+        DOES_NOT_EXIST = SyncState(SyncState.DOESNOTEXIST, None, None)
+        assert actual_output == [
+            ("0", SyncState(SyncState.DELETED, None, 500), DOES_NOT_EXIST),
+            ("a-c", DOES_NOT_EXIST, SyncState(SyncState.CREATED, 3000, None)),
+            (
+                "a.txt",
+                SyncState(SyncState.CREATED, 2000, None),
+                SyncState(SyncState.CREATED, 4000, None),
+            ),
+            ("a/b", SyncState(SyncState.CREATED, 1000, None), DOES_NOT_EXIST),
+        ]
+
+    def test_specific_keys(self, s3_client, local_client):
+        utils.set_local_contents(local_client, "foo", timestamp=1000)
+        utils.set_local_contents(local_client, "bar", timestamp=2000)
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        actual_output = list(worker.get_states(keys=["foo", "baz"]))
+
+        DOES_NOT_EXIST = SyncState(SyncState.DOESNOTEXIST, None, None)
+        assert actual_output == [
+            ("foo", SyncState(SyncState.CREATED, 1000, None), DOES_NOT_EXIST),
+            ("baz", DOES_NOT_EXIST, DOES_NOT_EXIST),
+        ]
+
+    def test_specific_keys_are_not_listed(self, s3_client, local_client):
+        utils.set_local_contents(local_client, "foo", timestamp=1000)
+        utils.set_s3_contents(s3_client, "bar", timestamp=2000)
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        with mock.patch.object(local_client, "scan") as scan, mock.patch.object(
+            s3_client.boto, "get_paginator"
+        ) as get_paginator, mock.patch.object(
+            s3_client.boto, "head_object", wraps=s3_client.boto.head_object
+        ) as head_object:
+            actual_output = list(worker.get_states(keys=["foo", "bar"]))
+
+        assert scan.call_count == 0
+        assert get_paginator.call_count == 0
+        assert head_object.call_count == 2
+
+        DOES_NOT_EXIST = SyncState(SyncState.DOESNOTEXIST, None, None)
+        assert actual_output == [
+            ("foo", SyncState(SyncState.CREATED, 1000, None), DOES_NOT_EXIST),
+            ("bar", DOES_NOT_EXIST, SyncState(SyncState.CREATED, 2000, None)),
+        ]
+
+    def test_specific_directory_keys(self, s3_client, local_client):
+        utils.set_local_contents(local_client, "colors/red", timestamp=1000)
+        utils.set_local_contents(local_client, "colors/dark/blue", timestamp=2000)
+        utils.set_local_contents(local_client, "shapes/square", timestamp=3000)
+        utils.set_local_index(
+            local_client,
+            {
+                "gone/circle": {"local_timestamp": 500, "remote_timestamp": 500},
+                "shapes/square": {"local_timestamp": 3000, "remote_timestamp": 3000},
+            },
+        )
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        actual_output = list(worker.get_states(keys=["colors/", "gone"]))
+
+        DOES_NOT_EXIST = SyncState(SyncState.DOESNOTEXIST, None, None)
+        assert actual_output == [
+            ("colors", DOES_NOT_EXIST, DOES_NOT_EXIST),
+            (
+                "colors/dark/blue",
+                SyncState(SyncState.CREATED, 2000, None),
+                DOES_NOT_EXIST,
+            ),
+            ("colors/red", SyncState(SyncState.CREATED, 1000, None), DOES_NOT_EXIST),
+            ("gone", DOES_NOT_EXIST, DOES_NOT_EXIST),
+            ("gone/circle", SyncState(SyncState.DELETED, None, 500), DOES_NOT_EXIST),
+        ]
+
+    def test_specific_file_keys_do_not_scan_index(self, s3_client, local_client):
+        class LookupOnlyIndex(dict):
+            def __iter__(self):
+                raise AssertionError("the index was scanned")
+
+            def items(self):
+                raise AssertionError("the index was scanned")
+
+        utils.set_local_contents(local_client, "foo", timestamp=2000)
+        entry = {"local_timestamp": 1000, "remote_timestamp": 1000}
+        local_client.index = LookupOnlyIndex(foo=entry, bar=entry)
+        s3_client.index = LookupOnlyIndex(foo=entry, bar=entry)
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        assert worker.expand_keys(["foo", "bar"]) == ["foo", "bar"]
+
+    def test_specific_ignored_keys(self, s3_client, local_client):
+        utils.set_local_contents(local_client, ".syncignore", data="*.tmp\n")
+        local_client.reload_ignore_files()
+        utils.set_local_contents(local_client, "foo.tmp", timestamp=1000)
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        assert list(worker.get_states(keys=["foo.tmp"])) == []
+
 
 class TestGetSyncStates(object):
     def test_empty(self, local_client, s3_client):
@@ -249,6 +367,66 @@ class TestIntegrations(object):
         expected_keys = ["colors/green", "colors/blue", "colors/cream"]
         assert_local_keys(clients, expected_keys)
 
+    def test_concurrent_sync(self, local_client, s3_client):
+        utils.set_s3_contents(s3_client, "colors/cream", 9999, "#ddeeff")
+
+        utils.set_local_contents(local_client, "colors/red", 5000, "#ff0000")
+        utils.set_local_contents(local_client, "colors/green", 3000, "#00ff00")
+        utils.set_local_contents(local_client, "colors/blue", 2000, "#0000ff")
+
+        worker = sync.SyncWorker(local_client, s3_client, jobs=4)
+        worker.sync()
+
+        clients = [local_client, s3_client]
+        expected_keys = ["colors/red", "colors/green", "colors/blue", "colors/cream"]
+        assert_local_keys(clients, expected_keys)
+        assert_contents(clients, "colors/red", b"#ff0000")
+        assert_contents(clients, "colors/cream", b"#ddeeff")
+        assert_remote_timestamp(clients, "colors/red", 5000)
+        assert_remote_timestamp(clients, "colors/cream", 9999)
+
+        utils.delete_local(local_client, "colors/red")
+
+        worker.sync()
+        expected_keys = ["colors/green", "colors/blue", "colors/cream"]
+        assert_local_keys(clients, expected_keys)
+
+    def test_warm_sync_without_flush(self, local_client, s3_client):
+        utils.set_local_contents(local_client, "colors/red", 5000, "#ff0000")
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        worker.sync()
+
+        # later sessions reuse the listing and indexes held by the clients
+        utils.set_local_contents(local_client, "colors/green", 3000, "#00ff00")
+        with mock.patch.object(
+            s3_client.boto, "get_paginator", wraps=s3_client.boto.get_paginator
+        ) as get_paginator:
+            worker.sync(refresh=False, flush=False)
+        assert get_paginator.call_count == 0
+
+        clients = [local_client, s3_client]
+        assert_contents(clients, "colors/green", b"#00ff00")
+        assert s3_client.index["colors/green"]["local_timestamp"] is not None
+
+        with mock.patch.object(s3_client, "flush_index") as flush_index:
+            worker.sync(refresh=False, flush=False)
+        assert flush_index.call_count == 0
+
+        worker.flush_index()
+        s3_client.reload_index()
+        assert_remote_timestamp(clients, "colors/green", 3000)
+
+    def test_sync_specific_keys(self, local_client, s3_client):
+        utils.set_local_contents(local_client, "colors/red", 5000, "#ff0000")
+        utils.set_local_contents(local_client, "colors/green", 3000, "#00ff00")
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        worker.sync(keys=["colors/red"])
+
+        assert s3_client.get_local_keys() == ["colors/red"]
+        assert_remote_timestamp([local_client, s3_client], "colors/red", 5000)
+
     def test_fresh_sync(self, local_client, s3_client):
         utils.set_local_contents(local_client, "foo", timestamp=1000)
         utils.set_local_contents(local_client, "bar", timestamp=2000)
@@ -402,6 +580,394 @@ class TestIntegrations(object):
         assert_remote_timestamp(clients, "foo", 7000)
 
 
+class TestPipeline(object):
+    def test_transfers_start_before_planning_finishes(self, local_client, s3_client):
+        utils.set_local_contents(local_client, "bar", timestamp=2000)
+        utils.set_local_contents(local_client, "foo", timestamp=1000)
+        worker = sync.SyncWorker(local_client, s3_client)
+
+        uploaded_while_planning = []
+
+        def get_states(keys=None):
+            does_not_exist = SyncState(SyncState.DOESNOTEXIST, None, None)
+            yield "bar", SyncState(SyncState.CREATED, 2000, None), does_not_exist
+            uploaded_while_planning.append(s3_client.get("bar") is not None)
+            yield "foo", SyncState(SyncState.CREATED, 1000, None), does_not_exist
+
+        worker.get_states = get_states
+        worker.sync()
+
+        assert uploaded_while_planning == [True]
+        assert_local_keys([s3_client], ["bar", "foo"])
+
+    def test_conflicts_are_handled_last(self, local_client, s3_client):
+        utils.set_local_contents(local_client, "apple", timestamp=2000)
+        utils.set_s3_contents(s3_client, "apple", timestamp=3000)
+        utils.set_local_contents(local_client, "banana", timestamp=1000)
+
+        events = []
+
+        def conflict_handler(key, action_1, client_1, action_2, client_2):
+            events.append(("conflict", key))
+            return Resolution.get_resolution(key, action_1, client_2, client_1)
+
+        def action_callback(resolution):
+            events.append(("action", resolution.key))
+
+        worker = sync.SyncWorker(
+            local_client,
+            s3_client,
+            conflict_handler=conflict_handler,
+            action_callback=action_callback,
+        )
+        worker.sync()
+
+        assert events == [
+            ("action", "banana"),
+            ("conflict", "apple"),
+            ("action", "apple"),
+        ]
+        assert_remote_timestamp([local_client, s3_client], "apple", 2000)
+
+    def test_no_head_requests_after_download(self, local_client, s3_client):
+        keys = ["file{:02d}".format(i) for i in range(50)]
+        for key in keys:
+            utils.set_s3_contents(s3_client, key, timestamp=1000)
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        with mock.patch.object(
+            s3_client.boto, "get_paginator", wraps=s3_client.boto.get_paginator
+        ) as get_paginator, mock.patch.object(
+            s3_client.boto, "head_object", wraps=s3_client.boto.head_object
+        ) as head_object:
+            worker.sync()
+
+        assert get_paginator.call_count == 1
+        assert head_object.call_count == 0
+        assert sorted(local_client.get_local_keys()) == keys
+        assert s3_client.get_index_local_timestamp("file00") == 1000
+
+    @pytest.mark.parametrize("jobs", [1, 4])
+    def test_conflict_handler_error(self, local_client, s3_client, jobs):
+        keys = ["file{}".format(i) for i in range(5)]
+        for key in keys:
+            utils.set_local_contents(local_client, key, timestamp=1000)
+        utils.set_local_contents(local_client, "zoo", timestamp=2000)
+        utils.set_s3_contents(s3_client, "zoo", timestamp=3000)
+
+        def conflict_handler(key, action_1, client_1, action_2, client_2):
+            raise EOFError()
+
+        worker = sync.SyncWorker(
+            local_client, s3_client, conflict_handler=conflict_handler, jobs=jobs
+        )
+        with pytest.raises(EOFError):
+            worker.sync()
+
+        # the files which were uploaded before the error were indexed
+        worker = sync.SyncWorker(
+            local.LocalSyncClient(local_client.path),
+            s3.S3SyncClient(s3_client.boto, s3_client.bucket, s3_client.prefix),
+        )
+        resolutions, unhandled_events = worker.get_sync_states()
+        assert resolutions == {}
+        assert sorted(unhandled_events.keys()) == ["zoo"]
+
+
+class TestCheckpoints(object):
+    def test_crash_recovery(self, local_client, s3_client):
+        keys = ["file{}".format(i) for i in range(5)]
+        for key in keys:
+            utils.set_local_contents(local_client, key, timestamp=1000)
+
+        recovered = []
+
+        def action_callback(resolution):
+            # what a new process would see if this one crashed right now
+            if resolution.key == "file4":
+                worker = sync.SyncWorker(
+                    local.LocalSyncClient(local_client.path),
+                    s3.S3SyncClient(s3_client.boto, s3_client.bucket, s3_client.prefix),
+                )
+                recovered.append(worker.get_sync_states())
+
+        worker = sync.SyncWorker(
+            local_client, s3_client, action_callback=action_callback
+        )
+        with mock.patch.object(worker, "CHECKPOINT_INTERVAL", 0):
+            worker.sync()
+
+        # the keys synced before the crash are known to both clients
+        [(resolutions, unhandled_events)] = recovered
+        assert unhandled_events == {}
+        assert list(resolutions) == ["file4"]
+        assert resolutions["file4"].action == Resolution.CREATE
+
+    def test_no_checkpoints_without_flush(self, local_client, s3_client):
+        utils.set_local_contents(local_client, "foo", timestamp=1000)
+        utils.set_local_contents(local_client, "bar", timestamp=1000)
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        s3_client.flush_index = mock.MagicMock()
+        with mock.patch.object(worker, "CHECKPOINT_INTERVAL", 0):
+            worker.sync(flush=False)
+
+        assert s3_client.flush_index.call_count == 0
+
+
+class TestContentHash(object):
+    def test_touched_file_is_not_transferred(self, s3_client):
+        folder = tempfile.mkdtemp()
+        try:
+            local_client = local.LocalSyncClient(folder, content_hash=True)
+            utils.set_local_contents(local_client, "foo", timestamp=1000, data="abc")
+            utils.set_local_contents(local_client, "bar", timestamp=1000, data="123")
+
+            worker = sync.SyncWorker(local_client, s3_client)
+            worker.sync()
+
+            utils.set_local_contents(local_client, "foo", timestamp=2000, data="abc")
+            utils.set_local_contents(local_client, "bar", timestamp=2000, data="456")
+
+            resolutions, unhandled_events = worker.get_sync_states()
+            assert unhandled_events == {}
+            assert resolutions == {
+                "foo": Resolution(Resolution.REINDEX, local_client, None, "foo", 2000),
+                "bar": Resolution(
+                    Resolution.UPDATE, s3_client, local_client, "bar", 2000
+                ),
+            }
+
+            s3_client.put = mock.MagicMock(wraps=s3_client.put)
+            worker.sync()
+
+            assert s3_client.put.call_count == 1
+            assert s3_client.put.call_args[0][0] == "bar"
+            assert local_client.get_index_local_timestamp("foo") == 2000
+            assert local_client.get_remote_timestamp("foo") == 1000
+
+            # nothing left to do afterwards
+            assert worker.get_sync_states() == ({}, {})
+        finally:
+            shutil.rmtree(folder)
+
+
+class TestMoveDetection(object):
+    def test_disabled(self, local_client, s3_client):
+        utils.set_local_contents(local_client, "foo", timestamp=1000, data="abc")
+        worker = sync.SyncWorker(local_client, s3_client)
+        worker.sync()
+
+        os.rename(
+            os.path.join(local_client.path, "foo"),
+            os.path.join(local_client.path, "bar"),
+        )
+
+        resolutions, _ = worker.get_sync_states()
+        assert resolutions == {
+            "foo": Resolution(Resolution.DELETE, s3_client, None, "foo", 1000),
+            "bar": Resolution(Resolution.CREATE, s3_client, local_client, "bar", 1000),
+        }
+
+    def test_local_move(self, s3_client):
+        folder = tempfile.mkdtemp()
+        try:
+            local_client = local.LocalSyncClient(folder, content_hash=True)
+            utils.set_local_contents(local_client, "foo/a", timestamp=1000, data="a")
+            utils.set_local_contents(local_client, "foo/b", timestamp=1000, data="b")
+            utils.set_local_contents(local_client, "baz", timestamp=1000, data="c")
+
+            worker = sync.SyncWorker(local_client, s3_client, detect_moves=True)
+            worker.sync()
+
+            os.rename(os.path.join(folder, "foo"), os.path.join(folder, "bar"))
+            utils.set_local_contents(local_client, "new", timestamp=2000, data="d")
+
+            resolutions, unhandled_events = worker.get_sync_states()
+            assert unhandled_events == {}
+            assert resolutions == {
+                "bar/a": Resolution(
+                    Resolution.MOVE,
+                    s3_client,
+                    local_client,
+                    "bar/a",
+                    1000,
+                    source_key="foo/a",
+                ),
+                "bar/b": Resolution(
+                    Resolution.MOVE,
+                    s3_client,
+                    local_client,
+                    "bar/b",
+                    1000,
+                    source_key="foo/b",
+                ),
+                "new": Resolution(
+                    Resolution.CREATE, s3_client, local_client, "new", 2000
+                ),
+            }
+
+            s3_client.put = mock.MagicMock(wraps=s3_client.put)
+            worker.sync()
+
+            assert s3_client.put.call_count == 1
+            assert sorted(s3_client.get_local_keys()) == [
+                "bar/a",
+                "bar/b",
+                "baz",
+                "new",
+            ]
+            assert s3_client.get("bar/b").fp.read() == b"b"
+            assert worker.get_sync_states() == ({}, {})
+        finally:
+            shutil.rmtree(folder)
+
+    def test_remote_move(self, s3_client):
+        folder = tempfile.mkdtemp()
+        try:
+            local_client = local.LocalSyncClient(folder, content_hash=True)
+            utils.set_local_contents(local_client, "foo", timestamp=1000, data="abc")
+
+            worker = sync.SyncWorker(local_client, s3_client, detect_moves=True)
+            worker.sync()
+
+            s3_client.move("foo", "bar")
+            local_client.put = mock.MagicMock(wraps=local_client.put)
+            worker.sync()
+
+            assert local_client.put.call_count == 0
+            assert local_client.get_local_keys() == ["bar"]
+            assert utils.get_local_contents(local_client, "bar") == b"abc"
+            assert worker.get_sync_states() == ({}, {})
+        finally:
+            shutil.rmtree(folder)
+
+    def test_different_contents(self, s3_client):
+        folder = tempfile.mkdtemp()
+        try:
+            local_client = local.LocalSyncClient(folder, content_hash=True)
+            utils.set_local_contents(local_client, "foo", timestamp=1000, data="abc")
+
+            worker = sync.SyncWorker(local_client, s3_client, detect_moves=True)
+            worker.sync()
+
+            utils.delete_local(local_client, "foo")
+            utils.set_local_contents(local_client, "bar", timestamp=2000, data="xyz")
+
+            resolutions, _ = worker.get_sync_states()
+            assert sorted(r.action for r in resolutions.values()) == [
+                Resolution.CREATE,
+                Resolution.DELETE,
+            ]
+        finally:
+            shutil.rmtree(folder)
+
+
+class TestDeleteBatches(object):
+    def test_batched(self, local_client, s3_client):
+        keys = ["file{}".format(i) for i in range(5)]
+        for key in keys:
+            utils.set_local_contents(local_client, key, timestamp=1000)
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        worker.sync()
+        for key in keys:
+            utils.delete_local(local_client, key)
+
+        s3_client.boto.delete_objects = mock.MagicMock(
+            wraps=s3_client.boto.delete_objects
+        )
+        with mock.patch.object(worker, "DELETE_BATCH_SIZE", 2):
+            worker.sync()
+
+        assert s3_client.boto.delete_objects.call_count == 3
+        assert s3_client.get_local_keys() == []
+        assert worker.get_sync_states() == ({}, {})
+
+    @pytest.mark.parametrize("jobs", [1, 4])
+    def test_file_replaced_by_directory(self, local_client, s3_client, jobs):
+        utils.set_s3_contents(s3_client, "x", timestamp=1000, data="file")
+        worker = sync.SyncWorker(local_client, s3_client, jobs=jobs)
+        worker.sync()
+
+        s3_client.boto.delete_object(
+            Bucket=s3_client.bucket, Key=os.path.join(s3_client.prefix, "x")
+        )
+        utils.set_s3_contents(s3_client, "x/y", timestamp=2000, data="directory")
+        s3_client.invalidate_listing()
+        worker.sync()
+
+        assert local_client.get_local_keys() == ["x/y"]
+        assert utils.get_local_contents(local_client, "x/y") == b"directory"
+        assert worker.get_sync_states() == ({}, {})
+
+    def test_batch_runs_before_directory_is_written(self, local_client, s3_client):
+        utils.set_local_contents(local_client, "a", timestamp=1000)
+        utils.set_local_contents(local_client, "x", timestamp=1000)
+        worker = sync.SyncWorker(local_client, s3_client)
+        worker.sync()
+
+        utils.delete_local(local_client, "a")
+        utils.delete_local(local_client, "x")
+        utils.set_local_contents(local_client, "x/y", timestamp=2000)
+
+        calls = []
+        s3_client.delete_many = mock.MagicMock(
+            side_effect=lambda keys: calls.append(("delete", keys)) or {}
+        )
+        s3_client.put = mock.MagicMock(
+            side_effect=lambda key, *args, **kwargs: calls.append(("put", key))
+        )
+        worker.sync()
+
+        assert calls == [("delete", ["a", "x"]), ("put", "x/y")]
+
+    def test_concurrent(self, local_client, s3_client):
+        keys = ["file{}".format(i) for i in range(5)]
+        for key in keys:
+            utils.set_local_contents(local_client, key, timestamp=1000)
+
+        worker = sync.SyncWorker(local_client, s3_client, jobs=4)
+        worker.sync()
+        for key in keys:
+            utils.delete_local(local_client, key)
+
+        with mock.patch.object(worker, "DELETE_BATCH_SIZE", 2):
+            success = worker.run_resolutions(worker.get_sync_states()[0])
+
+        assert sorted(success) == keys
+        assert s3_client.get_local_keys() == []
+
+    def test_failed_keys_are_not_indexed(self, local_client, s3_client):
+        utils.set_local_contents(local_client, "foo", timestamp=1000)
+        utils.set_local_contents(local_client, "bar", timestamp=1000)
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        worker.sync()
+        utils.delete_local(local_client, "foo")
+        utils.delete_local(local_client, "bar")
+
+        s3_client.delete_many = mock.MagicMock(
+            return_value={"foo": "AccessDenied: Access Denied"}
+        )
+        success = worker.run_resolutions(worker.get_sync_states()[0])
+
+        assert success == ["bar"]
+        assert s3_client.delete_many.call_args[0][0] == ["bar", "foo"]
+        assert local_client.get_index_local_timestamp("foo") == 1000
+
+    def test_request_failure(self, local_client, s3_client):
+        utils.set_local_contents(local_client, "foo", timestamp=1000)
+
+        worker = sync.SyncWorker(local_client, s3_client)
+        worker.sync()
+        utils.delete_local(local_client, "foo")
+
+        s3_client.delete_many = mock.MagicMock(side_effect=ValueError("oops"))
+        assert worker.run_resolutions(worker.get_sync_states()[0]) == []
+        assert s3_client.get_local_keys() == ["foo"]
+
+
 class TestRunResolutions(object):
     def test_empty(self, local_client, s3_client):
         worker = sync.SyncWorker(local_client, s3_client)
@@ -431,6 +997,189 @@ class TestRunResolutions(object):
         assert sorted(success) == sorted(["foo", "baz"])
         assert_local_keys(clients, ["baz"])
 
+    def test_concurrent_jobs(self, local_client, s3_client):
+        clients = [local_client, s3_client]
+        worker = sync.SyncWorker(local_client, s3_client, jobs=4)
+
+        keys = ["file{}".format(i) for i in range(20)]
+        resolutions = {}
+        for index, key in enumerate(keys):
+            utils.set_local_contents(local_client, key, timestamp=1000 + index)
+            resolutions[key] = Resolution(
+                Resolution.CREATE, s3_client, local_client, key, 1000 + index
+            )
+
+        success = worker.run_resolutions(resolutions)
+
+        assert success == sorted(keys)
+        assert_local_keys(clients, keys)
+        for index, key in enumerate(keys):
+            assert_remote_timestamp(clients, key, 1000 + index)
+
+    def test_concurrent_jobs_are_bounded(self, local_client, s3_client, monkeypatch):
+        monkeypatch.setattr(sync.SyncWorker, "PENDING_PER_JOB", 2)
+        planned = []
+        worker = sync.SyncWorker(
+            local_client, s3_client, action_callback=planned.append, jobs=2
+        )
+
+        release = threading.Event()
+        move_client = worker.move_client
+
+        def blocked_move_client(resolution):
+            release.wait(5)
+            move_client(resolution)
+
+        worker.move_client = blocked_move_client
+
+        keys = ["file{:02d}".format(i) for i in range(20)]
+        resolutions = {}
+        for key in keys:
+            utils.set_local_contents(local_client, key, timestamp=1000)
+            resolutions[key] = Resolution(
+                Resolution.CREATE, s3_client, local_client, key, 1000
+            )
+
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(worker.run_resolutions(resolutions))
+        )
+        thread.start()
+        try:
+            # planning waits once 4 transfers are queued
+            deadline = time.monotonic() + 5
+            while len(planned) < 5 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.1)
+            assert len(planned) == 5
+        finally:
+            release.set()
+            thread.join()
+
+        assert result == [keys]
+        assert s3_client.get_remote_timestamp("file19") == 1000
+
+    def test_concurrent_jobs_failure(self, local_client, s3_client):
+        worker = sync.SyncWorker(local_client, s3_client, jobs=4)
+
+        utils.set_local_contents(local_client, "foo", timestamp=1000)
+        success = worker.run_resolutions(
+            {
+                "foo": Resolution(
+                    Resolution.CREATE, s3_client, local_client, "foo", 1000
+                ),
+                "bar": Resolution(
+                    Resolution.CREATE, s3_client, local_client, "bar", 2000
+                ),
+            }
+        )
+        assert success == ["foo"]
+        assert s3_client.get_remote_timestamp("foo") == 1000
+        assert "bar" not in s3_client.index
+
+    def test_concurrent_callbacks(self, local_client, s3_client):
+        start_callback = mock.MagicMock()
+        update_callback = mock.MagicMock()
+        complete_callback = mock.MagicMock()
+        worker = sync.SyncWorker(
+            local_client,
+            s3_client,
+            start_callback=start_callback,
+            update_callback=update_callback,
+            complete_callback=complete_callback,
+            jobs=3,
+        )
+
+        resolutions = {}
+        for key in ("red", "green", "blue"):
+            utils.set_local_contents(local_client, key, timestamp=1000, data=key)
+            resolutions[key] = Resolution(
+                Resolution.CREATE, s3_client, local_client, key, 1000
+            )
+
+        worker.run_resolutions(resolutions)
+
+        assert start_callback.call_count == 3
+        assert complete_callback.call_count == 3
+        total = sum(call[0][0] for call in update_callback.call_args_list)
+        assert total == len("red") + len("green") + len("blue")
+
+    def test_concurrent_callbacks_failure(self, local_client, s3_client):
+        start_callback = mock.MagicMock(
+            side_effect=lambda sync_object: ProgressBar.start_transfer(
+                sync_object.total_size, disable=True
+            )
+        )
+        complete_callback = mock.MagicMock(
+            side_effect=lambda sync_object: ProgressBar.finish_transfer()
+        )
+        worker = sync.SyncWorker(
+            local_client,
+            s3_client,
+            start_callback=start_callback,
+            complete_callback=complete_callback,
+            jobs=2,
+        )
+
+        resolutions = {}
+        for key in ("red", "green", "blue"):
+            utils.set_local_contents(local_client, key, timestamp=1000, data=key)
+            resolutions[key] = Resolution(
+                Resolution.CREATE, s3_client, local_client, key, 1000
+            )
+
+        put = s3_client.put
+
+        def failing_put(key, *args, **kwargs):
+            if key == "green":
+                raise IOError("oops")
+            return put(key, *args, **kwargs)
+
+        s3_client.put = failing_put
+        success = worker.run_resolutions(resolutions)
+
+        assert sorted(success) == ["blue", "red"]
+        assert start_callback.call_count == 3
+        assert complete_callback.call_count == 3
+        assert ProgressBar.active == 0
+
+    def test_stop_event(self, local_client, s3_client):
+        stop_event = threading.Event()
+        worker = sync.SyncWorker(
+            local_client,
+            s3_client,
+            start_callback=lambda sync_object: stop_event.set(),
+            stop_event=stop_event,
+        )
+
+        resolutions = {}
+        for key in ("blue", "green", "red"):
+            utils.set_local_contents(local_client, key, timestamp=1000, data=key)
+            resolutions[key] = Resolution(
+                Resolution.CREATE, s3_client, local_client, key, 1000
+            )
+
+        # only the transfer started before the stop is run, and it is indexed
+        assert worker.run_resolutions(resolutions) == ["blue"]
+        assert s3_client.get_remote_timestamp("blue") == 1000
+        assert "green" not in s3_client.index
+        assert "red" not in s3_client.index
+
+    def test_stop_event_skips_queued_transfers(self, local_client, s3_client):
+        stop_event = threading.Event()
+        stop_event.set()
+        worker = sync.SyncWorker(local_client, s3_client, jobs=4, stop_event=stop_event)
+
+        utils.set_local_contents(local_client, "blue", timestamp=1000)
+        resolution = Resolution(
+            Resolution.CREATE, s3_client, local_client, "blue", 1000
+        )
+        assert (
+            worker.run_deferred_function("blue", worker.move_client, resolution)
+            is False
+        )
+        assert "blue" not in s3_client.index
+
 
 class TestMoveClient(object):
     def test_correct_behaviour(self, local_client, s3_client):